@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Offline benchmarks of macro parsing, dispatch and element matching.
+
+Pages are served by FakeDriver, so no browser or network is needed.  Results
+are compared with a saved baseline and the script exits with status 1 if a
+benchmark is slower than baseline by more than the tolerance.
+
+    $ python bench.py            # compare with baseline.json
+    $ python bench.py --save     # record new baseline
+
+Baselines are machine specific, record one on the machine which runs the
+comparison.
+
+Import time is measured in fresh interpreters and checked against fixed
+budgets instead, since tools which only parse macros import the package
+too.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+from fakedriver import FakeDriver
+import macro
+from bridge import Bridge
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Seconds a fresh interpreter may spend on statements, after importing
+# source directory as package seleniumacros
+IMPORT_BUDGETS = [
+    ('import_seleniumacros', 'import seleniumacros', 0.02),
+    ('dispatch', 'import seleniumacros; seleniumacros.dispatch()', 0.06),
+]
+
+IMPORT_SCRIPT = '''
+import imp, sys, time
+started = time.time()
+imp.load_module('seleniumacros', None, %r, ('', '', imp.PKG_DIRECTORY))
+%s
+sys.stdout.write(repr(time.time() - started))
+'''
+
+BENCHMARKS = []
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+def measure(func, repeat=5, min_time=0.2):
+    ''' Return best seconds per call of func '''
+    number = 1
+    while True:
+        started = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - started
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed * 10 > min_time else 10
+    best = elapsed / number
+    for i in xrange(repeat - 1):
+        started = time.time()
+        for i in xrange(number):
+            func()
+        best = min(best, (time.time() - started) / number)
+    return best
+
+def import_time(statement, repeat=5):
+    ''' Return best seconds of statement in a new interpreter '''
+    script = IMPORT_SCRIPT % (os.path.abspath(SOURCE), statement)
+    return min(float(subprocess.check_output([sys.executable, '-c', script]))
+            for i in xrange(repeat))
+
+def links_page(count):
+    links = [u'<li><a href="/links/%d">Link %d</a></li>' % (i, i) for i in xrange(count)]
+    return u'<html><body><ul>%s</ul></body></html>' % u''.join(links)
+
+def form_macro(lines):
+    ''' A long macro filling the form fixture again and again '''
+    commands = [u'VERSION BUILD=7000000', u'URL GOTO=%sform.html' % FakeDriver.BASE_URL]
+    while len(commands) < lines:
+        commands.extend([
+            u"' Fill the form",
+            u'SET !VAR1 user{{!LOOP}}',
+            u'TAG POS=1 TYPE=INPUT:TEXT FORM=NAME:F1 ATTR=NAME:name CONTENT={{!VAR1}}',
+            u'TAG POS=1 TYPE=INPUT:TEXT FORM=NAME:F1 ATTR=NAME:email CONTENT={{!VAR1}}@example.com',
+            u'TAG POS=1 TYPE=TEXTAREA FORM=NAME:F1 ATTR=NAME:about CONTENT="Hello<SP>World"',
+            u'TAG POS=1 TYPE=SELECT FORM=NAME:F1 ATTR=NAME:country CONTENT=%fr',
+            u'TAG POS=1 TYPE=INPUT:CHECKBOX FORM=NAME:F1 ATTR=ID:newsletter CONTENT=YES',
+            u'TAG POS=1 TYPE=INPUT:RADIO FORM=NAME:F1 ATTR=ID:pro CONTENT=YES',
+        ])
+    return u'\n'.join(commands[:lines]) + u'\n'
+
+class Context(object):
+    ''' Shared fixtures of benchmarks '''
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp()
+        self.macro_path = os.path.join(self.directory, 'long.iim')
+        with open(self.macro_path, 'wb') as f:
+            f.write(form_macro(500).encode('utf-8'))
+
+    def bridge(self, pages=None):
+        bridge = Bridge(macro_cache=macro.MacroCache(None))
+        bridge.set_browser(Bridge.FIREFOX)
+        bridge.driver = FakeDriver(pages=pages)
+        bridge.set_builtin_variables({'!REPLAYSPEED': 'FAST'})
+        return bridge
+
+    def close(self):
+        shutil.rmtree(self.directory)
+
+@benchmark
+def parse_value_string(context):
+    bridge = context.bridge()
+    bridge.set_builtin_variables({'!VAR1': 'Hello'})
+    bridge.set_variables({'NAME': 'World'})
+    return lambda: bridge._parse_value_string(u'{{!VAR1}}<SP>and<SP>{{NAME}}')
+
+@benchmark
+def compile_macro_500_lines(context):
+    return lambda: macro.compile_macro(context.macro_path, Bridge.SUPPORTED_COMMANDS)
+
+@benchmark
+def load_cached_macro_500_lines(context):
+    cache = macro.MacroCache(os.path.join(context.directory, 'cache'))
+    cache.load(context.macro_path, Bridge.SUPPORTED_COMMANDS)
+    return lambda: macro.MacroCache(cache.directory).load(context.macro_path,
+            Bridge.SUPPORTED_COMMANDS)
+
+@benchmark
+def execute_script_500_lines(context):
+    bridge = context.bridge()
+    bridge.execute_script(context.macro_path)
+    return lambda: bridge.execute_script(context.macro_path)
+
+@benchmark
+def execute_tag_command_2000_links(context):
+    url = 'http://large/'
+    bridge = context.bridge({url: links_page(2000)})
+    bridge.driver.get(url)
+    args = ('POS=1', 'TYPE=A', 'ATTR=HREF:/links/1999&&TXT:Link 1999')
+    # Only measure matching, clicking would navigate away
+    return lambda: bridge._find_element_by(*bridge._parse_tag_arguments(*args)[:4])
+
+@benchmark
+def execute_tag_command_form(context):
+    bridge = context.bridge()
+    bridge.driver.get(FakeDriver.BASE_URL + 'form.html')
+    args = ('POS=1', 'TYPE=INPUT:TEXT', 'FORM=NAME:F1', 'ATTR=NAME:email',
+            'CONTENT=tom@example.com')
+    return lambda: bridge.execute_tag_command(*args)
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [BENCHMARK...]')
+    parser.add_option('-b', '--baseline', default=BASELINE,
+            help='baseline file [default: %default]')
+    parser.add_option('-s', '--save', action='store_true', default=False,
+            help='save results as new baseline')
+    parser.add_option('-t', '--tolerance', type='float', default=0.5,
+            help='allowed slowdown relative to baseline [default: %default]')
+    options, args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        baseline = json.load(open(options.baseline, 'rb'))
+
+    context = Context()
+    results, regressions = {}, []
+    try:
+        for func in BENCHMARKS:
+            name = func.__name__
+            if args and name not in args:
+                continue
+            seconds = results[name] = measure(func(context))
+            line = '%-36s %12.1f us' % (name, seconds * 1e6)
+            if name in baseline:
+                ratio = seconds / baseline[name]
+                line += '  %5.2fx baseline' % ratio
+                if ratio > 1 + options.tolerance:
+                    regressions.append(name)
+                    line += '  REGRESSION'
+            print line
+    finally:
+        context.close()
+
+    for name, statement, budget in IMPORT_BUDGETS:
+        if args and name not in args:
+            continue
+        seconds = import_time(statement)
+        line = '%-36s %12.1f us  %5.2fx budget' % (name, seconds * 1e6,
+                seconds / budget)
+        if seconds > budget:
+            regressions.append(name)
+            line += '  OVER BUDGET'
+        print line
+
+    if options.save:
+        baseline.update(results)
+        with open(options.baseline, 'wb') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        return 0
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dom
+from selenium.common.exceptions import WebDriverException
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+class FakeDriver(dom.DomDriver):
+    '''
+    In-process driver serving local HTML fixtures.
+
+    Pages under BASE_URL are read from fixtures directory, other pages could
+    be registered in pages by URL.
+
+    >>> driver = FakeDriver()
+    >>> driver.get(FakeDriver.BASE_URL + 'form.html')
+    >>> driver.title
+    u'Form fixture'
+    >>> driver.find_element_by_id('skip').click()
+    >>> driver.find_element_by_id('result').text
+    u'Thank you'
+
+    '''
+
+    BASE_URL = 'http://fixtures/'
+
+    def __init__(self, directory=FIXTURES, pages=None):
+        dom.DomDriver.__init__(self)
+        self.directory = directory
+        self.pages = dict(pages or {})
+        # List of (url, post data) fetched
+        self.requests = []
+
+    def _fetch(self, url, data=None):
+        self.requests.append((url, data))
+        key = url.split('#', 1)[0].split('?', 1)[0]
+        if key in self.pages:
+            return url, self.pages[key]
+        if key.startswith(self.BASE_URL):
+            path = os.path.join(self.directory, key[len(self.BASE_URL):])
+            if os.path.isfile(path):
+                return url, unicode(open(path, 'rb').read(), 'utf-8')
+        raise WebDriverException(u'Page not found: %s' % url)
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
-def dispatch():
-    ''' Start an iMacros interface instance '''
+def dispatch(pool=None, cache_proxy=None):
+    '''
+    Start an iMacros interface instance.
+    Pass a pool.DriverPool to lease warm browsers on iimInit, and a
+    proxy.CachingProxy to route browsers through a local cache.
+    '''
     from interface import Interface
 
-    return Interface()
+    return Interface(pool, cache_proxy=cache_proxy)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Interface whose calls return at once, so that one thread could drive many
+browser sessions.
+
+Calls of every AsyncInterface are queued and played in order by threads of
+an Executor shared by all sessions, so idle sessions hold no threads.
+Results are AsyncResult objects, waited for with get() or handled by
+callbacks.
+
+Commands are sent to drivers synchronously, so a session playing a call
+holds a thread until it returns.  Threads are started as sessions play
+calls, up to max_workers of the executor, beyond which sessions wait for a
+thread, and stopped once idle.
+
+    >>> sessions = [AsyncInterface() for i in range(20)]    # doctest: +SKIP
+    >>> wait([s.iimInit('-cr') for s in sessions])          # doctest: +SKIP
+    >>> results = [s.iimPlay('Search.iim') for s in sessions]   # doctest: +SKIP
+    >>> [result.get() for result in results]                # doctest: +SKIP
+'''
+
+import atexit
+import logging
+import threading
+import collections
+from interface import Interface
+import clock
+
+logger = logging.getLogger('seleniumacros')
+
+# Threads of default executor at most, i.e. sessions playing calls at once
+DEFAULT_WORKERS = 64
+# Seconds an idle thread of executor waits for calls before it stops
+IDLE_TIMEOUT = 60
+
+class AsyncResult(object):
+    '''
+    Result of a call played later.
+
+    >>> result = AsyncResult()
+    >>> result.ready()
+    False
+    >>> result.add_done_callback(lambda r: r.get())
+    >>> result.set_exception(ValueError('Wrong command for iimInit'))
+    >>> result.ready(), result.successful()
+    (True, False)
+    >>> result.get()
+    Traceback (most recent call last):
+    ...
+    ValueError: Wrong command for iimInit
+
+    '''
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.exception = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def ready(self):
+        return self.event.is_set()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError, 'Result is not ready'
+        return self.exception is None
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    def get(self, timeout=None):
+        ''' Return value or raise exception of call, once it is played '''
+        if not self.event.wait(timeout):
+            raise threading.ThreadError, 'Result is not ready'
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def add_done_callback(self, callback):
+        ''' Call callback with this result once it is ready '''
+        with self.lock:
+            if not self.ready():
+                self.callbacks.append(callback)
+                return
+        self._call(callback)
+
+    def set_result(self, value):
+        self.value = value
+        self._finish()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self._finish()
+
+    def _finish(self):
+        with self.lock:
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self._call(callback)
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except Exception, e:
+            logger.exception(e)
+
+def wait(results, timeout=None):
+    ''' Return values of results once all are ready, in the same order '''
+    return [result.get(timeout) for result in results]
+
+class Executor(object):
+    '''
+    Threads playing functions in the order they are submitted, started
+    while functions wait and fewer than max_workers threads run, and
+    stopped after idle_timeout seconds without functions.
+
+    >>> executor = Executor(max_workers=2)
+    >>> gate, done = threading.Event(), []
+    >>> def play(i):
+    ...     gate.wait()
+    ...     done.append(i)
+    >>> for i in range(3):
+    ...     executor.apply_async(play, (i,))
+    >>> executor.threads
+    2
+    >>> gate.set()
+    >>> executor.join()
+    >>> sorted(done)
+    [0, 1, 2]
+    >>> executor.close()
+    >>> executor.threads
+    0
+
+    '''
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, idle_timeout=IDLE_TIMEOUT):
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self.tasks = collections.deque()
+        self.condition = threading.Condition()
+        # Threads running, waiting for tasks, and tasks being played
+        self.threads = 0
+        self.idle = 0
+        self.busy = 0
+        self.workers = []
+        self.closed = False
+
+    def apply_async(self, func, args=()):
+        ''' Play func with args in a thread of executor '''
+        with self.condition:
+            self.tasks.append((func, args))
+            if self.idle >= len(self.tasks):
+                # join waits on the same condition
+                self.condition.notify_all()
+            elif self.max_workers is None or self.threads < self.max_workers:
+                self.threads += 1
+                thread = threading.Thread(target=self._work,
+                        name='AsyncInterface-%d' % self.threads)
+                thread.daemon = True
+                thread.start()
+                self.workers = [worker for worker in self.workers
+                        if worker.is_alive()] + [thread]
+
+    def join(self):
+        ''' Wait until submitted functions are played '''
+        with self.condition:
+            while self.tasks or self.busy:
+                self.condition.wait()
+
+    def close(self):
+        ''' Play submitted functions and stop threads '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            workers = list(self.workers)
+        for worker in workers:
+            if worker is not threading.current_thread():
+                worker.join()
+
+    def _work(self):
+        with self.condition:
+            while True:
+                expires = clock.monotonic() + self.idle_timeout
+                while not self.tasks:
+                    remaining = expires - clock.monotonic()
+                    if remaining <= 0 or self.closed:
+                        self.threads -= 1
+                        return
+                    self.idle += 1
+                    self.condition.wait(remaining)
+                    self.idle -= 1
+                func, args = self.tasks.popleft()
+                self.busy += 1
+                self.condition.release()
+                try:
+                    func(*args)
+                except Exception, e:
+                    logger.exception(e)
+                finally:
+                    self.condition.acquire()
+                    self.busy -= 1
+                    self.condition.notify_all()
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+def default_executor():
+    '''
+    Executor shared by AsyncInterface without executor, which plays calls
+    of at most DEFAULT_WORKERS sessions at once.
+    '''
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = Executor(DEFAULT_WORKERS)
+            # Idle threads would be waiting while interpreter shuts down
+            atexit.register(_default_executor.close)
+        return _default_executor
+
+class AsyncInterface(object):
+    '''
+    Interface with the same methods returning AsyncResult.
+
+    >>> imacros = AsyncInterface()
+    >>> results = [imacros.iimSet('NAME', 'Tom'), imacros.iimSet('NAME', 'Ann')]
+    >>> wait(results)
+    [1, 1]
+    >>> imacros.interface.bridge.variables
+    {'NAME': 'Ann'}
+    >>> imacros.iimGetLastError().get()
+    Traceback (most recent call last):
+    ...
+    IndexError: deque index out of range
+
+    '''
+
+    def __init__(self, executor=None, **kwargs):
+        # Executor, or multiprocessing ThreadPool, whose threads limit how
+        # many sessions play calls at once.  Keyword arguments are passed to
+        # Interface, many sessions share kept alive connections to their
+        # drivers unless disabled
+        kwargs.setdefault('keep_alive', True)
+        self.interface = Interface(**kwargs)
+        self.executor = executor or default_executor()
+        self.calls = collections.deque()
+        self.running = False
+        self.lock = threading.Lock()
+
+    def iimInit(self, command='', openNewBrowser=True, timeout=False):
+        return self._submit('iimInit', command, openNewBrowser, timeout)
+
+    def iimPlay(self, macro, timeout=False, loops=1):
+        return self._submit('iimPlay', macro, timeout, loops)
+
+    def iimSet(self, name, value):
+        return self._submit('iimSet', name, value)
+
+    def iimDisplay(self, message, timeout=0):
+        return self._submit('iimDisplay', message, timeout)
+
+    def iimExit(self, timeout=0):
+        return self._submit('iimExit', timeout)
+
+    def iimGetLastError(self, index=-1):
+        return self._submit('iimGetLastError', index)
+
+    def iimGetLastExtract(self, index=-1):
+        return self._submit('iimGetLastExtract', index)
+
+    def iimGetLastPerformance(self, index=1):
+        return self._submit('iimGetLastPerformance', index)
+
+    def _submit(self, method, *args):
+        result = AsyncResult()
+        with self.lock:
+            self.calls.append((method, args, result))
+            if self.running:
+                return result
+            self.running = True
+        self.executor.apply_async(self._drain)
+        return result
+
+    def _drain(self):
+        # Calls of a session are played in order by one thread at a time
+        while True:
+            with self.lock:
+                if not self.calls:
+                    self.running = False
+                    return
+                method, args, result = self.calls.popleft()
+            try:
+                value = getattr(self.interface, method)(*args)
+            except Exception, e:
+                result.set_exception(e)
+            else:
+                result.set_result(value)
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
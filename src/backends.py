@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Registry of driver backends by browser code, imported when first selected.
+
+Importing selenium.webdriver imports every driver it has, and pywin32 is
+slow to load, so neither is imported before iimInit selects a browser
+which needs it.  Backends are registered as 'module:attribute' targets or
+as callables which start a driver:
+
+    >>> registry = Registry([('http', 'httpdriver:HttpDriver')])
+    >>> 'http' in registry, 'xx' in registry
+    (True, False)
+    >>> registry['http'].__name__
+    'HttpDriver'
+
+Other packages could add browser codes with entry points of group
+seleniumacros.backends, e.g. in their setup.py:
+
+    entry_points={'seleniumacros.backends': ['pjs = mydrivers:PhantomJS']}
+
+which are looked up only when a code is not built in.
+'''
+
+import logging
+import platform
+import threading
+import collections
+
+logger = logging.getLogger('seleniumacros')
+
+ENTRY_POINT_GROUP = 'seleniumacros.backends'
+
+# Browser codes of iimInit, see Bridge
+BUILTIN_BACKENDS = [
+    ('ie',   'selenium.webdriver:Ie'),
+    ('fx',   'selenium.webdriver:Firefox'),
+    ('cr',   'selenium.webdriver:Chrome'),
+    ('http', 'httpdriver:HttpDriver'),   # Browserless
+]
+
+def load_target(target):
+    '''
+    Import module of a 'module:attribute' target and return the attribute.
+
+    >>> load_target('os.path:join')('a', 'b')
+    'a/b'
+    >>> load_target('os.path')
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid backend target: os.path
+
+    '''
+    if ':' not in target:
+        raise ValueError, 'Invalid backend target: %s' % target
+    module_name, attribute = target.split(':', 1)
+    # Modules of this package are found when it is installed as a package
+    value = __import__(module_name, globals(), {}, ['__name__'])
+    for name in attribute.split('.'):
+        value = getattr(value, name)
+    return value
+
+class Registry(object):
+    '''
+    Driver classes or factories by browser code, loaded on first lookup.
+
+    >>> registry = Registry(BUILTIN_BACKENDS)
+    >>> registry['fake'] = lambda: 'driver'
+    >>> registry['fake']()
+    'driver'
+    >>> registry.loaded.keys()
+    ['fake']
+    >>> registry['xx']
+    Traceback (most recent call last):
+    ...
+    KeyError: 'xx'
+
+    '''
+
+    def __init__(self, backends=()):
+        # Targets by code, in the order they are registered
+        self.targets = collections.OrderedDict(backends)
+        # Imported targets by code
+        self.loaded = {}
+        self.entry_points_loaded = False
+        self.lock = threading.RLock()
+
+    def register(self, code, target):
+        ''' Add backend code, target is 'module:attribute' or a callable '''
+        with self.lock:
+            self.targets[code] = target
+            self.loaded.pop(code, None)
+
+    __setitem__ = register
+
+    def __getitem__(self, code):
+        with self.lock:
+            if code in self.loaded:
+                return self.loaded[code]
+            if code not in self:
+                raise KeyError, code
+            target = self.targets[code]
+            if isinstance(target, basestring):
+                logger.debug(u'Loading backend %s from %s' % (code, target))
+                target = load_target(target)
+            elif hasattr(target, 'load') and not callable(target):
+                # Entry point of another package
+                logger.debug(u'Loading backend %s from %s' % (code, target))
+                target = target.load()
+            self.loaded[code] = target
+            return target
+
+    def __contains__(self, code):
+        with self.lock:
+            if code not in self.targets:
+                self._load_entry_points()
+            return code in self.targets
+
+    def keys(self):
+        with self.lock:
+            self._load_entry_points()
+            return self.targets.keys()
+
+    def _load_entry_points(self):
+        if self.entry_points_loaded:
+            return
+        self.entry_points_loaded = True
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            # Built in and registered backends take precedence
+            if entry_point.name not in self.targets:
+                self.targets[entry_point.name] = entry_point
+
+registry = Registry(BUILTIN_BACKENDS)
+
+def register(code, target):
+    ''' Add a browser code which iimInit could select '''
+    registry.register(code, target)
+
+_autoit_checked = False
+_autoit_available = False
+
+def autoit():
+    '''
+    Return AutoItX COM object to send native input to browsers, or None
+    where it is not used.  pywin32 is imported on first call.
+    '''
+    global _autoit_checked, _autoit_available
+    if not _autoit_checked:
+        try:
+            import win32com.client
+            _autoit_available = True
+        except ImportError:
+            if platform.platform().startswith('Windows'):
+                raise ImportError, 'This program requires the pywin32 extensions for Python.'
+            # We don't use AutoIt on other platforms
+            # TODO Use AutoKey on Linux
+        _autoit_checked = True
+    if not _autoit_available:
+        return None
+    import win32com.client
+    return win32com.client.Dispatch('AutoItX3.Control')
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -1,29 +1,34 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import os
 import re
 import time
-import logging
-import platform
+import fnmatch
 import urlparse
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from error import Timeout, ElementNotFound
+import collections
+import logging
+from selenium.common.exceptions import WebDriverException, NoSuchFrameException, \
+        TimeoutException
+from error import Timeout, ElementNotFound, UnsupportedCommand, \
+        EndOfDataSource
+import scripts
+import macro
+import lexer
+import clock
+import stopwatch
+import datasource
+import extract
+import options
+import proxy
+import multiplex
+import snapshot
+import navigation
+import backends
+import pool
 
 logger = logging.getLogger('seleniumacros')
 
-try:
-    import win32com.client
-    import pywintypes
-    using_autoit = True
-except ImportError:
-    if platform.platform().startswith('Windows'):
-        raise ImportError, 'This program requires the pywin32 extensions for Python.'
-    else:
-        # We don't use AutoIt on other platforms
-        using_autoit = False
-        # TODO Use AutoKey on Linux
-
 class Bridge(object):
     ''' A bridge between iMacros and Selenium '''
     # TODO
@@ -33,13 +38,10 @@ class Bridge(object):
     IE      = 'ie'
     FIREFOX = 'fx'
     CHROME  = 'cr'
+    HTTP    = 'http'      # Browserless, see httpdriver
 
-    # Selenium dirvers
-    WEB_DRIVERS = {
-        IE:      webdriver.Ie,
-        FIREFOX: webdriver.Firefox,
-        CHROME:  webdriver.Chrome,
-    }
+    # Selenium dirvers by browser code, imported when first selected
+    WEB_DRIVERS = backends.registry
 
     # Error codes
     OK      =  1
@@ -48,16 +50,19 @@ class Bridge(object):
 
     DEFAULT_TIMEOUT = 0   # Seconds to raise a timeout error. 0 means unlimited
 
+    HISTORY_SIZE = 100    # Number of errors and extracts kept for iimGetLast*
+
     SUPPORTED_COMMANDS = (
         # 'ADD',
         # 'BACK',
+        'CHECKPOINT',       # Not an iMacros command, see execute_checkpoint_command
         # 'CLEAR',
         # 'CLICK',
         'DS',
         # 'EXTRACT',
         # 'FILEDELETE',
-        # 'FILTER',
-        # 'FRAME',
+        'FILTER',
+        'FRAME',
         # 'IMAGECLICK',
         # 'IMAGESEARCH',
         # 'ONCERTIFICATEDIALOG',
@@ -71,15 +76,15 @@ class Bridge(object):
         # 'PAUSE',
         # 'PRINT',
         # 'PROMPT',
-        # 'PROXY',
+        'PROXY',
         # 'REFRESH',
-        # 'SAVEAS',
+        'SAVEAS',
         # 'SAVEITEM',
         # 'SEARCH',
         'SET',
         'SIZE',
-        # 'STOPWATCH',
-        # 'TAB',
+        'STOPWATCH',
+        'TAB',
         'TAG',
         # 'TRAY',
         'URL',
@@ -90,12 +95,12 @@ class Bridge(object):
     SUPPORTED_BUILTIN_VARIABLES = (
         # Unsupported built-in variables
         # '!CLIPBOARD',
-        # '!COL1',
-        # '!COL2',
-        # '!COL3',
-        # '!DATASOURCE',
-        # '!DATASOURCE_COLUMNS',
-        # '!DATASOURCE_LINE',
+        '!COL1',
+        '!COL2',
+        '!COL3',
+        '!DATASOURCE',
+        '!DATASOURCE_COLUMNS',
+        '!DATASOURCE_LINE',
         # '!ENCRYPTION',
         # '!ENDOFPAGE',
         # '!ERRORIGNORE',
@@ -103,12 +108,12 @@ class Bridge(object):
         # '!EXTRACT_TEST_POPUP',
         # '!EXTRACTDIALOG',
         # '!FILELOG',
-        # '!FILESTOPWATCH',
-        # '!FOLDER_DATASOURCE',
-        # '!FOLDER_STOPWATCH',
+        '!FILESTOPWATCH',
+        '!FOLDER_DATASOURCE',
+        '!FOLDER_STOPWATCH',
         # '!IMAGEX',
         # '!IMAGEY',
-        # '!LOOP',
+        '!LOOP',
         # '!MARKOBJECT',
         # '!NOW',
         # '!POPUP_ALLOWED',
@@ -118,8 +123,8 @@ class Bridge(object):
         # '!REGION_RIGHT',
         # '!REGION_TOP',
         # '!SINGLESTEP',
-        # '!STOPWATCHTIME',
-        # '!STOPWATCH_HEADER',
+        '!STOPWATCHTIME',
+        '!STOPWATCH_HEADER',
         # '!TAGSOURCEINDEX',
         # '!TAGX',
         # '!TAGY',
@@ -136,38 +141,98 @@ class Bridge(object):
     )
 
     DEFAULT_BUILTIN_VARIABLES = {
-        # Set all timeout to 1 hour
-        '!TIMEOUT':       '3600',
-        '!TIMEOUT_MACRO': '3600',
-        '!TIMEOUT_PAGE':  '3600',
-        '!TIMEOUT_STEP':  '3600',
+        # Seconds to load a page, find an element and play a whole macro.
+        # Fail fast rather than block the browser for a long time
+        '!TIMEOUT':       '60',
+        '!TIMEOUT_MACRO': '600',
+        '!TIMEOUT_PAGE':  '60',
+        '!TIMEOUT_STEP':  '6',
         '!REPLAYSPEED':   'MEDIUM',
+        '!LOOP':          '1',
     }
 
     # Seconds to wait between commands
     REPLAYSPEED_FAST = 0
     REPLAYSPEED_MEDIUM = 0.25
     REPLAYSPEED_SLOW = 1
+    # ADAPTIVE speed, set with SET !REPLAYSPEED ADAPTIVE, continues as soon
+    # as page is ready after each command.  Page is polled from
+    # REPLAYSPEED_ADAPTIVE_MIN_INTERVAL to REPLAYSPEED_ADAPTIVE_MAX_INTERVAL
+    # seconds, and considered ready if its nodes and text have not changed
+    # for REPLAYSPEED_ADAPTIVE_QUIET seconds.  Replay goes on anyway after
+    # REPLAYSPEED_ADAPTIVE_TIMEOUT seconds.
+    REPLAYSPEED_ADAPTIVE = 'ADAPTIVE'
+    REPLAYSPEED_ADAPTIVE_MIN_INTERVAL = 0.02
+    REPLAYSPEED_ADAPTIVE_MAX_INTERVAL = 0.25
+    REPLAYSPEED_ADAPTIVE_QUIET = 0.05
+    REPLAYSPEED_ADAPTIVE_TIMEOUT = 10
+
+    # Seconds between polls for elements
+    POLL_MIN_INTERVAL = 0.05
+    POLL_MAX_INTERVAL = 0.5
+    # Commands which do not change page, so no need to wait for it
+    PASSIVE_COMMANDS = ('SET', 'WAIT')
+    # Commands after which macro could be resumed from current URL
+    RESUMABLE_COMMANDS = ('URL', 'CHECKPOINT')
 
-    RE_COMMENT = re.compile(r'^\'\s*(.*)$')
     RE_X = re.compile(r'^X=(\d+)$')
     RE_Y = re.compile(r'^Y=(\d+)$')
-    RE_VARIABLE = re.compile(r'^\{\{([0-9A-Z_]+)\}\}$')
-    RE_BUILTIN_VARIABLE = re.compile(r'^\{\{(![0-9A-Z_]+)\}\}$')
     RE_VARIABLE_NAME = re.compile(r'^([0-9A-Z_]+)$')
     RE_BUILTIN_VARIABLE_NAME = re.compile(r'^(![0-9A-Z_]+)$')
-    RE_QUOTED_STRING = re.compile(r'^[\'\"](.*)[\'\"]$')
     RE_SECONDS = re.compile(r'^SECONDS=(\d+)$')
+    RE_TAB = re.compile(r'^T=(\d+)$')
+    RE_FRAME = re.compile(r'^(F|NAME)=(.+)$')
+    RE_FILTER_TYPE = re.compile(r'^TYPE=(IMAGES|MEDIA|FONTS|NONE)$', re.I)
+    RE_FILTER_STATUS = re.compile(r'^STATUS=(ON|OFF)$', re.I)
+    RE_COLUMN = re.compile(r'^!COL\d+$')
+    EXTRACT_TYPES = ('TXT', 'HTM', 'HREF', 'TITLE', 'ALT')
     # TODO Support more direct screen events
     # RE_DS_CMD = re.compile(r'^CMD=(CLICK|LDBLCLK|LDOWN|LUP|MOVETO|MDOWN|MUP|MDBLCLK|RDOWN|RUP|RDBLCLK|KEY)$')
     RE_DS_CMD = re.compile(r'^CMD=(CLICK|KEY)$')
 
 
-    def __init__(self):
+    def __init__(self, macro_cache=None, pool=None, tracer=None, cache_proxy=None,
+            snapshot_store=None, retry_policy=None, navigation_policy=None,
+            auditor=None, keep_alive=False):
+        self.macro_cache = macro_cache or macro.default_cache
+        # Sessions saved at CHECKPOINT commands
+        self.snapshot_store = snapshot_store or snapshot.default_store
+        # Lease drivers from pool instead of starting new ones if provided
+        self.pool = pool
+        # proxy.CachingProxy which started drivers are routed through
+        self.cache_proxy = cache_proxy
+        # tracing.Tracer to record wire calls of driver, None to disable
+        self.tracer = tracer
+        # retry.RetryPolicy to restart crashed drivers, None to fail at once
+        self.retry_policy = retry_policy
+        # State to resume macro from after driver is restarted
+        self.resume_point = None
+        # navigation.NavigationPolicy to skip loading current page again,
+        # None to always load
+        self.navigation_policy = navigation_policy
+        # screenshot.Auditor to take screenshots of failed commands and every
+        # few commands, None to take none
+        self.auditor = auditor
+        # Send commands of started drivers over wire.KeepAliveConnection
+        self.keep_alive = keep_alive
+        # Filters and load strategy drivers are started with
+        self.driver_options = options.DriverOptions()
+        # Key of started driver in pool
+        self.driver_key = None
+        # Bound command handlers, resolved once per bridge
+        self.handlers = {}
+        # Compiled templates of values parsed at replay time
+        self.templates = {}
+        # Opened datasource.DataSource, kept between loops
+        self.datasource = None
+        # If !COLn are to be read before they are rendered next time
+        self.datasource_pending = False
+        # extract.ExtractSink by path for SAVEAS TYPE=EXTRACT
+        self.sinks = {}
         self.reset()
 
     def set_browser(self, browser=IE):
-        if browser not in self.WEB_DRIVERS.keys():
+        if browser not in self.WEB_DRIVERS:
             error = 'Invalid browser code: %s' % browser
             logger.error(error)
             raise ValueError, error
@@ -175,15 +240,45 @@ class Bridge(object):
 
     def start_driver(self, force=False):
         if force or self.driver is None:
-            logger.info(u'Starting driver')
-            self.driver = self.WEB_DRIVERS[self.browser]()
-            self.driver.implicitly_wait(int(self.builtin_variables.get('!TIMEOUT', 10)))
-
-            if using_autoit:
+            driver_options = self._driver_options()
+            # Factory must not depend on state of bridge, since pool may call
+            # it later in background
+            factory = driver_options.factory(self.browser, self.WEB_DRIVERS[self.browser])
+            # Drivers started with other options are not interchangeable
+            self.driver_key = self.browser if driver_options.is_default() \
+                    else (self.browser,) + driver_options.key
+            if self.pool is not None:
+                logger.info(u'Leasing driver from pool')
+                self.driver = self.pool.lease(self.driver_key, factory)
+            else:
+                logger.info(u'Starting driver')
+                self.driver = factory()
+            if self.keep_alive and self.browser != self.HTTP:
+                # Reuse connections to driver instead of connecting per
+                # command, wire imports selenium.webdriver
+                import wire
+                wire.keep_alive(self.driver)
+            if self.tracer is not None:
+                self.tracer.attach(self.driver)
+            # Tab 1 is the window driver starts with
+            self.tabs = [self.driver.current_window_handle]
+            self.tab = 0
+            self._reset_frames(())
+            # Elements are polled explicitly within !TIMEOUT_STEP, implicit
+            # wait would block every failed lookup instead
+            self.driver.implicitly_wait(0)
+            try:
+                self.driver.set_page_load_timeout(
+                        int(self.builtin_variables['!TIMEOUT_PAGE']))
+            except WebDriverException, e:
+                logger.warn(u'Can not set page load timeout: %s' % e)
+
+            autoit = backends.autoit() if self.browser != self.HTTP else None
+            if autoit is not None:
                 # Set unique window title to get handle for AutoIT
                 self.driver.execute_script(u'document.title = "%s"' % \
                         self.driver.current_window_handle)
-                self.autoit = win32com.client.Dispatch('AutoItX3.Control')
+                self.autoit = autoit
                 self.autoit_handle = \
                         self.autoit.WinWait(self.driver.current_window_handle)
                 self.autoit.WinActivate(self.autoit_handle)
@@ -200,51 +295,253 @@ class Bridge(object):
     def set_variables(self, variables={}):
         self.variables.update(variables)
 
-    def reset(self):
+    def set_tracer(self, tracer):
+        if self.driver is not None:
+            if self.tracer is not None:
+                self.tracer.detach(self.driver)
+            if tracer is not None:
+                tracer.attach(self.driver)
+        self.tracer = tracer
+
+    def set_driver_options(self, driver_options):
+        ''' Set options of drivers started later '''
+        self.driver_options = driver_options
+
+    def stop_driver(self):
         if getattr(self, 'driver', None):
-            self.driver.close()
+            if self.tracer is not None:
+                self.tracer.detach(self.driver)
+            if self.pool is not None:
+                self.pool.release(self.driver_key, self.driver)
+            else:
+                self.driver.close()
         self.driver = None
+        # Window handles of tabs in order, and index of current tab
+        self.tabs = []
+        self.tab = 0
+        self._reset_frames(())
+
+    def scrub_driver(self):
+        '''
+        Close other tabs and clear session of current page, so that the
+        next macro starts from a blank page, see pool.DriverPool.scrub.
+        '''
+        if self.driver is None:
+            return
+        pool.DriverPool.scrub(self.driver)
+        self.tabs = [self.driver.current_window_handle]
+        self.tab = 0
+        self._reset_frames(())
+
+    def restart_driver(self):
+        ''' Quit driver, which may be in an unknown state, and start another '''
+        driver, self.driver = self.driver, None
+        if driver is not None:
+            if self.tracer is not None:
+                self.tracer.detach(driver)
+            if isinstance(self.pool, pool.DriverPool):
+                self.pool.discard(driver)
+            elif self.pool is not None:
+                # Window of a shared browser, which others keep using
+                self.pool.release(self.driver_key, driver)
+            else:
+                try:
+                    driver.quit()
+                except Exception, e:
+                    logger.debug(u'Can not quit driver: %s' % e)
+        self.start_driver()
+
+    def reset(self):
+        self.stop_driver()
+        if getattr(self, 'datasource', None):
+            self.datasource.close()
+        self.datasource = None
+        self.datasource_pending = False
+        for sink in getattr(self, 'sinks', {}).values():
+            sink.close()
+        self.sinks = {}
         self.browser = None
         self.autoit = None
         self.autoit_handle = None
+        # Deadline of macro being played
+        self.watchdog = clock.Deadline(0)
+        # Timing of last played macro
+        self.performance = stopwatch.Performance()
+        self.reset_variables()
+
+    def reset_variables(self):
+        ''' Reset variables, errors and extracts but keep driver running '''
         self.builtin_variables = {}
         # Set default values for built-in variables
         self.builtin_variables.update(self.DEFAULT_BUILTIN_VARIABLES)
         self.variables = {}
-        self.errors = []
-        self.extracts = []
-
-    def execute_script(self, script, timeout=DEFAULT_TIMEOUT):
-        for command in open(script, 'rb').readlines():
-            command = unicode(command.strip(), 'utf-8')
-            # Ignore empty string
-            if not command:
-                continue
+        # Bounded, so that a long-lived bridge does not grow without limit
+        self.errors = collections.deque(maxlen=self.HISTORY_SIZE)
+        self.extracts = collections.deque(maxlen=self.HISTORY_SIZE)
 
-            # Escape command string.
-            logger.info(u'Execute command: %s' % self._escape_string(command))
-            # Handle comment command
-            match = self.RE_COMMENT.match(command)
-            if match:
-                self.execute_comment(match.group(1))
-                continue
+    def execute_script(self, script, timeout=DEFAULT_TIMEOUT, loops=1):
+        compiled = self.macro_cache.load(script, self.SUPPORTED_COMMANDS)
+        if loops == 1:
+            return self.execute_macro(compiled, timeout)
+        return self.execute_loop(compiled, loops, timeout)
+
+    def execute_loop(self, macro, loops=0, timeout=DEFAULT_TIMEOUT):
+        '''
+        Play a compiled macro with !LOOP from 1 to loops, or until the end of
+        datasource if loops is 0.  Stop at the first failed loop and return
+        its status.  timeout applies to every loop.
+
+        >>> bridge = Bridge()
+        >>> bridge.execute_loop(macro.compile_string(u'SET !VAR1 {{!LOOP}}', ('SET',)), 3)
+        >>> bridge.builtin_variables['!VAR1']
+        '3'
 
-            # FIXME
-            # Here is a bug when you run:
-            # SET !VAR1 'Hello World'
-            # So we need a regexp to split tokens in the futrue
-            command = command.split()
-            if command[0] in self.SUPPORTED_COMMANDS:
+        '''
+        loop = 1
+        while loops <= 0 or loop <= loops:
+            self.builtin_variables['!LOOP'] = str(loop)
+            # Line defaults to !LOOP until the macro sets it
+            self.builtin_variables.pop('!DATASOURCE_LINE', None)
+            retcode = self.execute_macro(macro, timeout)
+            if retcode is None and loops <= 0 and self.datasource_pending:
+                # Macro has not used its row, which tells if data is left
                 try:
-                    getattr(self, 'execute_%s_command' % command[0].lower())(*command[1:])
-                except Exception, e:
-                    logger.error(e)
-                    self.errors.append(e)
-                    return False
-                # getattr(self, 'execute_%s_command' % command[0].lower())(*command[1:])
-            else:
-                self.execute_unsupported_command(command[0], *command[1:])
-            self._replay_wait()
+                    self._read_datasource_line()
+                except EndOfDataSource:
+                    return None
+            if retcode is not None:
+                if loops <= 0 and loop > 1 and self.errors and \
+                        isinstance(self.errors[-1], EndOfDataSource):
+                    # Datasource is exhausted, which ends the loop normally
+                    self.errors.pop()
+                    return None
+                return retcode
+            if loops <= 0 and self.datasource is None:
+                logger.warn(u'Macro has no datasource to loop over')
+                return retcode
+            loop += 1
+
+    def execute_macro(self, macro, timeout=DEFAULT_TIMEOUT):
+        '''
+        Play a compiled macro.  Return TIMEOUT if it runs longer than timeout
+        or !TIMEOUT_MACRO seconds.
+        '''
+        if timeout <= 0:
+            timeout = int(self.builtin_variables.get('!TIMEOUT_MACRO', 0))
+        try:
+            self._check_macro(macro)
+        except UnsupportedCommand, e:
+            logger.error(e)
+            self.errors.append(e)
+            return False
+        self.watchdog = clock.Deadline(timeout,
+                u'Macro has been running more than %s seconds' % timeout)
+        self.performance = stopwatch.Performance(macro.path)
+        self.builtin_variables['!EXTRACT'] = u''
+        self.macro = macro
+        run = self.auditor.start_run() if self.auditor is not None else 0
+        commands = 0
+        command = None
+        try:
+            # Skip commands before a checkpoint whose session is restored
+            index = self._restore_checkpoint(macro)
+            retries = 0
+            start_point = self._save_resume_point(index, False)
+            while index < len(macro.steps):
+                command = macro.steps[index]
+                index += 1
+                self.watchdog.check()
+                started = clock.monotonic()
+                if self.tracer is not None:
+                    self.tracer.enter(command.line, command.name)
+                logger.info(u'Execute command: %s' % command.source)
+                handler = self._get_handler(command.handler)
+                # Fill variables into arguments
+                args = self._render_args(command)
+                # Handle comment command
+                if command.name is None:
+                    handler(*args)
+                    continue
+
+                if command.name in self.SUPPORTED_COMMANDS:
+                    try:
+                        handler(*args)
+                    except Timeout:
+                        self.performance.record_command(command.line, command.name,
+                                clock.monotonic() - started, True)
+                        raise
+                    except Exception, e:
+                        logger.error(e)
+                        self.performance.record_command(command.line, command.name,
+                                clock.monotonic() - started, True)
+                        if self.retry_policy is None or \
+                                not self.retry_policy.should_retry(e, retries):
+                            self.errors.append(e)
+                            self._audit(run, command, 'failed')
+                            return False
+                        retries += 1
+                        try:
+                            index = self._resume(macro, command, start_point)
+                        except Timeout:
+                            raise
+                        except Exception, e:
+                            logger.error(u'Can not resume macro: %s' % e)
+                            self.errors.append(e)
+                            return False
+                        continue
+                else:
+                    handler(*args)
+                seconds = clock.monotonic() - started
+                self._replay_wait(command.name)
+                self.performance.record_command(command.line, command.name, seconds)
+                commands += 1
+                if self.auditor is not None and self.auditor.should_take(commands):
+                    self._audit(run, command, 'step')
+                if self.retry_policy is not None and \
+                        command.name in self.RESUMABLE_COMMANDS:
+                    self._save_resume_point(index)
+        except Timeout, e:
+            logger.error(e)
+            self.errors.append(e)
+            self._audit(run, command, 'timeout')
+            return self.TIMEOUT
+        except EndOfDataSource, e:
+            # Raised by a row read when !COLn are rendered
+            logger.error(e)
+            self.errors.append(e)
+            self._audit(run, command, 'failed')
+            return False
+        finally:
+            if self.tracer is not None:
+                # Calls after macro are not caused by its last line
+                self.tracer.leave()
+            self._finish_performance()
+            for sink in self.sinks.values():
+                sink.flush()
+
+    def execute_checkpoint_command(self, *args):
+        '''
+        CHECKPOINT NAME=login TTL=3600 VERIFY=Sign<SP>out
+
+        Save cookies, storage, URL and built-in variables of the session.
+        Later runs of the macro with the same user variables restore it
+        before playing, and continue after the checkpoint if the restored
+        URL is not redirected and contains VERIFY text if given.  Otherwise
+        the snapshot is dropped and the macro is played from the start.
+        TTL is seconds a snapshot is valid, 3600 by default.
+        '''
+        params = self._parse_checkpoint_arguments(args)
+        builtin_variables = dict((name, value) for name, value \
+                in self.builtin_variables.items() \
+                if name != '!LOOP' and isinstance(value, basestring))
+        data = {
+            'url': self.driver.current_url,
+            'cookies': self.driver.get_cookies(),
+            'storage': self.driver.execute_script(scripts.SNAPSHOT_STORAGE),
+            'builtin_variables': builtin_variables,
+        }
+        self.snapshot_store.put(snapshot.snapshot_key(self.macro.path,
+                params['NAME'], self.variables), data, params['TTL'])
 
     def execute_ds_command(self, cmd, *args):
         '''
@@ -265,7 +562,7 @@ class Bridge(object):
         cmd = match.group(1)
         if cmd == 'KEY':
             # It's a keyboard event
-            content = self._parse_value_string(args)
+            content = self._strip_argument(args[0])
             self.autoit.Send(content)
         else:
             # It's a mouse event
@@ -287,6 +584,28 @@ class Bridge(object):
                 # TODO Hide Add-on Bar to improve precise
                 raise NotImplementedError, 'Not implemented yet'
 
+    def execute_saveas_command(self, *args):
+        '''
+        SAVEAS TYPE=EXTRACT FOLDER=* FILE=data.csv
+
+        Append values of !EXTRACT to a CSV file as a row and clear !EXTRACT.
+        Only TYPE=EXTRACT is supported.
+        '''
+        params = dict(arg.split('=', 1) for arg in args if '=' in arg)
+        type = params.get('TYPE', '').upper()
+        if type != 'EXTRACT':
+            raise ValueError, u'SAVEAS TYPE=%s is not supported yet' % type
+        folder = params.get('FOLDER', '*')
+        filename = params.get('FILE', '*')
+        path = os.path.join(os.getcwd() if folder == '*' else folder,
+                'extract.csv' if filename == '*' else filename)
+        sink = self.sinks.get(path)
+        if sink is None:
+            sink = self.sinks[path] = extract.ExtractSink(path)
+        value = self.builtin_variables.get('!EXTRACT') or u''
+        sink.write(value.split(extract.SEPARATOR))
+        self.builtin_variables['!EXTRACT'] = u''
+
     def execute_set_command(self, name, value):
         '''
         SET !VAR1 TEST1
@@ -298,16 +617,50 @@ class Bridge(object):
         >>> bridge.execute_set_command('!VAR1', 'TEST1')
         >>> bridge.builtin_variables['!VAR1']
         'TEST1'
-        >>> bridge.execute_set_command('!VAR2', '{{!VAR1}}')
+        >>> bridge.execute_macro(macro.compile_string(u'SET !VAR2 {{!VAR1}}', ('SET',)))
         >>> bridge.builtin_variables['!VAR2']
         'TEST1'
 
+        Row of !DATASOURCE is read when !DATASOURCE_LINE is set or !COLn is
+        used first, !LOOP past the end of data is no error then.
+
+        >>> import shutil, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> open(os.path.join(directory, 'data.csv'), 'wb').write('a,b\\nc,d\\n')
+        >>> bridge.execute_set_command('!FOLDER_DATASOURCE', directory)
+        >>> bridge.builtin_variables['!LOOP'] = '5'
+        >>> bridge.execute_macro(macro.compile_string(u'SET !DATASOURCE data.csv\\n'
+        ...         u'SET !DATASOURCE_LINE 2\\nSET !DATASOURCE_COLUMNS 3\\n'
+        ...         u'SET !VAR2 {{!COL1}}{{!COL3}}', ('SET',)))
+        >>> bridge.builtin_variables['!VAR2'], bridge.builtin_variables['!COL3']
+        (u'c', u'')
+        >>> bridge.reset()
+        >>> shutil.rmtree(directory)
+
         '''
         # TODO
         # support setting Non-built-in variables?
         if not self.RE_BUILTIN_VARIABLE_NAME.match(name):
             raise ValueError, 'Wrong name format'
-        self.builtin_variables[name] = self._parse_value_string(value)
+        if name == '!EXTRACT':
+            # Values set to !EXTRACT are added to extracted data
+            if value.upper() == 'NULL':
+                self.builtin_variables[name] = u''
+            else:
+                self._add_extract(value)
+            return
+        self.builtin_variables[name] = value
+        if not self.builtin_variables.get('!DATASOURCE'):
+            return
+        if name == '!DATASOURCE_LINE':
+            self._read_datasource_line()
+        elif name == '!DATASOURCE':
+            # Row is read once !DATASOURCE_LINE is set or !COLn is used, so
+            # that it is read once per loop and at the line macro asks for
+            self._clear_columns()
+            self.datasource_pending = True
+        elif name == '!DATASOURCE_COLUMNS' and not self.datasource_pending:
+            self._pad_columns()
 
     def execute_size_command(self, x, y):
         '''
@@ -328,6 +681,44 @@ class Bridge(object):
         # This changes the size of whole firefox window, not only viewport
         self.driver.execute_script('window.resizeTo(%s,%s)' % (x, y))
 
+    def execute_stopwatch_command(self, *args):
+        '''
+        STOPWATCH ID=login
+        STOPWATCH START ID=login
+        STOPWATCH STOP ID=login
+        STOPWATCH LABEL=loaded
+
+        >>> bridge = Bridge()
+        >>> bridge.execute_stopwatch_command('ID=login')
+        >>> bridge.execute_stopwatch_command('STOP', 'ID=login')
+        >>> bridge.performance.get(2)[1]
+        'login'
+
+        '''
+        action, id = None, None
+        for arg in args:
+            if arg in ('START', 'STOP'):
+                action = arg
+            elif arg.startswith('ID='):
+                id = arg[3:]
+            elif arg.startswith('LABEL='):
+                seconds = self.performance.label(arg[6:])
+                self.builtin_variables['!STOPWATCHTIME'] = '%.3f' % seconds
+                return
+            else:
+                raise ValueError, 'Invalid argument format'
+        if not id:
+            raise ValueError, 'Stopwatch ID is required'
+
+        if action == 'START':
+            self.performance.start(id)
+        elif action == 'STOP':
+            seconds = self.performance.stop(id)
+        else:
+            seconds = self.performance.toggle(id)
+        if action != 'START' and seconds is not None:
+            self.builtin_variables['!STOPWATCHTIME'] = '%.3f' % seconds
+
     def execute_tag_command(self, *args):
         '''
         TAG POS=1 FORM=ID:login ATTR=NAME:email
@@ -349,11 +740,11 @@ class Bridge(object):
         >>> bridge.execute_wait_command('SECONDS=5')
 
         >>> bridge.execute_url_command('GOTO=http://www.iopus.com/imacros/support/html2tag.htm')
-        >>> bridge.execute_tag_command('POS=1', 'TYPE=STRONG', 'ATTR=TXT:<SP>iMacros<SP>User<SP>Forum')
+        >>> bridge.execute_tag_command('POS=1', 'TYPE=STRONG', 'ATTR=TXT: iMacros User Forum')
         >>> bridge.execute_wait_command('SECONDS=5')
 
         >>> bridge.execute_url_command('GOTO=http://www.iopus.com/imacros/support/html2tag.htm')
-        >>> bridge.execute_tag_command('POS=1', 'TYPE=INPUT:TEXT', 'FORM=NAME:F1', 'ATTR=NAME:tf1', 'CONTENT=Hello<SP>World')
+        >>> bridge.execute_tag_command('POS=1', 'TYPE=INPUT:TEXT', 'FORM=NAME:F1', 'ATTR=NAME:tf1', 'CONTENT=Hello World')
         >>> bridge.execute_tag_command('POS=1', 'TYPE=INPUT:CHECKBOX', 'FORM=NAME:F1', 'ATTR=NAME:cb1&&ID:cb1', 'CONTENT=YES')
         >>> bridge.execute_tag_command('POS=1', 'TYPE=INPUT:RADIO', 'FORM=NAME:F1', 'ATTR=ID:r1', 'CONTENT=YES')
 
@@ -365,6 +756,8 @@ class Bridge(object):
         # Need to add asserts to clicked links
 
         pos, type, form, attrs, content, extract = self._parse_tag_arguments(*args)
+        if extract and not content:
+            return self.execute_extract_batch(args)
         try:
             element = self._find_element_by(pos, type, form, attrs)
         except IndexError:
@@ -384,9 +777,8 @@ class Bridge(object):
                     # Issue: http://code.google.com/p/selenium/issues/detail?id=2370
                     if input_type != 'file':
                         element.clear()
-                    value = self._parse_value_string(content)
-                    logger.debug(value)
-                    element.send_keys(value)
+                    logger.debug(content)
+                    element.send_keys(content)
 
             elif element.tag_name == 'select':
                 options = content.split(':')
@@ -396,7 +788,9 @@ class Bridge(object):
                     # FIXME
                     # Will raise an 'Unrecognized command' exception under Firefox:
                     # http://code.google.com/p/selenium/issues/detail?id=1427
-                    chain = webdriver.ActionChains(self.driver)
+                    from selenium.webdriver import ActionChains
+                    from selenium.webdriver.common.keys import Keys
+                    chain = ActionChains(self.driver)
                     action = chain.key_down(Keys.CONTROL)
                     for option in options:
                         action = action.click(self._find_option_by(element, option))
@@ -411,20 +805,99 @@ class Bridge(object):
                         # Do nothing if content is empty
                         pass
 
-        elif extract:
-            logger.warn(u'Extract is not supported yet. Will trigger a click instead')
-            element.click()
         else:
             element.click()
+            # Page or frame may be navigated by click
+            self._reset_frames(None)
+
+    def execute_extract_batch(self, *commands):
+        '''
+        Play consecutive TAG commands which only extract data with a single
+        script call.  Arguments are argument lists of every command.
+
+        >>> import dom
+        >>> bridge = Bridge()
+        >>> bridge.driver = dom.DomDriver()
+        >>> bridge.driver.document = dom.Document(u'<h1>Hi</h1><img src="a.png" alt="A">', 'http://a.com/')
+        >>> bridge.execute_extract_batch(['POS=1', 'TYPE=H1', 'ATTR=*', 'EXTRACT=TXT'],
+        ...         ['POS=1', 'TYPE=IMG', 'ATTR=*', 'EXTRACT=HREF'],
+        ...         ['POS=1', 'TYPE=IMG', 'ATTR=*', 'EXTRACT=ALT'])
+        >>> bridge.builtin_variables['!EXTRACT']
+        u'Hi[EXTRACT]http://a.com/a.png[EXTRACT]A'
+        >>> list(bridge.extracts)
+        [u'Hi', u'http://a.com/a.png', u'A']
+
+        '''
+        specs = []
+        for args in commands:
+            pos, type, form, attrs, content, extract = self._parse_tag_arguments(*args)
+            specs.append((pos, type, self._prepare_attributes(form) if form else None,
+                    self._prepare_attributes(attrs), extract))
+        values = []
+        def extract_all():
+            values[:] = self.driver.execute_script(scripts.EXTRACT, specs)
+            return None not in values
+        # Poll until all elements appear within !TIMEOUT_STEP
+        self._poll(extract_all, int(self.builtin_variables['!TIMEOUT_STEP']))
+        for args, value in zip(commands, values):
+            if value is None:
+                raise ElementNotFound, u'Can not find HTML element by ' + u' '.join(args)
+            self._add_extract(value)
+
+    def execute_fill_batch(self, *commands):
+        '''
+        Play consecutive TAG commands which fill fields of the same form with
+        a single script call.  Fields which need real key events, and fields
+        which are not found yet, are played by execute_tag_command in their
+        turn, so that a field revealed by filling an earlier one is waited
+        for like separate commands would.
+
+        >>> import dom
+        >>> bridge = Bridge()
+        >>> bridge.driver = dom.DomDriver()
+        >>> bridge.driver.document = dom.Document(u'<form name="F1"><input type="text" name="a">'
+        ...         u'<input type="text" name="b" onkeyup="check()">'
+        ...         u'<input type="checkbox" name="c"></form>', '')
+        >>> bridge.execute_fill_batch(
+        ...         ['POS=1', 'TYPE=INPUT:TEXT', 'FORM=NAME:F1', 'ATTR=NAME:a', 'CONTENT=1'],
+        ...         ['POS=1', 'TYPE=INPUT:TEXT', 'FORM=NAME:F1', 'ATTR=NAME:b', 'CONTENT=2'],
+        ...         ['POS=1', 'TYPE=INPUT:CHECKBOX', 'FORM=NAME:F1', 'ATTR=NAME:c', 'CONTENT=YES'])
+        >>> form = bridge.driver.document.root.find_element_by_tag_name('form')
+        >>> [(el.control_value(), el.checked) for el in form.find_elements_by_tag_name('input')]
+        [(u'1', False), (u'2', False), (u'', True)]
+        >>> bridge.builtin_variables['!TIMEOUT_STEP'] = 0
+        >>> bridge.execute_fill_batch(
+        ...         ['POS=1', 'TYPE=INPUT:TEXT', 'FORM=NAME:F1', 'ATTR=NAME:a', 'CONTENT=3'],
+        ...         ['POS=1', 'TYPE=INPUT:TEXT', 'FORM=NAME:F1', 'ATTR=NAME:x', 'CONTENT=4'])
+        Traceback (most recent call last):
+        ...
+        ElementNotFound: Can not find HTML element by POS=1 TYPE=INPUT:TEXT FORM=NAME:F1 ATTR=NAME:x CONTENT=4
+        >>> form.find_elements_by_tag_name('input')[0].control_value()
+        u'3'
+
+        '''
+        specs = []
+        for args in commands:
+            pos, type, form, attrs, content, extract = self._parse_tag_arguments(*args)
+            specs.append((pos, type, self._prepare_attributes(form) if form else None,
+                    self._prepare_attributes(attrs), content))
+        start = 0
+        while start < len(specs):
+            filled, status = self.driver.execute_script(scripts.FILL_FORM, specs[start:])
+            start += filled
+            if status != 'done':
+                # Missing field is waited for within !TIMEOUT_STEP here
+                self.execute_tag_command(*commands[start])
+                start += 1
 
     def _find_option_by(self, element, option):
-        if option.startswith('%%'):
+        if option.startswith('%'):
             # Use value attribute to find option
             option = element.find_element_by_css_selector(u'option[value="%s"]' \
-                    % self._parse_value_string(option[2:].strip()))
+                    % option[1:].strip())
         else:
             # Use text to find option
-            text = self._parse_value_string((option[1:] if option.startswith('$') else option).strip())
+            text = (option[1:] if option.startswith('$') else option).strip()
             option = [option for option in element.find_elements_by_tag_name('option') \
                     if option.text == text][0]
         return option
@@ -438,7 +911,197 @@ class Bridge(object):
             raise ValueError, 'Invalid argument format'
         url = goto[5:]
         logger.info(u'Go to URL %s' % self._escape_string(url))
-        self.driver.get(url)
+        if self.navigation_policy is not None:
+            # Frame is left as loading page would do
+            self._enter_frame(())
+            action = self.navigation_policy.action(url, self.driver)
+            if action != navigation.ALWAYS:
+                logger.info(u'Page is loaded already, %s' % action)
+                self.performance.record_avoided_load(url, action)
+            if action == navigation.SKIP:
+                return
+            if action == navigation.REFRESH:
+                self._load_page(url, self.driver.refresh)
+                return
+        self._load_page(url, lambda: self.driver.get(url))
+
+    def _load_page(self, url, load):
+        ''' Call load to load url and record how long the page took '''
+        # Chrome is started with load strategy none for EAGER, which returns
+        # before DOM is usable, so wait for it whatever the replay speed
+        eager = self.browser != self.HTTP and \
+                self.driver_options.load_strategy == options.EAGER
+        if eager:
+            # Hook unloading of current document, not to take it for the new one
+            self._is_page_ready(0, eager)
+        started = clock.monotonic()
+        load()
+        self._reset_frames(())
+        if eager:
+            seconds = int(self.builtin_variables['!TIMEOUT_PAGE'])
+            if not self._poll(lambda: self._is_page_ready(0, eager), seconds,
+                    self.REPLAYSPEED_ADAPTIVE_MIN_INTERVAL,
+                    self.REPLAYSPEED_ADAPTIVE_MAX_INTERVAL):
+                raise TimeoutException(u'Page is not loaded after %d seconds' % seconds)
+        self.performance.record_page_load(url, clock.monotonic() - started)
+
+    def execute_filter_command(self, type, status='STATUS=ON'):
+        '''
+        FILTER TYPE=IMAGES STATUS=ON
+        FILTER TYPE=NONE
+
+        Filters are browser preferences, so a driver which has not loaded
+        any page yet is restarted with them.  Otherwise they take effect
+        when the driver is started next time.
+        '''
+        type_match = self.RE_FILTER_TYPE.match(type)
+        status_match = self.RE_FILTER_STATUS.match(status)
+        if not (type_match and status_match):
+            raise ValueError, 'Invalid argument format'
+        driver_options = self.driver_options.with_filter(type_match.group(1),
+                status_match.group(1).upper() == 'ON')
+        if self.browser == self.HTTP:
+            # Resources of pages are never loaded without a browser
+            self.driver_options = driver_options
+        else:
+            self._change_driver_options(driver_options)
+
+    def execute_proxy_command(self, *args):
+        '''
+        PROXY ADDRESS=127.0.0.1:3128
+        PROXY ADDRESS=__NONE__
+
+        With a caching proxy, requests it can not serve are chained to the
+        address.  Otherwise drivers connect through it, see FILTER about
+        when it takes effect.
+        '''
+        params = dict(arg.split('=', 1) for arg in args if '=' in arg)
+        if 'ADDRESS' not in params:
+            raise ValueError, 'Invalid argument format'
+        address = params['ADDRESS'].strip()
+        if address.upper() in ('', '__NONE__', '__DEFAULT__'):
+            address = None
+        if 'BYPASS' in params:
+            logger.warn(u'PROXY BYPASS is not supported yet')
+        if self.cache_proxy is not None:
+            self.cache_proxy.upstream = proxy.parse_address(address) if address else None
+        else:
+            self._change_driver_options(self.driver_options.with_proxy(address))
+
+    def execute_frame_command(self, arg):
+        '''
+        FRAME F=2
+        FRAME NAME=main*
+
+        Select frame which following commands play in.  Frames are counted
+        from 1 in document order including nested frames, F=0 is the page
+        itself.  NAME could contain * wildcards.  Frames of page are looked
+        up with a single script call and cached until page may navigate.
+
+        >>> import dom
+        >>> bridge = Bridge()
+        >>> bridge.driver = dom.DomDriver()
+        >>> bridge.driver.document = dom.Document(u'<frameset><frame name="nav">'
+        ...         u'<frame name="main"></frameset>', 'http://a.com/')
+        >>> bridge.execute_frame_command('NAME=ma*')
+        >>> bridge.frame_path, bridge.driver.frames[0].attrs['name']
+        ((1,), u'main')
+        >>> bridge.execute_frame_command('F=0')
+        >>> bridge.driver.frames
+        []
+        >>> bridge.execute_set_command('!TIMEOUT_STEP', '0')
+        >>> bridge.execute_frame_command('F=3')
+        Traceback (most recent call last):
+        ...
+        ElementNotFound: Can not find frame F=3
+
+        '''
+        match = self.RE_FRAME.match(arg)
+        if not match:
+            raise ValueError, 'Invalid argument format'
+        key, value = match.groups()
+        if key == 'F' and not value.isdigit():
+            raise ValueError, 'Invalid argument format'
+        path = self._lookup_frame(key, value)
+        if path is None:
+            def find():
+                # Frames may be still loading
+                self._enter_frame(())
+                self.frames = self.driver.execute_script(scripts.FRAME_TREE)
+                return self._lookup_frame(key, value)
+            path = self._poll(find, int(self.builtin_variables['!TIMEOUT_STEP']))
+            if path is None:
+                raise ElementNotFound, u'Can not find frame %s' % arg
+        try:
+            self._enter_frame(path)
+        except NoSuchFrameException:
+            # Cached frames are gone, look them up again
+            self._reset_frames(None)
+            self._enter_frame(())
+            self.frames = self.driver.execute_script(scripts.FRAME_TREE)
+            path = self._lookup_frame(key, value)
+            if path is None:
+                raise ElementNotFound, u'Can not find frame %s' % arg
+            self._enter_frame(path)
+
+    def execute_tab_command(self, arg):
+        '''
+        TAB OPEN
+        TAB T=2
+        TAB CLOSE
+        TAB CLOSEALLOTHERS
+
+        Tabs are numbered from 1, the tab the driver started with, and are
+        opened as windows which WebDriver handles alike.  TAB OPEN does not
+        switch to the new tab.
+
+        >>> import dom
+        >>> bridge = Bridge()
+        >>> bridge.driver = dom.DomDriver()
+        >>> bridge.tabs = [bridge.driver.current_window_handle]
+        >>> bridge.execute_tab_command('OPEN')
+        >>> bridge.execute_tab_command('T=2')
+        >>> bridge.driver.current_window_handle
+        'window-1'
+        >>> bridge.execute_tab_command('CLOSE')
+        >>> bridge.tab, bridge.driver.current_window_handle
+        (0, 'main')
+        >>> bridge.execute_tab_command('T=2')
+        Traceback (most recent call last):
+        ...
+        ValueError: Tab 2 does not exist
+
+        '''
+        if arg == 'OPEN':
+            self.tabs.append(multiplex.open_window(self.driver))
+            return
+        if arg == 'CLOSE':
+            if len(self.tabs) < 2:
+                raise ValueError, 'Can not close the last tab'
+            self.driver.close()
+            del self.tabs[self.tab]
+            # Go back to the previous tab like iMacros
+            index = max(self.tab - 1, 0)
+            self.driver.switch_to_window(self.tabs[index])
+            self.tab = index
+            self._reset_frames(())
+            return
+        if arg == 'CLOSEALLOTHERS':
+            current = self.tabs[self.tab]
+            self.tabs.extend(handle for handle in self.driver.window_handles
+                    if handle not in self.tabs)
+            for handle in self.tabs:
+                if handle != current:
+                    self.driver.switch_to_window(handle)
+                    self.driver.close()
+            self.driver.switch_to_window(current)
+            self.tabs, self.tab = [current], 0
+            self._reset_frames(())
+            return
+        match = self.RE_TAB.match(arg)
+        if not match:
+            raise ValueError, 'Invalid argument format'
+        self._switch_tab(int(match.group(1)) - 1)
 
     def execute_wait_command(self, seconds):
         match = self.RE_SECONDS.match(seconds)
@@ -446,7 +1109,8 @@ class Bridge(object):
             raise ValueError, 'Invalid argument format'
         seconds = int(match.group(1))
         logger.info(u'Wait for %s seconds' % seconds)
-        time.sleep(seconds)
+        time.sleep(self.watchdog.limit(seconds))
+        self.watchdog.check()
 
     def execute_comment(self, comment):
         logger.info(u'Comment: %s' % self._escape_string(comment))
@@ -456,6 +1120,120 @@ class Bridge(object):
                 % self._escape_string(' '.join(args)))
 
     # Private methods
+    def _driver_options(self):
+        ''' Options to start drivers with, routed through caching proxy '''
+        if self.cache_proxy is None:
+            return self.driver_options
+        self.cache_proxy.start()
+        return self.driver_options.with_proxy(self.cache_proxy.address)
+
+    def _change_driver_options(self, driver_options):
+        '''
+        Preferences could not be changed in a running browser, so a driver
+        which has not loaded any page yet is restarted with new options.
+        Otherwise they take effect when driver is started next time.
+        '''
+        if driver_options == self.driver_options:
+            return
+        self.driver_options = driver_options
+        if self.driver is None:
+            return
+        if self.driver.current_url in ('about:blank', 'data:,', ''):
+            logger.info(u'Restart driver with new options')
+            self.stop_driver()
+            self.start_driver()
+        else:
+            logger.warn(u'Driver options take effect when driver is restarted')
+
+    def _switch_tab(self, index):
+        ''' Switch to tab at index, unless it is current already '''
+        if index == self.tab:
+            return
+        if index >= len(self.tabs):
+            # Windows opened by pages are only looked up on demand
+            self.tabs.extend(handle for handle in self.driver.window_handles
+                    if handle not in self.tabs)
+        if not 0 <= index < len(self.tabs):
+            raise ValueError, 'Tab %d does not exist' % (index + 1)
+        self.driver.switch_to_window(self.tabs[index])
+        self.tab = index
+        self._reset_frames(())
+
+    def _audit(self, run, command, reason):
+        ''' Take a screenshot for auditor, which never fails the macro '''
+        if self.auditor is None or self.driver is None or \
+                reason != 'step' and not self.auditor.on_failure:
+            return
+        path = self.auditor.path(self.macro.path, run,
+                command.line if command is not None else 0, reason)
+        try:
+            seconds = self.auditor.take(self.driver, path)
+        except Exception, e:
+            logger.warn(u'Can not take screenshot %s: %s' % (path, e))
+        else:
+            self.performance.record_screenshot(path, seconds)
+
+    def _reset_frames(self, path):
+        '''
+        Forget cached frames of page, path is the frame driver is known to
+        be in, () for the page itself or None if unknown.
+        '''
+        # List of [path of frame indexes, name] of page, None until looked up
+        self.frames = None
+        # Indexes of frames from page to current frame
+        self.frame_path = path
+
+    def _lookup_frame(self, key, value):
+        ''' Return path of frame F=value or NAME=value from cached frames '''
+        if key == 'F' and int(value) == 0:
+            return ()
+        if self.frames is None:
+            return None
+        if key == 'F':
+            index = int(value) - 1
+            return tuple(self.frames[index][0]) if index < len(self.frames) else None
+        for path, name in self.frames:
+            if fnmatch.fnmatchcase(name, value):
+                return tuple(path)
+        return None
+
+    def _enter_frame(self, path):
+        ''' Switch to frame at path, unless driver is in it already '''
+        if path == self.frame_path:
+            return
+        current = self.frame_path
+        if current is None or path[:len(current)] != current:
+            self.driver.switch_to_default_content()
+            current = ()
+        # Go down from current frame if target is inside it
+        self.frame_path = None
+        for index in path[len(current):]:
+            self.driver.switch_to_frame(index)
+        self.frame_path = path
+
+    def _check_macro(self, macro):
+        '''
+        Raise UnsupportedCommand if macro needs features driver lacks, so
+        that it fails before any side effect.
+        '''
+        rejected = getattr(self.driver, 'REJECTED_COMMANDS', None)
+        if rejected is None:
+            return
+        for command in macro:
+            if command.name in rejected:
+                raise UnsupportedCommand, u'Line %d: %s is not supported by %s' % \
+                        (command.line, command.name, self.browser)
+            if command.name == 'URL' and any(arg.source.upper().startswith(
+                    'GOTO=JAVASCRIPT:') for arg in command.args):
+                raise UnsupportedCommand, u'Line %d: JavaScript is not supported by %s' % \
+                        (command.line, self.browser)
+
+    def _get_handler(self, name):
+        handler = self.handlers.get(name)
+        if handler is None:
+            handler = self.handlers[name] = getattr(self, name)
+        return handler
+
     def _strip_argument(self, string):
         return string.split('=', 1)[1]
 
@@ -465,7 +1243,7 @@ class Bridge(object):
         >>> bridge = Bridge()
         >>> bridge._parse_value_string('TEST1')
         'TEST1'
-        >>> bridge._parse_value_string(''TEST1'')
+        >>> bridge._parse_value_string("'TEST1'")
         'TEST1'
         >>> bridge.set_variables({'TITLE': 'TEST1'})
         >>> bridge._parse_value_string('{{TITLE}}')
@@ -481,27 +1259,15 @@ class Bridge(object):
         360
 
         '''
-        # TODO
-        # Handle string contains variables, e.g. '{{!VAR1}}<SP>Hello World'
+        value = self._compile_value(string).render(self.variables,
+                self.builtin_variables)
+        return int(value) if value.isdigit() else value
 
-        # Check if string is a custom variables
-        match = self.RE_VARIABLE.match(string)
-        # print match, string
-        if match:
-            string = self.variables.get(match.group(1), '')
-        else:
-            # Check if string is a built-in variables
-            match = self.RE_BUILTIN_VARIABLE.match(string)
-            if match:
-                string = self.builtin_variables.get(match.group(1), '')
-            else:
-                # Check if string is quoted
-                match = self.RE_QUOTED_STRING.match(string)
-                if match:
-                    string = match.group(1)
-
-        # Escape string from iMacros specific chars
-        return int(string) if string.isdigit() else self._escape_string(string)
+    def _compile_value(self, string):
+        template = self.templates.get(string)
+        if template is None:
+            template = self.templates[string] = lexer.compile_value(string)
+        return template
 
     def _escape_string(self, string):
         return string.replace('<SP>', ' ').replace('<BR>', '\n').replace('%', '%%')
@@ -519,9 +1285,11 @@ class Bridge(object):
             elif name == 'ATTR':
                 attrs = self._parse_html_attributes(value)
             elif name == 'CONTENT':
-                content = self._parse_value_string(value)
+                content = value
             elif name == 'EXTRACT':
-                extract = value
+                extract = value.upper()
+                if extract not in self.EXTRACT_TYPES:
+                    raise ValueError, u'Extract type %s is not supported yet' % value
             else:
                 raise ValueError, 'Invalid tag argument'
         return pos, type, form, attrs, content, extract
@@ -540,61 +1308,282 @@ class Bridge(object):
                 if ':' in attr:
                     # Both name and value, e.g. NAME:email
                     name, value = attr.split(':', 1)
-                    attributes[name.lower()] = self._parse_value_string(value)
+                    attributes[name.lower()] = value
                 elif attr != '*':
                     # Only attribute name, e.g. NAME
                     attributes[attr.lower()] = True
         return attributes
 
     def _find_element_by(self, pos, type, form, attrs):
-        # Assume elements can only have unique id
-        if 'id' in attrs:
-            return self.driver.find_element_by_id(attrs['id'])
-
-        css_selector = type
-
-        # If form selector is provided, find element from children of it
-        if form:
-            form = self._find_element_by(1, 'form', None, form)
-            elements = form.find_elements_by_css_selector(css_selector)
-        else:
-            elements = self.driver.find_elements_by_css_selector(css_selector)
-
-        # FIXME
-        # Selenium sometimes returns None if can not find any matching elements
-        # So we have to make sure it always return a list
-        elements = elements or []
-
-        # NOTE
-        # Have to query attributes by list filter since both CSS and XPATH
-        # query engine of Selenium is just suck
-
-        text = attrs.pop('txt', None)
-        if text is not None:
-            # Selenium will strip element text automatically
-            text = text.strip()
-            elements = [element for element in elements if element.text == text]
-
+        # Match elements in browser with a single script call, since querying
+        # text and attributes of every candidate element through WebDriver
+        # costs one round trip per element
+        args = (scripts.FIND_ELEMENT, pos, type,
+                self._prepare_attributes(form) if form else None,
+                self._prepare_attributes(attrs))
+        # Poll until element appears within !TIMEOUT_STEP
+        element = self._poll(lambda: self.driver.execute_script(*args),
+                int(self.builtin_variables['!TIMEOUT_STEP']))
+        if element is None:
+            raise IndexError, 'Can not find HTML element'
+        return element
+
+    def _prepare_attributes(self, attrs):
+        attributes = {}
         for name, value in attrs.items():
             name = name.lower()
             if value is True:
-                elements = [el for el in elements if el.get_attribute(name)]
+                attributes[name] = value
             else:
-                if name in ('href', 'src', 'action'):
-                    # Make URL values absolute
-                    value = urlparse.urljoin(self.driver.current_url, value)
-                value = self._escape_string(value.strip())
-                elements = [el for el in elements if el.get_attribute(name).startswith(value)]
+                attributes[name] = value.strip()
+        return attributes
 
-        return elements[pos - 1]
+    def _read_datasource_line(self):
+        '''
+        Fill !COLn with columns of !DATASOURCE at !DATASOURCE_LINE, or at
+        !LOOP if line is not set.
+        '''
+        path = os.path.join(self.builtin_variables.get('!FOLDER_DATASOURCE') \
+                or os.getcwd(), self.builtin_variables['!DATASOURCE'])
+        if self.datasource is None or self.datasource.path != path:
+            if self.datasource is not None:
+                self.datasource.close()
+                self.datasource = None
+            self.datasource = datasource.DataSource(path)
+        line = self.builtin_variables.get('!DATASOURCE_LINE') or \
+                self.builtin_variables['!LOOP']
+        self.datasource_pending = False
+        self._clear_columns()
+        columns = self.datasource.row(line)
+        for index, column in enumerate(columns):
+            self.builtin_variables['!COL%d' % (index + 1)] = column
+        self._pad_columns()
+
+    def _clear_columns(self):
+        for name in [name for name in self.builtin_variables \
+                if self.RE_COLUMN.match(name)]:
+            del self.builtin_variables[name]
+
+    def _pad_columns(self):
+        ''' Set empty !COLn up to !DATASOURCE_COLUMNS '''
+        count = int(self.builtin_variables.get('!DATASOURCE_COLUMNS') or 0)
+        for index in range(count):
+            self.builtin_variables.setdefault('!COL%d' % (index + 1), u'')
+
+    def _render_args(self, command):
+        ''' Fill variables into arguments of command '''
+        if self.datasource_pending and any(self.RE_COLUMN.match(name)
+                for name in command.variables):
+            self._read_datasource_line()
+        return command.render_args(self.variables, self.builtin_variables)
+
+    def _add_extract(self, value):
+        self.extracts.append(value)
+        current = self.builtin_variables.get('!EXTRACT')
+        self.builtin_variables['!EXTRACT'] = \
+                current + extract.SEPARATOR + value if current else value
+
+    def _parse_checkpoint_arguments(self, args):
+        params = dict(arg.split('=', 1) for arg in args if '=' in arg)
+        if not params.get('NAME'):
+            raise ValueError, 'Checkpoint name is required'
+        try:
+            params['TTL'] = int(params.get('TTL', snapshot.DEFAULT_TTL))
+        except ValueError:
+            raise ValueError, 'Invalid argument format'
+        return params
 
-    def _replay_wait(self):
+    def _restore_checkpoint(self, macro):
+        '''
+        Restore the session of the last checkpoint of macro which has a valid
+        snapshot.  Return index of step to play from.
+        '''
+        if self.driver is None:
+            return 0
+        checkpoints = [(index, step) for index, step in enumerate(macro.steps)
+                if step.name == 'CHECKPOINT']
+        for index, command in reversed(checkpoints):
+            params = self._parse_checkpoint_arguments(self._render_args(command))
+            key = snapshot.snapshot_key(macro.path, params['NAME'], self.variables)
+            data = self.snapshot_store.get(key)
+            if data is None:
+                continue
+            if self._restore_snapshot(data, params.get('VERIFY')):
+                logger.info(u'Restored checkpoint %s' % params['NAME'])
+                return index + 1
+            logger.info(u'Snapshot of checkpoint %s is not valid any more' % \
+                    params['NAME'])
+            self.snapshot_store.invalidate(key)
+            self.driver.delete_all_cookies()
+        return 0
+
+    def _restore_snapshot(self, data, verify=None):
+        url = data['url']
         try:
-            time.sleep(getattr(self, 'REPLAYSPEED_%s' % \
-                    self.builtin_variables['!REPLAYSPEED']))
+            parts = urlparse.urlsplit(url)
+            if parts.scheme in ('http', 'https'):
+                # Cookies and storage could only be set on a page of their
+                # domain, favicon is the cheapest one to load
+                self.driver.get('%s://%s/favicon.ico' % (parts.scheme, parts.netloc))
+                for cookie in data['cookies']:
+                    try:
+                        self.driver.add_cookie(cookie)
+                    except WebDriverException, e:
+                        logger.debug(u'Can not restore cookie %s: %s' % \
+                                (cookie.get('name'), e))
+                storage = data['storage'] or {}
+                self.driver.execute_script(scripts.RESTORE_STORAGE,
+                        storage.get('local', {}), storage.get('session', {}))
+            self.driver.get(url)
+            self._reset_frames(())
+            # Logged out sessions are usually redirected to a login page
+            if self.driver.current_url != url:
+                return False
+            if verify and verify not in self.driver.page_source:
+                return False
+        except WebDriverException, e:
+            logger.warn(u'Can not restore snapshot: %s' % e)
+            return False
+        self.builtin_variables.update(data['builtin_variables'])
+        return True
+
+    def _save_resume_point(self, index, at_page=True):
+        '''
+        Save state to resume macro from step index if driver crashes later,
+        and return it.  URL, cookies and storage are only saved at_page,
+        since there is no page to resume from at the start of macro.
+        '''
+        if self.retry_policy is None:
+            return None
+        url, cookies, storage = None, [], None
+        if at_page:
+            try:
+                url = self.driver.current_url
+                cookies = self.driver.get_cookies()
+                storage = self.driver.execute_script(scripts.SNAPSHOT_STORAGE)
+            except Exception, e:
+                # Next command fails too and resumes from previous point
+                logger.warn(u'Can not save resume point: %s' % e)
+                return self.resume_point
+        self.resume_point = {
+            'index': index,
+            'time': clock.monotonic(),
+            'url': url,
+            'cookies': cookies,
+            'storage': storage,
+            'builtin_variables': dict(self.builtin_variables),
+            'variables': dict(self.variables),
+            'extracts': list(self.extracts),
+        }
+        return self.resume_point
+
+    def _resume(self, macro, command, start_point):
+        '''
+        Restart driver after command failed and restore the last resume
+        point, or start_point of macro if its session can not be restored.
+        Return index of step to play from.
+        '''
+        time.sleep(self.watchdog.limit(self.retry_policy.delay))
+        self.watchdog.check()
+        logger.warn(u'Restart driver and resume macro after line %d failed' % \
+                command.line)
+        try:
+            self.stop_driver()
+        except Exception, e:
+            # Crashed driver could not be closed
+            logger.debug(u'Can not stop driver: %s' % e)
+            self.driver = None
+        self.start_driver()
+        point = self.resume_point
+        if point['url'] is not None:
+            self._restore_resume_point(point)
+            if self._restore_snapshot(point):
+                index = point['index']
+            else:
+                # Session could not be restored, e.g. login has expired
+                logger.warn(u'Can not restore %s, play macro again' % point['url'])
+                point = None
+        if point is None or point['url'] is None:
+            self._restore_resume_point(start_point)
+            index = self._restore_checkpoint(macro)
+            point = self.resume_point = start_point
+        # Commands played since resume point are lost
+        now = clock.monotonic()
+        self.performance.record_retry(command.line, now - point['time'])
+        point['time'] = now
+        return index
+
+    def _restore_resume_point(self, point):
+        self.builtin_variables = dict(point['builtin_variables'])
+        self.variables = dict(point['variables'])
+        self.extracts.clear()
+        self.extracts.extend(point['extracts'])
+
+    def _finish_performance(self):
+        self.performance.finish()
+        folder = self.builtin_variables.get('!FOLDER_STOPWATCH')
+        filename = self.builtin_variables.get('!FILESTOPWATCH')
+        if not (folder or filename):
+            return
+        if not filename:
+            name = os.path.splitext(os.path.basename(self.performance.name or ''))[0]
+            filename = 'Performance_%s.csv' % name
+        path = os.path.join(folder or os.getcwd(), filename)
+        try:
+            self.performance.write_csv(path,
+                    self.builtin_variables.get('!STOPWATCH_HEADER') == 'YES')
+        except (IOError, OSError), e:
+            logger.error(u'Can not write stopwatch data: %s' % e)
+
+    def _replay_wait(self, command=None):
+        speed = self.builtin_variables['!REPLAYSPEED']
+        if speed == self.REPLAYSPEED_ADAPTIVE:
+            if command not in self.PASSIVE_COMMANDS:
+                self._wait_for_page()
+            return
+        try:
+            time.sleep(getattr(self, 'REPLAYSPEED_%s' % speed))
         except AttributeError:
             raise ValueError, 'Wrong value for !REPLAYSPEED'
 
+    def _wait_for_page(self):
+        if self.driver is None:
+            return
+        quiet = int(self.REPLAYSPEED_ADAPTIVE_QUIET * 1000)
+        eager = self.driver_options.load_strategy == options.EAGER
+        if not self._poll(lambda: self._is_page_ready(quiet, eager),
+                self.REPLAYSPEED_ADAPTIVE_TIMEOUT,
+                self.REPLAYSPEED_ADAPTIVE_MIN_INTERVAL,
+                self.REPLAYSPEED_ADAPTIVE_MAX_INTERVAL):
+            logger.warn(u'Page is still not ready after %s seconds' % \
+                    self.REPLAYSPEED_ADAPTIVE_TIMEOUT)
+
+    def _is_page_ready(self, quiet, eager):
+        try:
+            return self.driver.execute_script(scripts.PAGE_READY, quiet, eager)
+        except WebDriverException, e:
+            # Script may fail while page is being unloaded
+            logger.debug(u'Page is not ready: %s' % e)
+            return False
+
+    def _poll(self, func, seconds, interval=POLL_MIN_INTERVAL,
+            max_interval=POLL_MAX_INTERVAL):
+        '''
+        Call func with growing intervals until it returns a true value or
+        seconds elapse.  Raise Timeout once macro runs out of time.
+        '''
+        expires = clock.monotonic() + seconds
+        while True:
+            result = func()
+            if result:
+                return result
+            self.watchdog.check()
+            remaining = expires - clock.monotonic()
+            if remaining <= 0:
+                return result
+            time.sleep(self.watchdog.limit(min(interval, remaining)))
+            interval = min(interval * 1.5, max_interval)
+
 if __name__ == '__main__':
     import  doctest
     doctest.testmod()
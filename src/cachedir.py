@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Directories of on-disk caches, private to the user.
+
+Cache entries are loaded with marshal and name Bridge methods to call, so
+a directory other users could write to would let them run code in our
+process.  Default directories are under the cache directory of the user,
+and directories are only used if the user owns them and nobody else could
+write to them.
+'''
+
+import os
+import errno
+import stat
+import logging
+import tempfile
+
+logger = logging.getLogger('seleniumacros')
+
+def user_cache_directory(name):
+    '''
+    Return directory of cache name under the cache directory of the user,
+    e.g. ~/.cache/seleniumacros/name.
+    '''
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or tempfile.gettempdir()
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or \
+                os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'seleniumacros', name)
+
+def make_private(directory):
+    '''
+    Create directory readable by the user only if it is missing.  Return
+    if it could be trusted: owned by the user and not writable by others.
+
+    >>> import shutil
+    >>> base = tempfile.mkdtemp()
+    >>> make_private(os.path.join(base, 'cache'))
+    True
+    >>> oct(os.stat(os.path.join(base, 'cache')).st_mode & 0777)
+    '0700'
+    >>> os.chmod(os.path.join(base, 'cache'), 0777)
+    >>> make_private(os.path.join(base, 'cache'))
+    False
+    >>> shutil.rmtree(base)
+
+    '''
+    try:
+        os.makedirs(directory, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            logger.warn(u'Can not create cache directory %s: %s' % (directory, e))
+            return False
+    if os.name == 'nt':
+        # Directories under LOCALAPPDATA are private by default
+        return True
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        logger.warn(u'Cache directory %s is not private, not using it' % directory)
+        return False
+    return True
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Client of macro server, with the same methods as Interface.
+
+    >>> imacros = RemoteInterface('127.0.0.1:8780')    # doctest: +SKIP
+    >>> imacros.iimInit('-fx')                          # doctest: +SKIP
+    1
+    >>> imacros.iimPlay('FillForm.iim')                 # doctest: +SKIP
+    1
+    >>> imacros.iimExit()                               # doctest: +SKIP
+    1
+'''
+
+import json
+import time
+import socket
+import httplib
+import logging
+from server import DEFAULT_PORT, TOKEN_HEADER, load_token
+
+logger = logging.getLogger('seleniumacros')
+
+class RemoteError(Exception):
+    ''' Call failed on server '''
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+class RemoteInterface(object):
+    '''
+    Interface played by a macro server.  A session is created on first call
+    and closed by iimExit, calls share one kept alive connection.  Token of
+    the server is looked up as the server does if it is None.
+    '''
+
+    def __init__(self, address='127.0.0.1:%d' % DEFAULT_PORT, timeout=None,
+            retries=5, token=None):
+        self.address = address
+        self.token = token if token is not None else load_token()
+        # Seconds to wait for a call, None to wait as long as the macro runs
+        self.timeout = timeout
+        # Attempts of a call refused by a busy server
+        self.retries = retries
+        self.connection = None
+        self.session = None
+
+    def iimInit(self, command='', openNewBrowser=True, timeout=False):
+        return self._call('iimInit', command, openNewBrowser, timeout)
+
+    def iimPlay(self, macro, timeout=False, loops=1):
+        return self._call('iimPlay', macro, timeout, loops)
+
+    def iimSet(self, name, value):
+        return self._call('iimSet', name, value)
+
+    def iimDisplay(self, message, timeout=0):
+        return self._call('iimDisplay', message, timeout)
+
+    def iimExit(self, timeout=0):
+        if self.session is None:
+            return 1
+        try:
+            self._request('DELETE', '/sessions/%s' % self.session)
+        finally:
+            self.session = None
+            self.close()
+        return 1
+
+    def iimGetLastError(self, index=-1):
+        return self._call('iimGetLastError', index)
+
+    def iimGetLastExtract(self, index=-1):
+        return self._call('iimGetLastExtract', index)
+
+    def iimGetLastPerformance(self, index=1):
+        return self._call('iimGetLastPerformance', index)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _call(self, method, *args):
+        if self.session is None:
+            self.session = self._request('POST', '/sessions')['session']
+        path = '/sessions/%s/%s' % (self.session, method)
+        return self._request('POST', path, args)['result']
+
+    def _request(self, method, path, data=None):
+        body = json.dumps(data) if data is not None else ''
+        for attempt in range(self.retries + 1):
+            status, headers, reply = self._send(method, path, body)
+            if status != httplib.SERVICE_UNAVAILABLE or attempt == self.retries:
+                break
+            delay = int(headers.get('retry-after', 1))
+            logger.info(u'Server is busy, retry in %d seconds' % delay)
+            time.sleep(delay)
+        try:
+            result = json.loads(reply)
+        except ValueError:
+            raise RemoteError(status, reply)
+        if status != httplib.OK:
+            raise RemoteError(status, result.get('error', reply))
+        return result
+
+    def _send(self, method, path, body):
+        # Kept alive connection closed by server is opened again once, calls
+        # on a new connection are never sent twice
+        for attempt in range(2):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = httplib.HTTPConnection(self.address,
+                        timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body,
+                        {'Content-Type': 'application/json',
+                        TOKEN_HEADER: self.token or ''})
+                response = self.connection.getresponse()
+                return (response.status, dict(response.getheaders()),
+                        response.read())
+            except socket.timeout:
+                self.close()
+                raise
+            except (httplib.BadStatusLine, socket.error):
+                self.close()
+                if not reused:
+                    raise
+            except httplib.HTTPException:
+                self.close()
+                raise
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
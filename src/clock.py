@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import time
+import platform
+from error import Timeout
+
+def _load_clock_gettime():
+    '''
+    Return clock_gettime of librt, or of libc where it lives on newer glibc
+    and musl, or None if neither could be loaded.
+    '''
+    import ctypes
+    for library in ('librt.so.1', None):
+        try:
+            # None loads symbols of the process, including libc
+            clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.c_void_p]
+        return clock_gettime
+    return None
+
+try:
+    from time import monotonic
+except ImportError:
+    _clock_gettime = _load_clock_gettime() if platform.system() == 'Linux' else None
+    if _clock_gettime is not None:
+        import os
+        import ctypes
+
+        CLOCK_MONOTONIC = 1
+
+        class _timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        def monotonic():
+            ''' Seconds of a clock which can not go backwards '''
+            t = _timespec()
+            if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return t.tv_sec + t.tv_nsec * 1e-9
+    else:
+        # TODO Use GetTickCount64 on Windows
+        monotonic = time.time
+
+class Deadline(object):
+    '''
+    A point of time after which Timeout is raised by check().
+    Deadline of 0 seconds never expires.
+
+    >>> Deadline(0).expired(), Deadline(0).remaining()
+    (False, None)
+    >>> Deadline(60).expired()
+    False
+    >>> Deadline(-1, 'Too late').check()
+    Traceback (most recent call last):
+    ...
+    Timeout: Too late
+
+    '''
+
+    def __init__(self, seconds, message=u'Timeout'):
+        self.seconds = seconds
+        self.message = message
+        self.expires = monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        ''' Seconds before deadline, None if unlimited '''
+        if self.expires is None:
+            return None
+        return max(self.expires - monotonic(), 0)
+
+    def expired(self):
+        return self.expires is not None and monotonic() >= self.expires
+
+    def check(self):
+        if self.expired():
+            raise Timeout, self.message
+
+    def limit(self, seconds):
+        ''' Shorten seconds so that it does not exceed the deadline '''
+        remaining = self.remaining()
+        return seconds if remaining is None else min(seconds, remaining)
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
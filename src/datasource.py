@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Streaming reader of CSV files used by !DATASOURCE.
+
+The file is memory mapped and only the offsets of rows are kept in memory.
+Offsets are indexed lazily up to the requested row, so reading the first
+rows of a huge file does not scan all of it, and a row seen once is found
+again in constant time.
+'''
+
+import os
+import csv
+import mmap
+from array import array
+from error import EndOfDataSource
+
+BOM = '\xef\xbb\xbf'
+
+class DataSource(object):
+    '''
+    Rows of a CSV file, starting from 1.
+
+    >>> import tempfile
+    >>> path = tempfile.mktemp('.csv')
+    >>> open(path, 'wb').write('a,b\\n"c, d",\\xe4\\xb8\\xad\\n"multi\\nline",e\\n')
+    >>> source = DataSource(path)
+    >>> source.row(2)
+    [u'c, d', u'\\u4e2d']
+    >>> source.row(3)
+    [u'multi\\nline', u'e']
+    >>> source.row(1)
+    [u'a', u'b']
+    >>> len(source)
+    3
+    >>> source.row(4) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    EndOfDataSource: Line 4 is out of range of ...
+    >>> source.close()
+    >>> os.remove(path)
+
+    '''
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        # Empty files can not be mapped
+        if self.size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = ''
+        # Offsets where rows start, offsets[n] is the end of row n
+        start = len(BOM) if self.data[:len(BOM)] == BOM else 0
+        self.offsets = array('L', [start])
+        self.complete = False
+
+    def __len__(self):
+        self._index(None)
+        return len(self.offsets) - 1
+
+    def row(self, line):
+        ''' Return columns of row at line as unicode strings '''
+        line = int(line)
+        if line < 1 or not self._index(line):
+            raise EndOfDataSource, u'Line %s is out of range of %s' % \
+                    (line, self.path)
+        record = self.data[self.offsets[line - 1]:self.offsets[line]]
+        columns = next(csv.reader([record.rstrip('\r\n')]), [])
+        return [unicode(column, self.encoding, 'replace') for column in columns]
+
+    def close(self):
+        if self.size:
+            self.data.close()
+        self.file.close()
+
+    def _index(self, line):
+        ''' Index offsets up to line, or all if None.  Return if it exists '''
+        data, offsets = self.data, self.offsets
+        while not self.complete and (line is None or len(offsets) <= line):
+            start = position = offsets[-1]
+            # Quoted fields may contain line breaks, so a row ends at the
+            # first line break with even number of quotes before it
+            quotes = 0
+            while True:
+                end = data.find('\n', position)
+                end = self.size if end < 0 else end + 1
+                quotes += data[position:end].count('"')
+                position = end
+                if quotes % 2 == 0 or end >= self.size:
+                    break
+            if data[start:end].strip():
+                offsets.append(end)
+            else:
+                # Skip blank lines
+                offsets[-1] = end
+            if end >= self.size:
+                self.complete = True
+        return line is None or len(offsets) > line
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,752 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+A small in-process DOM which implements the subset of WebDriver API used by
+Bridge.
+
+Scripts sent by Bridge are not evaluated.  Instead, DomDriver recognizes
+snippets from scripts module and runs their Python equivalents.  Subclasses
+decide where pages come from by implementing _fetch().
+'''
+
+import re
+import cgi
+import urllib
+import urlparse
+import collections
+import htmlentitydefs
+from HTMLParser import HTMLParser, HTMLParseError
+from selenium.common.exceptions import WebDriverException, \
+        NoSuchElementException, NoSuchFrameException
+import scripts
+
+VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img',
+        'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'))
+# Elements closed by a following sibling of same tag, e.g. <li>a<li>b
+SELF_CLOSING_SIBLINGS = frozenset(('li', 'option', 'p', 'td', 'th', 'tr'))
+HIDDEN_ELEMENTS = frozenset(('head', 'script', 'style', 'title', 'noscript'))
+
+RE_SPACES = re.compile(r'\s+')
+RE_SELECTOR = re.compile(r'^\s*([\w*-]+)?((?:\[[^\]]+\])*)\s*$')
+RE_SELECTOR_ATTRIBUTE = re.compile(r'''
+    \[\s*([\w-]+)\s*
+    (?:=\s*(?:"([^"]*)"|'([^']*)'|([^\]\s]*)))?
+    \s*\]''', re.X)
+
+# WebDriver keys which submit a form
+SUBMIT_KEYS = (u'\ue006', u'\ue007')
+
+class Element(object):
+    ''' An HTML element which behaves like a selenium WebElement '''
+
+    def __init__(self, document, tag, attrs, parent=None):
+        self.document = document
+        self.tag = tag
+        self.attrs = attrs
+        self.parent = parent
+        self.children = []
+        # Form control state
+        self.value = None
+        self.checked = 'checked' in attrs
+        self.selected = 'selected' in attrs
+
+    def __repr__(self):
+        return '<Element %s %r>' % (self.tag, self.attrs)
+
+    def iter(self):
+        ''' Descendant elements in document order '''
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Element):
+                yield node
+                stack.extend(reversed(node.children))
+
+    def text_content(self):
+        texts = []
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Element):
+                if node.tag not in HIDDEN_ELEMENTS:
+                    if node.tag == 'br':
+                        texts.append(u'\n')
+                    stack.extend(reversed(node.children))
+            else:
+                texts.append(node)
+        return u''.join(texts)
+
+    def outer_html(self):
+        '''
+        Serialize element, current values of form controls are not reflected.
+
+        >>> document = Document(u'<p class="a">1 &lt; 2<br></p>', '')
+        >>> document.root.children[0].outer_html()
+        u'<p class="a">1 &lt; 2<br></p>'
+
+        '''
+        html = []
+        # Closing tags are pushed as (tag,) to be written after children
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Element):
+                html.append(u'<%s%s>' % (node.tag, u''.join(u' %s="%s"' % \
+                        (name, cgi.escape(value, True)) for name, value \
+                        in sorted(node.attrs.items()))))
+                if node.tag not in VOID_ELEMENTS:
+                    stack.append((node.tag,))
+                    stack.extend(reversed(node.children))
+            elif isinstance(node, tuple):
+                html.append(u'</%s>' % node)
+            else:
+                html.append(cgi.escape(node))
+        return u''.join(html)
+
+    def ancestor(self, tag):
+        element = self
+        while element is not None and element.tag != tag:
+            element = element.parent
+        return element
+
+    def options(self):
+        return [el for el in self.iter() if el.tag == 'option']
+
+    def option_value(self):
+        if 'value' in self.attrs:
+            return self.attrs['value']
+        return RE_SPACES.sub(u' ', self.text_content()).strip()
+
+    def control_value(self):
+        if self.tag == 'select':
+            selected = [option for option in self.options() if option.selected]
+            if not selected and self.options() and 'multiple' not in self.attrs:
+                selected = self.options()[:1]
+            return selected[0].option_value() if selected else u''
+        if self.value is not None:
+            return self.value
+        if self.tag == 'textarea':
+            return self.text_content()
+        if self.tag == 'option':
+            return self.option_value()
+        return self.attrs.get('value', u'')
+
+    def input_type(self):
+        if self.tag == 'input':
+            return self.attrs.get('type', 'text').lower()
+        if self.tag == 'button':
+            return self.attrs.get('type', 'submit').lower()
+        return None
+
+    # WebElement API
+    @property
+    def tag_name(self):
+        return self.tag
+
+    @property
+    def text(self):
+        return RE_SPACES.sub(u' ', self.text_content()).strip()
+
+    def get_attribute(self, name):
+        name = name.lower()
+        if name == 'value' and self.tag in ('input', 'textarea', 'select', 'option'):
+            return self.control_value()
+        if name in ('checked', 'selected'):
+            state = self.checked if name == 'checked' else self.selected
+            return 'true' if state else None
+        if name == 'outerhtml':
+            return self.outer_html()
+        if name in ('href', 'src', 'action') and name in self.attrs:
+            return urlparse.urljoin(self.document.url, self.attrs[name])
+        return self.attrs.get(name)
+
+    def is_selected(self):
+        if self.tag == 'option':
+            return self.selected
+        return self.checked
+
+    def is_displayed(self):
+        return self.input_type() != 'hidden'
+
+    def click(self):
+        self.document.driver._click(self)
+
+    def submit(self):
+        form = self.ancestor('form')
+        if form is not None:
+            self.document.driver._submit(form)
+
+    def clear(self):
+        self.value = u''
+
+    def send_keys(self, *values):
+        text = u''.join(unicode(value) for value in values)
+        submit = any(key in text for key in SUBMIT_KEYS)
+        # Drop special WebDriver keys
+        text = u''.join(c for c in text if not u'\ue000' <= c <= u'\ue0ff')
+        self.value = self.control_value() + text
+        if submit:
+            self.submit()
+
+    def find_elements_by_css_selector(self, selector):
+        match = compile_selector(selector)
+        return [el for el in self.iter() if match(el)]
+
+    def find_element_by_css_selector(self, selector):
+        elements = self.find_elements_by_css_selector(selector)
+        if not elements:
+            raise NoSuchElementException(u'Can not find element by %s' % selector)
+        return elements[0]
+
+    def find_elements_by_tag_name(self, tag):
+        return self.find_elements_by_css_selector(tag)
+
+    def find_element_by_tag_name(self, tag):
+        return self.find_element_by_css_selector(tag)
+
+class Document(object):
+    '''
+    A parsed HTML document.
+
+    >>> document = Document(u'<p id="a">Hello <b>World</b><p>Bye<br>Now', 'http://a.com/b/')
+    >>> document.get_element_by_id('a').text
+    u'Hello World'
+    >>> [p.text for p in document.root.find_elements_by_tag_name('p')]
+    [u'Hello World', u'Bye Now']
+
+    '''
+
+    def __init__(self, html, url, driver=None):
+        self.url = url
+        self.driver = driver
+        self.html = html
+        self.root = Element(self, '#document', {})
+        _Parser(self).parse(html)
+        self.ids = {}
+        for element in self.root.iter():
+            if 'id' in element.attrs:
+                self.ids.setdefault(element.attrs['id'], element)
+
+    def get_element_by_id(self, id):
+        return self.ids.get(id)
+
+    @property
+    def title(self):
+        titles = self.root.find_elements_by_tag_name('title')
+        return titles[0].text_content().strip() if titles else u''
+
+class _Parser(HTMLParser):
+
+    def __init__(self, document):
+        HTMLParser.__init__(self)
+        self.document = document
+        self.stack = [document.root]
+
+    def parse(self, html):
+        try:
+            self.feed(html)
+            self.close()
+        except HTMLParseError:
+            # Keep what has been parsed from broken HTML
+            pass
+
+    def handle_starttag(self, tag, attrs):
+        parent = self.stack[-1]
+        if tag in SELF_CLOSING_SIBLINGS and parent.tag == tag:
+            self.stack.pop()
+            parent = self.stack[-1]
+        element = Element(self.document, tag,
+                dict((name, value if value is not None else u'')
+                for name, value in attrs), parent)
+        parent.children.append(element)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, 0, -1):
+            if self.stack[index].tag == tag:
+                del self.stack[index:]
+                return
+
+    def handle_data(self, data):
+        self.stack[-1].children.append(data)
+
+    def handle_entityref(self, name):
+        if name in htmlentitydefs.name2codepoint:
+            self.handle_data(unichr(htmlentitydefs.name2codepoint[name]))
+        else:
+            self.handle_data(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        try:
+            if name[:1] in ('x', 'X'):
+                self.handle_data(unichr(int(name[1:], 16)))
+            else:
+                self.handle_data(unichr(int(name)))
+        except ValueError:
+            self.handle_data(u'&#%s;' % name)
+
+_selectors = {}
+
+def compile_selector(selector):
+    '''
+    Compile simple CSS selectors like tag, tag[name=value] or *[name].
+
+    >>> document = Document(u'<input type="TEXT" name="a"><input name="b" type="radio">', '')
+    >>> [el.attrs['name'] for el in document.root.find_elements_by_css_selector('input[type=text]')]
+    [u'a']
+    >>> [el.attrs['name'] for el in document.root.find_elements_by_css_selector('*[type="radio"][name]')]
+    [u'b']
+
+    '''
+    match = _selectors.get(selector)
+    if match is not None:
+        return match
+
+    parsed = RE_SELECTOR.match(selector)
+    if not parsed:
+        raise WebDriverException(u'Unsupported selector: %s' % selector)
+    tag = (parsed.group(1) or '*').lower()
+    conditions = []
+    for name, double, single, bare in RE_SELECTOR_ATTRIBUTE.findall(parsed.group(2)):
+        if double or single or bare:
+            conditions.append((name.lower(), double or single or bare))
+        else:
+            conditions.append((name.lower(), None))
+
+    def match(element):
+        if tag != '*' and element.tag != tag:
+            return False
+        for name, value in conditions:
+            actual = element.attrs.get(name)
+            if actual is None:
+                return False
+            if value is not None:
+                if name == 'type':
+                    if actual.lower() != value.lower():
+                        return False
+                elif actual != value:
+                    return False
+        return True
+
+    _selectors[selector] = match
+    return match
+
+class DomDriver(object):
+    ''' Base of drivers which replay macros against a Document '''
+
+    # Handle of the first window, others are numbered in opening order
+    WINDOW_HANDLE = 'main'
+
+    def __init__(self):
+        # Document by handle of every open window
+        self.windows = collections.OrderedDict()
+        self.window_handle = self.WINDOW_HANDLE
+        # Frame elements switched into from the top document of window
+        self.frames = []
+        self.document = Document(u'', 'about:blank', self)
+        self.opened = 0
+        self.scripts = {
+            scripts.FIND_ELEMENT: self._find_element_script,
+            scripts.PAGE_READY:   lambda quiet, eager=False: True,
+            scripts.CLEAR_STORAGE: lambda: None,
+            scripts.HEALTH_CHECK: lambda: 1,
+            scripts.SNAPSHOT_STORAGE: lambda: {'local': {}, 'session': {}},
+            scripts.RESTORE_STORAGE: lambda local, session: None,
+            scripts.EXTRACT:      self._extract_script,
+            scripts.FILL_FORM:    self._fill_form_script,
+            scripts.OPEN_WINDOW:  self._open_window_script,
+            scripts.NAVIGATE:     self._open,
+            scripts.NAVIGATED:    lambda: True,
+            scripts.LOAD_STATE:   lambda: 'complete',
+            scripts.FRAME_TREE:   self._frame_tree_script,
+        }
+
+    @property
+    def top_document(self):
+        ''' Document of current window '''
+        try:
+            return self.windows[self.window_handle]
+        except KeyError:
+            raise WebDriverException(u'No such window: %s' % self.window_handle)
+
+    def _get_document(self):
+        if self.frames:
+            return self._frame_document(self.frames[-1])
+        return self.top_document
+
+    def _set_document(self, document):
+        if self.frames:
+            self.frames[-1].frame_document = document
+        else:
+            self.windows[self.window_handle] = document
+
+    # Document of current frame, or of current window
+    document = property(_get_document, _set_document)
+
+    def _frame_document(self, element):
+        # Frames are loaded once they are first used
+        document = getattr(element, 'frame_document', None)
+        if document is None:
+            src = element.attrs.get('src')
+            url = urlparse.urljoin(element.document.url, src) if src else 'about:blank'
+            try:
+                final_url, html = self._fetch(url) if src else (url, u'')
+            except WebDriverException:
+                final_url, html = url, u''
+            document = element.frame_document = Document(html, final_url, self)
+        return document
+
+    def _frame_elements(self, document):
+        return [element for element in document.root.iter()
+                if element.tag in ('frame', 'iframe')]
+
+    def _fetch(self, url, data=None):
+        '''
+        Return final URL and HTML of url, data is urlencoded form data to
+        post if not None.
+        '''
+        raise NotImplementedError
+
+    def _open(self, url, data=None):
+        if url == 'about:blank':
+            final_url, html = url, u''
+        else:
+            final_url, html = self._fetch(url, data)
+        self.document = Document(html, final_url, self)
+
+    # WebDriver API
+    @property
+    def current_url(self):
+        return self.top_document.url
+
+    @property
+    def title(self):
+        return self.top_document.title
+
+    @property
+    def page_source(self):
+        return self.document.html
+
+    @property
+    def current_window_handle(self):
+        return self.window_handle
+
+    @property
+    def window_handles(self):
+        return list(self.windows)
+
+    def get(self, url):
+        self.frames = []
+        self._open(url)
+
+    def refresh(self):
+        self.frames = []
+        self._open(self.document.url)
+
+    def execute_script(self, script, *args):
+        handler = self.scripts.get(script)
+        if handler is None:
+            raise WebDriverException(u'JavaScript is not supported by %s' % \
+                    self.__class__.__name__)
+        return handler(*args)
+
+    def find_element_by_id(self, id):
+        element = self.document.get_element_by_id(id)
+        if element is None:
+            raise NoSuchElementException(u'Can not find element by id %s' % id)
+        return element
+
+    def find_elements_by_css_selector(self, selector):
+        return self.document.root.find_elements_by_css_selector(selector)
+
+    def find_element_by_css_selector(self, selector):
+        return self.document.root.find_element_by_css_selector(selector)
+
+    def find_elements_by_tag_name(self, tag):
+        return self.document.root.find_elements_by_tag_name(tag)
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def switch_to_window(self, handle):
+        if handle not in self.windows:
+            raise WebDriverException(u'No such window: %s' % handle)
+        self.window_handle = handle
+        self.frames = []
+
+    def switch_to_frame(self, reference):
+        '''
+        Switch into a frame of current document by index, name or id.
+
+        >>> driver = DomDriver()
+        >>> driver.document = Document(u'<iframe name="a"></iframe>', 'http://a.com/')
+        >>> driver.switch_to_frame(0)
+        >>> driver.page_source, driver.current_url
+        (u'', 'http://a.com/')
+        >>> driver.switch_to_default_content()
+        >>> driver.switch_to_frame('b')
+        Traceback (most recent call last):
+        ...
+        NoSuchFrameException: Message: No such frame: b
+        <BLANKLINE>
+
+        '''
+        elements = self._frame_elements(self.document)
+        if isinstance(reference, Element):
+            found = [reference] if reference in elements else []
+        elif isinstance(reference, (int, long)):
+            found = elements[reference:reference + 1] if reference >= 0 else []
+        else:
+            found = [element for element in elements
+                    if reference in (element.attrs.get('name'), element.attrs.get('id'))]
+        if not found:
+            raise NoSuchFrameException(u'No such frame: %s' % reference)
+        self.frames.append(found[0])
+
+    def switch_to_default_content(self):
+        self.frames = []
+
+    def delete_all_cookies(self):
+        pass
+
+    def get_cookies(self):
+        return []
+
+    def add_cookie(self, cookie_dict):
+        pass
+
+    def close(self):
+        '''
+        Close current window.  Like WebDriver, other windows have to be
+        switched to explicitly.  Closing the last window leaves a blank one.
+
+        >>> driver = DomDriver()
+        >>> driver.execute_script(scripts.OPEN_WINDOW)
+        >>> driver.window_handles
+        ['main', 'window-1']
+        >>> driver.close()
+        >>> driver.current_url
+        Traceback (most recent call last):
+        ...
+        WebDriverException: Message: No such window: main
+        <BLANKLINE>
+        >>> driver.switch_to_window('window-1')
+        >>> driver.current_url
+        'about:blank'
+
+        '''
+        self.windows.pop(self.window_handle, None)
+        self.frames = []
+        if not self.windows:
+            self.quit()
+
+    def quit(self):
+        self.windows.clear()
+        self.frames = []
+        self.window_handle = self.WINDOW_HANDLE
+        self.document = Document(u'', 'about:blank', self)
+
+    # Emulation of scripts
+    def _frame_tree_script(self):
+        frames = []
+        def walk(document, path):
+            for index, element in enumerate(self._frame_elements(document)):
+                frame_path = path + [index]
+                frames.append([frame_path,
+                        element.attrs.get('name') or element.attrs.get('id') or u''])
+                walk(self._frame_document(element), frame_path)
+        walk(self.top_document, [])
+        return frames
+
+    def _open_window_script(self):
+        self.opened += 1
+        self.windows['window-%d' % self.opened] = Document(u'', 'about:blank', self)
+
+    def _find_element_script(self, pos, selector, form, attrs):
+        root = self.document.root
+        if form:
+            root = self._find(root, 1, 'form', form)
+            if root is None:
+                return None
+        return self._find(root, pos, selector, attrs)
+
+    def _extract_script(self, specs):
+        values = []
+        for pos, selector, form, attrs, type in specs:
+            element = self._find_element_script(pos, selector, form, attrs)
+            values.append(None if element is None else self._extract(element, type))
+        return values
+
+    def _extract(self, element, type):
+        if type == 'TXT':
+            if element.tag in ('input', 'textarea'):
+                return element.control_value()
+            if element.tag == 'select':
+                selected = [option for option in element.options() if option.selected]
+                selected = selected or element.options()[:1]
+                return selected[0].text if selected else u''
+            return element.text
+        if type == 'HTM':
+            return element.outer_html()
+        if type == 'HREF':
+            return element.get_attribute('href') or element.get_attribute('src') or u''
+        return element.get_attribute(type.lower()) or u''
+
+    def _fill_form_script(self, specs):
+        for index, (pos, selector, form, attrs, content) in enumerate(specs):
+            element = self._find_element_script(pos, selector, form, attrs)
+            if element is None:
+                return [index, 'missing']
+            if not self._fill(element, content):
+                return [index, 'keys']
+        return [len(specs), 'done']
+
+    def _fill(self, element, content):
+        type = element.input_type()
+        if element.tag == 'input' and type in ('checkbox', 'radio'):
+            if element.checked != (content == 'YES'):
+                self._click(element)
+            return True
+        if element.tag == 'select':
+            values = content.split(':')
+            if 'multiple' not in element.attrs:
+                values = values[-1:]
+                for option in element.options():
+                    option.selected = False
+            for value in values:
+                for option in element.options():
+                    if value.startswith('%'):
+                        found = option.option_value() == value[1:].strip()
+                    else:
+                        found = option.text == (value[1:] if value.startswith('$') else value).strip()
+                    if found:
+                        option.selected = True
+                        break
+            return True
+        if element.tag not in ('input', 'textarea') or type == 'file' or \
+                any(u'\ue000' <= c <= u'\ue0ff' for c in content) or \
+                any(name in element.attrs for name in ('onkeydown', 'onkeypress', 'onkeyup')):
+            return False
+        element.value = unicode(content)
+        return True
+
+    def _find(self, root, pos, selector, attrs):
+        if 'id' in attrs and attrs['id'] is not True:
+            # Assume elements can only have unique id
+            return self.document.get_element_by_id(unicode(attrs['id']))
+        if pos < 1:
+            return None
+        n = 0
+        for element in root.find_elements_by_css_selector(selector):
+            if self._matches(element, attrs):
+                n += 1
+                if n == pos:
+                    return element
+        return None
+
+    def _matches(self, element, attrs):
+        for name, expected in attrs.items():
+            if name == 'txt':
+                if element.text != unicode(expected).strip():
+                    return False
+                continue
+            actual = element.get_attribute(name)
+            if expected is True:
+                if not actual:
+                    return False
+                continue
+            expected = unicode(expected)
+            if name in ('href', 'src', 'action'):
+                expected = urlparse.urljoin(self.document.url, expected)
+            if actual is None or not actual.startswith(expected):
+                return False
+        return True
+
+    # Emulation of user actions
+    def _click(self, element):
+        type = element.input_type()
+        if type == 'checkbox':
+            element.checked = not element.checked
+        elif type == 'radio':
+            self._check_radio(element)
+        elif element.tag == 'option':
+            select = element.ancestor('select')
+            if select is not None and 'multiple' in select.attrs:
+                element.selected = not element.selected
+            else:
+                if select is not None:
+                    for option in select.options():
+                        option.selected = False
+                element.selected = True
+        elif type in ('submit', 'image') and element.tag in ('input', 'button'):
+            form = element.ancestor('form')
+            if form is not None:
+                self._submit(form, element)
+        else:
+            link = element.ancestor('a')
+            if link is not None and 'href' in link.attrs:
+                href = link.get_attribute('href')
+                # Links to scripts or anchors of current page do not load
+                if not href.lower().startswith('javascript:') and \
+                        urlparse.urldefrag(href)[0] != \
+                        urlparse.urldefrag(self.document.url)[0]:
+                    self._open(href)
+
+    def _check_radio(self, element):
+        form = element.ancestor('form') or self.document.root
+        name = element.attrs.get('name')
+        for other in form.iter():
+            if other.input_type() == 'radio' and other.attrs.get('name') == name:
+                other.checked = False
+        element.checked = True
+
+    def _form_data(self, form, submitter=None):
+        data = []
+        for element in form.iter():
+            name = element.attrs.get('name')
+            if not name or 'disabled' in element.attrs:
+                continue
+            type = element.input_type()
+            if element.tag == 'select':
+                for option in element.options():
+                    if option.selected:
+                        data.append((name, option.option_value()))
+                if 'multiple' not in element.attrs and \
+                        not any(option.selected for option in element.options()) \
+                        and element.options():
+                    data.append((name, element.options()[0].option_value()))
+            elif element.tag == 'textarea':
+                data.append((name, element.control_value()))
+            elif element.tag == 'input' or element.tag == 'button':
+                if type in ('checkbox', 'radio'):
+                    if element.checked:
+                        data.append((name, element.attrs.get('value', u'on')))
+                elif type in ('submit', 'image', 'button', 'reset'):
+                    if element is submitter:
+                        data.append((name, element.control_value()))
+                elif type != 'file':
+                    data.append((name, element.control_value()))
+        return [(name.encode('utf-8'), value.encode('utf-8')) for name, value in data]
+
+    def _submit(self, form, submitter=None):
+        action = form.get_attribute('action') or self.document.url
+        data = urllib.urlencode(self._form_data(form, submitter))
+        if form.attrs.get('method', 'get').lower() == 'post':
+            self._open(action, data)
+        else:
+            action = urlparse.urldefrag(action)[0].split('?', 1)[0]
+            self._open('%s?%s' % (action, data))
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -7,6 +7,12 @@ class Timeout(Exception):
 class ElementNotFound(Exception):
     ''' Can not find HTML element '''
 
+class UnsupportedCommand(Exception):
+    ''' Command can not be played by current driver '''
+
+class EndOfDataSource(Exception):
+    ''' Line of datasource is out of range '''
+
 if __name__ == '__main__':
     import  doctest
     doctest.testmod()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Sinks which append extracted data to files for SAVEAS TYPE=EXTRACT.
+'''
+
+import csv
+
+# Separator of values in !EXTRACT
+SEPARATOR = u'[EXTRACT]'
+
+class ExtractSink(object):
+    '''
+    Append rows of extracted values to a CSV file through a write buffer.
+
+    Rows are not kept in memory once written, so a macro could extract any
+    amount of data in a loop.
+
+    >>> import os, tempfile
+    >>> path = tempfile.mktemp('.csv')
+    >>> sink = ExtractSink(path)
+    >>> sink.write([u'Tom', u'Say "Hi"'])
+    >>> sink.write([u'\\u4e2d'])
+    >>> sink.close()
+    >>> open(path, 'rb').read()
+    '"Tom","Say ""Hi"""\\r\\n"\\xe4\\xb8\\xad"\\r\\n'
+    >>> os.remove(path)
+
+    '''
+
+    def __init__(self, path, buffer_size=64 * 1024):
+        self.path = path
+        self.file = open(path, 'ab', buffer_size)
+        self.writer = csv.writer(self.file, quoting=csv.QUOTE_ALL)
+
+    def write(self, values):
+        self.writer.writerow([unicode(value).encode('utf-8') for value in values])
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Browserless driver which fetches pages with urllib2 and replays macros
+against the parsed HTML.
+
+It is selected by iimInit('-http') and suits macros which only navigate,
+fill and submit server-rendered forms and extract text.  No JavaScript is
+run, so macros with DS or SIZE commands or javascript: URLs are rejected by
+Bridge before they are played.
+'''
+
+import re
+import socket
+import httplib
+import urllib2
+import urlparse
+import cookielib
+from selenium.common.exceptions import WebDriverException
+import dom
+
+RE_META_CHARSET = re.compile(r'''<meta[^>]+charset=["']?([\w-]+)''', re.I)
+
+class HttpDriver(dom.DomDriver):
+    '''
+    Driver backed by an HTTP client with a cookie jar.
+
+    >>> driver = HttpDriver()
+    >>> driver.add_cookie({'name': 'sid', 'value': '42', 'domain': 'example.com'})
+    >>> [(c['name'], c['value']) for c in driver.get_cookies()]
+    [('sid', '42')]
+    >>> driver.delete_all_cookies()
+    >>> driver.get_cookies()
+    []
+
+    '''
+
+    USER_AGENT = 'Mozilla/5.0 (compatible; seleniumacros)'
+
+    # Commands which need a real browser window
+    REJECTED_COMMANDS = ('DS', 'SIZE')
+
+    def __init__(self, timeout=None, proxy=None):
+        dom.DomDriver.__init__(self)
+        self.timeout = timeout
+        self.cookie_jar = cookielib.CookieJar()
+        # Proxies of environment are used unless proxy is given
+        proxies = {'http': proxy, 'https': proxy} if proxy else None
+        self.opener = urllib2.build_opener(urllib2.ProxyHandler(proxies),
+                urllib2.HTTPCookieProcessor(self.cookie_jar))
+        self.opener.addheaders = [('User-Agent', self.USER_AGENT)]
+
+    def _fetch(self, url, data=None):
+        if url.lower().startswith('javascript:'):
+            raise WebDriverException(u'JavaScript is not supported by %s' % \
+                    self.__class__.__name__)
+        try:
+            try:
+                response = self.opener.open(url, data, self.timeout)
+            except urllib2.HTTPError, e:
+                # Browsers render error pages as well
+                response = e
+            try:
+                content = response.read()
+                final_url = response.geturl()
+                charset = response.info().getparam('charset')
+            finally:
+                response.close()
+        except (urllib2.URLError, httplib.HTTPException, socket.error), e:
+            raise WebDriverException(u'Can not load %s: %s' % (url, e))
+        return final_url, self._decode(content, charset)
+
+    def _decode(self, content, charset=None):
+        if not charset:
+            match = RE_META_CHARSET.search(content, 0, 2048)
+            charset = match.group(1) if match else 'utf-8'
+        try:
+            return unicode(content, charset, 'replace')
+        except LookupError:
+            return unicode(content, 'utf-8', 'replace')
+
+    # WebDriver API
+    def set_page_load_timeout(self, seconds):
+        self.timeout = seconds or None
+
+    def get_cookies(self):
+        return [{
+            'name':   cookie.name,
+            'value':  cookie.value,
+            'domain': cookie.domain,
+            'path':   cookie.path,
+            'secure': cookie.secure,
+            'expiry': cookie.expires,
+        } for cookie in self.cookie_jar]
+
+    def add_cookie(self, cookie_dict):
+        domain = cookie_dict.get('domain') or \
+                urlparse.urlparse(self.current_url).hostname or ''
+        path = cookie_dict.get('path', '/')
+        self.cookie_jar.set_cookie(cookielib.Cookie(0,
+                cookie_dict['name'], cookie_dict['value'],
+                None, False,
+                domain, True, domain.startswith('.'),
+                path, True,
+                cookie_dict.get('secure', False), cookie_dict.get('expiry'),
+                False, None, None, {}))
+
+    def delete_cookie(self, name):
+        for cookie in list(self.cookie_jar):
+            if cookie.name == name:
+                self.cookie_jar.clear(cookie.domain, cookie.path, cookie.name)
+
+    def delete_all_cookies(self):
+        self.cookie_jar.clear()
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
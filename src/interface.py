@@ -3,8 +3,9 @@
 
 import re
 import logging
-from selenium import webdriver
 from bridge import Bridge
+import options
+import screenshot
 
 logger = logging.getLogger('seleniumacros')
 
@@ -41,15 +42,25 @@ class Interface(object):
     '''
 
     RE_INIT_COMMAND = re.compile(r'^-(\w+)(?:\s+(.*))?$')
+    RE_INIT_OPTION = re.compile(r'-(\w+)\s+(\S+)')
 
-    def __init__(self):
-        self.bridge = Bridge()
+    def __init__(self, pool=None, tracer=None, cache_proxy=None, retry_policy=None,
+            navigation_policy=None, auditor=None, screenshot_writer=None,
+            keep_alive=False):
+        self.bridge = Bridge(pool=pool, tracer=tracer, cache_proxy=cache_proxy,
+                retry_policy=retry_policy, navigation_policy=navigation_policy,
+                auditor=auditor, keep_alive=keep_alive)
+        # screenshot.ScreenshotWriter saving screenshots, shared one if None
+        self.screenshot_writer = screenshot_writer
 
     @handle_retcode
     def iimInit(self, command, openNewBrowser=True, timeout=False):
         '''
         Setup new browser driver.
         See http://wiki.imacros.net/iimInit%28%29 for more info.
+
+        Browser code could be followed by driver options, e.g.
+        '-fx -filter IMAGES,MEDIA -loadstrategy eager'.
         '''
         # openNewBrowser is ignored, since we always open new window
         if not command:
@@ -58,19 +69,40 @@ class Interface(object):
         if not match:
             raise ValueError('Wrong command for iimInit')
         self.bridge.set_browser(match.group(1))
+        self.bridge.set_driver_options(self._parse_driver_options(match.group(2)))
         self.bridge.start_driver()
         if timeout > 0:
             self.bridge.set_builtin_variables({'!TIMEOUT_MACRO': int(timeout)})
 
+    def _parse_driver_options(self, string):
+        '''
+        >>> imacros = Interface()
+        >>> imacros._parse_driver_options('-filter images,fonts -loadstrategy eager').key
+        (('FONTS', 'IMAGES'), 'eager', None)
+
+        '''
+        filters, load_strategy = (), options.NORMAL
+        for name, value in self.RE_INIT_OPTION.findall(string or ''):
+            if name == 'filter':
+                filters = [filter for filter in value.split(',') if filter]
+            elif name == 'loadstrategy':
+                load_strategy = value.lower()
+            else:
+                raise ValueError('Unknown option for iimInit: -%s' % name)
+        return options.DriverOptions(filters, load_strategy)
+
     @handle_retcode
-    def iimPlay(self, macro, timeout=False):
+    def iimPlay(self, macro, timeout=False, loops=1):
         '''
         Start browser process if it is not started yet.  Replay macro.
         See http://wiki.imacros.net/iimPlay%28%29 for more info.
+
+        The macro is played loops times with !LOOP counting from 1, or until
+        the end of its !DATASOURCE if loops is 0.
         '''
-        if timeout > 0:
-            self.bridge.set_builtin_variables({'!TIMEOUT': int(timeout)})
-        return self.bridge.execute_script(macro)
+        # Macro is stopped and TIMEOUT is returned after timeout seconds
+        return self.bridge.execute_script(macro,
+                int(timeout) if timeout > 0 else 0, loops)
 
     @handle_retcode
     def iimSet(self, name, value):
@@ -96,6 +128,11 @@ class Interface(object):
         Closes browser instance.
         See http://wiki.imacros.net/iimExit%28%29 for more info.
         '''
+        # Screenshots of session are written before it is gone, a writer
+        # which is not started yet has none
+        writer = self._screenshot_writer(start=False)
+        if writer is not None:
+            writer.flush(timeout or None)
         self.bridge.reset()
 
     def iimGetLastError(self, index=-1):
@@ -117,20 +154,34 @@ class Interface(object):
         '''
         Takes screenshot of browser or web page
         See http://wiki.imacros.net/iimTakeBrowserScreenshot%28%29 for more info.
+
+        img_type is 0 for the visible part of page or 1 for the whole page.
+        The image is converted to the format of path extension and written
+        in background, with timeout the call waits up to timeout seconds
+        for it and returns TIMEOUT if it is not written yet.
         '''
-        raise NotImplementedError, 'Not implemented yet'
+        if self.bridge.driver is None:
+            raise ValueError, 'Browser is not started'
+        writer = self._screenshot_writer()
+        writer.submit(screenshot.capture(self.bridge.driver, int(img_type)), path)
+        if timeout > 0 and not writer.flush(timeout):
+            return Bridge.TIMEOUT
 
-    @handle_retcode
-    def iimGetLastPerformance(self, index=0):
+    def _screenshot_writer(self, start=True):
+        return self.screenshot_writer or screenshot.default_writer(start)
+
+    def iimGetLastPerformance(self, index=1):
         '''
         Returns the total runtime and STOPWATCH data for the most recent macro run.
         Returned object is tuple where first value indicates data presence,
         second value is STOPWATCH name, third is STOPWATCH value.
-        If index equals 1 then total runtime is returned.
+        If index equals 1 then total runtime is returned.  STOPWATCH records
+        are followed by played commands named like 'L12 TAG', or
+        'L12 TAG FAILED' if the command failed.
 
         See http://wiki.imacros.net/iimGetLastPerformance for more info.
         '''
-        raise NotImplementedError, 'Not implemented yet'
+        return self.bridge.performance.get(index)
 
 if __name__ == '__main__':
     import  doctest
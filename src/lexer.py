@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Tokenize iMacros command lines into argument templates.
+
+Every argument is compiled once into a Template, where literal text is
+already unescaped and variable references are kept as slots.  Rendering a
+template at replay time just fills the slots and joins the parts.
+'''
+
+import re
+
+RE_VARIABLE = re.compile(r'\{\{(!?[0-9A-Z_]+)\}\}')
+RE_TOKEN = re.compile(r'''
+      (?P<space>\s+)
+    | "(?P<quoted>(?:[^"\\]|\\.)*)"
+    | (?P<variable>\{\{!?[0-9A-Z_]+\}\})
+    | (?P<escape><SP>|<BR>)
+    | (?P<text>[^\s"{<]+|.)
+''', re.X | re.S)
+# Single quoted strings are only recognized at the start of a token, so that
+# apostrophes inside words stay untouched
+RE_SINGLE_QUOTED = re.compile(r"'([^']*)'(?=\s|$)")
+RE_QUOTED_ESCAPE = re.compile(r'\\(.)', re.S)
+
+ESCAPES = {
+    '<SP>': ' ',
+    '<BR>': '\n',
+}
+
+QUOTED_ESCAPES = {
+    'n': '\n',
+    't': '\t',
+}
+
+def unescape(string):
+    ''' Replace iMacros specific chars '''
+    if '<' in string:
+        string = string.replace('<SP>', ' ').replace('<BR>', '\n')
+    return string
+
+class Template(object):
+    '''
+    A compiled argument with slots for variables.
+
+    >>> template = compile_value('{{!VAR1}}<SP>Hello<SP>{{NAME}}')
+    >>> template.render({'NAME': 'World'}, {'!VAR1': 'Say'})
+    'Say Hello World'
+    >>> template.source
+    '{{!VAR1}}<SP>Hello<SP>{{NAME}}'
+    >>> compile_value('Hello<SP>World').render({}, {})
+    'Hello World'
+
+    '''
+
+    def __init__(self, source, parts, slots):
+        self.source = source
+        self.parts = parts
+        # List of (index in parts, variable name)
+        self.slots = slots
+        if slots:
+            self.literal = None
+        else:
+            self.literal = ''.join(parts)
+
+    def render(self, variables, builtin_variables):
+        if self.literal is not None:
+            return self.literal
+        parts = list(self.parts)
+        for index, name in self.slots:
+            if name[0] == '!':
+                value = builtin_variables.get(name, '')
+            else:
+                value = variables.get(name, '')
+            if not isinstance(value, basestring):
+                value = unicode(value)
+            parts[index] = unescape(value)
+        return ''.join(parts)
+
+    def __repr__(self):
+        return '<Template %r>' % self.source
+
+class _Builder(object):
+    ''' Collect parts of a template '''
+
+    def __init__(self):
+        self.parts = []
+        self.slots = []
+        self.text = []
+
+    def add_text(self, text):
+        self.text.append(text)
+
+    def add_variable(self, name):
+        self._flush()
+        self.slots.append((len(self.parts), name))
+        self.parts.append('')
+
+    def add_quoted(self, string):
+        position = 0
+        for match in RE_VARIABLE.finditer(string):
+            self._add_quoted_text(string[position:match.start()])
+            self.add_variable(match.group(1))
+            position = match.end()
+        self._add_quoted_text(string[position:])
+
+    def build(self, source):
+        self._flush()
+        return Template(source, self.parts, self.slots)
+
+    def _add_quoted_text(self, text):
+        if text:
+            text = RE_QUOTED_ESCAPE.sub(
+                    lambda m: QUOTED_ESCAPES.get(m.group(1), m.group(1)), text)
+            self.add_text(unescape(text))
+
+    def _flush(self):
+        if self.text:
+            self.parts.append(''.join(self.text))
+            self.text = []
+
+def tokenize(line):
+    '''
+    Split a command line into templates in a single pass.
+
+    >>> [t.render({}, {}) for t in tokenize("SET !VAR1 'Hello World'")]
+    ['SET', '!VAR1', 'Hello World']
+    >>> [t.render({}, {}) for t in tokenize('TAG ATTR=TXT:"Say \\\\"Hi\\\\"" CONTENT=a<SP>b')]
+    ['TAG', 'ATTR=TXT:Say "Hi"', 'CONTENT=a b']
+    >>> [t.render({'X': 'b c'}, {}) for t in tokenize("SET !VAR1 \\"a {{X}}\\" Don't")]
+    ['SET', '!VAR1', 'a b c', "Don't"]
+
+    '''
+    templates = []
+    builder, start = None, None
+    position, length = 0, len(line)
+    while position < length:
+        if builder is None and line[position] == "'":
+            match = RE_SINGLE_QUOTED.match(line, position)
+            if match:
+                builder = _Builder()
+                builder.add_quoted(match.group(1))
+                templates.append(builder.build(match.group(0)))
+                builder = None
+                position = match.end()
+                continue
+
+        match = RE_TOKEN.match(line, position)
+        kind = match.lastgroup
+        if kind == 'space':
+            if builder is not None:
+                templates.append(builder.build(line[start:position]))
+                builder = None
+        else:
+            if builder is None:
+                builder, start = _Builder(), position
+            if kind == 'quoted':
+                builder.add_quoted(match.group('quoted'))
+            elif kind == 'variable':
+                builder.add_variable(match.group(kind)[2:-2])
+            elif kind == 'escape':
+                builder.add_text(ESCAPES[match.group(kind)])
+            else:
+                builder.add_text(match.group(kind))
+        position = match.end()
+
+    if builder is not None:
+        templates.append(builder.build(line[start:]))
+    return templates
+
+def compile_value(string):
+    '''
+    Compile a single value, where spaces are not treated as separators.
+
+    >>> compile_value("'Hello World'").render({}, {})
+    'Hello World'
+    >>> compile_value('{{TITLE}}').render({'TITLE': 'Hello<SP>World'}, {})
+    'Hello World'
+
+    '''
+    builder = _Builder()
+    match = RE_SINGLE_QUOTED.match(string)
+    if match and match.end() == len(string):
+        builder.add_quoted(match.group(1))
+        return builder.build(string)
+
+    for match in RE_TOKEN.finditer(string):
+        kind = match.lastgroup
+        if kind == 'quoted':
+            builder.add_quoted(match.group('quoted'))
+        elif kind == 'variable':
+            builder.add_variable(match.group(kind)[2:-2])
+        elif kind == 'escape':
+            builder.add_text(ESCAPES[match.group(kind)])
+        else:
+            builder.add_text(match.group(0))
+    return builder.build(string)
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
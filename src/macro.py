@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Compile iMacros scripts into a list of commands which could be replayed
+without parsing the script again.
+
+Compiled macros are cached in memory and on disk.  Cache entries are keyed
+by path, modification time and compiler version of macro, so that new
+processes could skip parsing completely.
+'''
+
+import os
+import re
+import sys
+import errno
+import hashlib
+import logging
+import marshal
+import tempfile
+import lexer
+import plan
+import cachedir
+
+logger = logging.getLogger('seleniumacros')
+
+# Bump this whenever the compiled representation changes
+COMPILER_VERSION = 3
+
+RE_COMMENT = re.compile(r'^\'\s*(.*)$')
+
+class Command(object):
+    '''
+    A compiled macro line.
+
+    name is None for comments.  handler is name of the Bridge method which
+    executes the command and args are templates of the arguments passed to it.
+
+    >>> command = compile_line(1, u'URL GOTO=http://www.iopus.com', ('URL',))
+    >>> command.name, command.handler, command.render_args({}, {})
+    (u'URL', 'execute_url_command', (u'GOTO=http://www.iopus.com',))
+    >>> command = compile_line(2, u'PAUSE', ('URL',))
+    >>> command.handler, command.render_args({}, {})
+    ('execute_unsupported_command', (u'PAUSE',))
+    >>> command = compile_line(3, u"' Hello World", ('URL',))
+    >>> command.name, command.handler, command.render_args({}, {})
+    (None, 'execute_comment', (u'Hello World',))
+    >>> command = compile_line(4, u"SET !VAR1 {{!LOOP}}<SP>times", ('SET',))
+    >>> command.render_args({}, {'!LOOP': 3})
+    [u'!VAR1', u'3 times']
+
+    '''
+
+    def __init__(self, line, name, handler, args, source):
+        self.line = line
+        self.name = name
+        self.handler = handler
+        self.args = args
+        self.source = source
+        # Names of variables arguments are rendered with
+        self.variables = frozenset(name for arg in args for index, name in arg.slots)
+        # Arguments without variables are rendered only once
+        if all(arg.literal is not None for arg in args):
+            self.literal_args = tuple(arg.literal for arg in args)
+        else:
+            self.literal_args = None
+
+    def render_args(self, variables, builtin_variables):
+        if self.literal_args is not None:
+            return self.literal_args
+        return [arg.render(variables, builtin_variables) for arg in self.args]
+
+    def __repr__(self):
+        return '<Command line %d: %s>' % (self.line, self.source.encode('utf-8'))
+
+class Macro(object):
+    ''' A compiled macro '''
+
+    def __init__(self, path, commands, steps=None):
+        self.path = path
+        self.commands = commands
+        # Commands grouped into steps to play, see plan
+        self.steps = plan.plan(commands) if steps is None else steps
+
+    def __iter__(self):
+        return iter(self.commands)
+
+    def __len__(self):
+        return len(self.commands)
+
+    def dump(self):
+        ''' Return macro as builtin types which could be marshaled '''
+        return ([(command.line, command.name, command.handler,
+                [(arg.source, arg.parts, arg.slots) for arg in command.args],
+                command.source) for command in self.commands],
+                plan.dump(self.steps, self.commands))
+
+    @classmethod
+    def load(cls, path, data):
+        commands, steps = data
+        commands = [Command(line, name, handler,
+                tuple(lexer.Template(*arg) for arg in args), source)
+                for line, name, handler, args, source in commands]
+        return cls(path, commands, plan.load(steps, commands))
+
+def compile_line(line, text, supported_commands):
+    # Escape string from iMacros specific chars for logging
+    source = lexer.unescape(text)
+    match = RE_COMMENT.match(text)
+    if match:
+        comment = match.group(1)
+        return Command(line, None, 'execute_comment',
+                (lexer.Template(comment, [comment], []),), source)
+
+    tokens = lexer.tokenize(text)
+    name = tokens[0].source
+    if name in supported_commands:
+        return Command(line, name, 'execute_%s_command' % str(name.lower()),
+                tuple(tokens[1:]), source)
+    else:
+        return Command(line, name, 'execute_unsupported_command',
+                tuple(tokens), source)
+
+def compile_lines(lines, supported_commands):
+    commands = []
+    for line, text in enumerate(lines):
+        text = text.strip()
+        # Ignore empty string
+        if text:
+            commands.append(compile_line(line + 1, text, supported_commands))
+    return commands
+
+def compile_macro(path, supported_commands):
+    lines = [unicode(text, 'utf-8') for text in open(path, 'rb').readlines()]
+    return Macro(path, compile_lines(lines, supported_commands))
+
+def compile_string(string, supported_commands):
+    return Macro(None, compile_lines(string.splitlines(), supported_commands))
+
+class MacroCache(object):
+    '''
+    Cache of compiled macros.
+
+    >>> import shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> path = os.path.join(directory, 'test.iim')
+    >>> open(path, 'wb').write('URL GOTO=http://www.iopus.com\\n')
+    >>> cache = MacroCache(os.path.join(directory, 'cache'))
+    >>> macro = cache.load(path, ('URL',))
+    >>> cache.load(path, ('URL',)) is macro
+    True
+    >>> len(MacroCache(cache.directory).load(path, ('URL',)))
+    1
+    >>> shutil.rmtree(directory)
+
+    '''
+
+    DEFAULT_DIRECTORY = cachedir.user_cache_directory('macros')
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        # Set directory to None to disable on-disk cache
+        self.directory = directory
+        self.macros = {}
+        # If directory is private to the user, checked on first use
+        self.private = None
+
+    def load(self, path, supported_commands):
+        path = os.path.abspath(path)
+        key = self._key(path, supported_commands)
+        cached = self.macros.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        macro = self._read(path, key)
+        if macro is None:
+            logger.debug(u'Compile macro %s' % path)
+            macro = compile_macro(path, supported_commands)
+            self._write(key, macro)
+        self.macros[path] = (key, macro)
+        return macro
+
+    def clear(self):
+        self.macros.clear()
+
+    def _key(self, path, supported_commands):
+        stat = os.stat(path)
+        # Format of marshal depends on Python version
+        return hashlib.sha1(repr((COMPILER_VERSION, sys.version_info[:2],
+                marshal.version, path, stat.st_mtime, stat.st_size,
+                tuple(supported_commands)))).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, '%s.marshal' % key)
+
+    def _usable(self):
+        if not self.directory:
+            return False
+        if self.private is None:
+            self.private = cachedir.make_private(self.directory)
+        return self.private
+
+    def _read(self, path, key):
+        if not self._usable():
+            return None
+        try:
+            # marshal loads much faster than pickle, which matters since
+            # loading has to be cheaper than parsing
+            with open(self._filename(key), 'rb') as f:
+                return Macro.load(path, marshal.load(f))
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                logger.warn(u'Can not read macro cache: %s' % e)
+        except Exception, e:
+            # Broken cache entry will be overwritten
+            logger.warn(u'Can not load macro cache: %s' % e)
+        return None
+
+    def _write(self, key, macro):
+        if not self._usable():
+            return
+        try:
+            # Write to a temporary file first, so that other processes never
+            # read an incomplete cache entry
+            fd, temp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(macro.dump(), f)
+            try:
+                os.rename(temp, self._filename(key))
+            except OSError:
+                # Windows does not replace existing file
+                os.remove(temp)
+        except (IOError, OSError), e:
+            logger.warn(u'Can not write macro cache: %s' % e)
+
+# Cache shared by all bridges in process
+default_cache = MacroCache()
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Share one browser among several bridges, each playing in its own windows.
+
+A window costs far less memory than a browser process.  Multiplexer is
+passed to Bridge or Interface in place of a DriverPool, and every lease gets
+a WindowSession: a driver which switches the shared driver to a window of
+the session before each call.  Calls of sessions are serialized, so they
+interleave at WebDriver call granularity, and page loads are waited for
+between calls instead of blocking the driver.
+
+Windows of a browser share cookies, cache and storage, so macros which
+depend on separate logins must not be multiplexed.  Windows opened by pages
+are not attributed to any session.
+'''
+
+import time
+import logging
+import threading
+from selenium.common.exceptions import WebDriverException
+import scripts
+import clock
+
+logger = logging.getLogger('seleniumacros')
+
+# Seconds to wait for a window opened by script to be listed
+OPEN_WINDOW_TIMEOUT = 5
+# Seconds between polls of a page being loaded
+POLL_INTERVAL = 0.05
+
+def open_window(driver, timeout=OPEN_WINDOW_TIMEOUT):
+    '''
+    Open a blank window and return its handle, without switching to it.
+
+    >>> import dom
+    >>> driver = dom.DomDriver()
+    >>> open_window(driver), driver.current_window_handle
+    ('window-1', 'main')
+
+    '''
+    if isinstance(driver, WindowSession):
+        return driver.open_window()
+    handles = set(driver.window_handles)
+    driver.execute_script(scripts.OPEN_WINDOW)
+    expires = clock.monotonic() + timeout
+    while True:
+        opened = [handle for handle in driver.window_handles if handle not in handles]
+        if opened:
+            return opened[0]
+        if clock.monotonic() > expires:
+            raise WebDriverException(u'Can not open window, pop-ups may be blocked')
+        time.sleep(POLL_INTERVAL)
+
+def _unwrap(value):
+    if isinstance(value, _Proxy):
+        return value._target
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(item) for item in value)
+    return value
+
+class _Proxy(object):
+    ''' Object of shared driver, used from a window of session '''
+
+    # Values passed as they are, other objects like elements are wrapped
+    PLAIN_TYPES = (basestring, int, long, float, bool, dict, type(None))
+
+    def __init__(self, session, target):
+        self._session = session
+        self._target = target
+
+    def __getattr__(self, name):
+        shared, session = self._session.shared, self._session
+        with shared.lock:
+            shared.switch(session.window_handle, session.frame_path)
+            value = getattr(self._target, name)
+        if not callable(value):
+            return self._wrap(value)
+
+        def call(*args, **kwargs):
+            with shared.lock:
+                shared.switch(session.window_handle, session.frame_path)
+                return self._wrap(value(*_unwrap(args), **kwargs))
+        return call
+
+    def __eq__(self, other):
+        return self._target == _unwrap(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _wrap(self, value):
+        if isinstance(value, self.PLAIN_TYPES):
+            return value
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._wrap(item) for item in value)
+        return _Proxy(self._session, value)
+
+class WindowSession(_Proxy):
+    '''
+    Driver which plays in its own windows of a shared driver.
+
+    >>> import dom
+    >>> shared = SharedDriver(dom.DomDriver())
+    >>> a, b = shared.open_session(), shared.open_session()
+    >>> a.current_window_handle, b.current_window_handle
+    ('main', 'window-1')
+    >>> a.get('about:blank')
+    >>> b.get('about:blank')
+    >>> b.open_window()
+    'window-2'
+    >>> a.current_url
+    'about:blank'
+    >>> shared.driver.current_window_handle, shared.switches
+    ('main', 2)
+    >>> b.quit()
+    >>> shared.driver.window_handles
+    ['main']
+
+    '''
+
+    DEFAULT_PAGE_LOAD_TIMEOUT = 300
+
+    def __init__(self, shared, handle):
+        _Proxy.__init__(self, self, shared.driver)
+        self.shared = shared
+        self.handles = [handle]
+        self.window_handle = handle
+        # Frame indexes session is in, entered again after other sessions
+        self.frame_path = ()
+        self.page_load_timeout = self.DEFAULT_PAGE_LOAD_TIMEOUT
+
+    @property
+    def current_window_handle(self):
+        return self.window_handle
+
+    @property
+    def window_handles(self):
+        return list(self.handles)
+
+    def switch_to_window(self, handle):
+        if handle not in self.handles:
+            raise WebDriverException(u'No such window: %s' % handle)
+        # Shared driver is switched lazily before next call
+        self.window_handle = handle
+        self.frame_path = ()
+
+    def switch_to_frame(self, index):
+        '''
+        Switch to frame by index, names and elements are not tracked.
+
+        >>> import dom
+        >>> shared = SharedDriver(dom.DomDriver())
+        >>> a, b = shared.open_session(), shared.open_session()
+        >>> shared.driver.document = dom.Document(u'<iframe name="f"></iframe>',
+        ...         'http://a.com/')
+        >>> a.switch_to_frame(0)
+        >>> b.current_url, a.frame_path, len(shared.driver.frames)
+        ('about:blank', (0,), 0)
+        >>> a.title, len(shared.driver.frames)
+        (u'', 1)
+
+        '''
+        if not isinstance(index, (int, long)):
+            raise WebDriverException(u'Frames of multiplexed sessions are '
+                    'selected by index')
+        with self.shared.lock:
+            self.shared.switch(self.window_handle, self.frame_path)
+            self.shared.driver.switch_to_frame(index)
+            self.frame_path += (index,)
+            self.shared.frame_path = self.frame_path
+
+    def switch_to_default_content(self):
+        self.frame_path = ()
+
+    def open_window(self):
+        with self.shared.lock:
+            handle = open_window(self.shared.driver)
+        self.handles.append(handle)
+        return handle
+
+    def set_page_load_timeout(self, seconds):
+        self.page_load_timeout = seconds
+
+    def get(self, url):
+        '''
+        Load url in window of session.  Loading is polled, so that other
+        sessions could use the driver meanwhile.
+        '''
+        self.frame_path = ()
+        self.execute_script(scripts.NAVIGATE, url)
+        expires = clock.monotonic() + self.page_load_timeout
+        while True:
+            try:
+                if self.execute_script(scripts.NAVIGATED):
+                    return
+            except WebDriverException, e:
+                # Script may fail while page is being unloaded
+                logger.debug(u'Page is not loaded: %s' % e)
+            if clock.monotonic() > expires:
+                raise WebDriverException(u'Timed out loading page %s' % url)
+            time.sleep(POLL_INTERVAL)
+
+    def close(self):
+        ''' Close current window of session '''
+        self.shared.close_window(self.window_handle)
+        self.handles.remove(self.window_handle)
+
+    def quit(self):
+        ''' Close all windows of session '''
+        for handle in self.handles:
+            self.shared.close_window(handle)
+        self.handles = []
+
+class SharedDriver(object):
+    ''' A driver with windows used by several sessions '''
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.lock = threading.RLock()
+        # Window and frame driver is switched to, to skip redundant switches
+        self.active = driver.current_window_handle
+        self.frame_path = ()
+        # Windows left by closed sessions
+        self.free = [self.active]
+        self.sessions = 0
+        self.switches = 0
+
+    def open_session(self):
+        with self.lock:
+            handle = self.free.pop() if self.free else open_window(self.driver)
+            self.sessions += 1
+        return WindowSession(self, handle)
+
+    def switch(self, handle, frame_path=()):
+        if handle != self.active:
+            self.driver.switch_to_window(handle)
+            self.active = handle
+            self.frame_path = ()
+            self.switches += 1
+        if frame_path != self.frame_path:
+            self.driver.switch_to_default_content()
+            for index in frame_path:
+                self.driver.switch_to_frame(index)
+            self.frame_path = frame_path
+
+    def close_window(self, handle):
+        with self.lock:
+            if len(self.driver.window_handles) > 1:
+                self.switch(handle)
+                self.driver.close()
+                self.active = None
+                self.frame_path = ()
+            else:
+                # Closing the last window would quit browser
+                self.switch(handle)
+                self.driver.get('about:blank')
+                self.free.append(handle)
+
+class Multiplexer(object):
+    '''
+    Leases windows of shared drivers, with at most sessions_per_driver
+    sessions in a driver.  Could be used as pool of Bridge.
+    '''
+
+    def __init__(self, sessions_per_driver=8):
+        self.sessions_per_driver = sessions_per_driver
+        # SharedDriver list by browser
+        self.drivers = {}
+        self.lock = threading.Lock()
+
+    def lease(self, browser, factory):
+        with self.lock:
+            shared = None
+            for candidate in self.drivers.get(browser, []):
+                if candidate.sessions < self.sessions_per_driver:
+                    shared = candidate
+                    break
+            if shared is not None:
+                return shared.open_session()
+        logger.info(u'Starting shared driver %s' % browser)
+        shared = SharedDriver(factory())
+        session = shared.open_session()
+        with self.lock:
+            self.drivers.setdefault(browser, []).append(shared)
+        return session
+
+    def release(self, browser, session):
+        shared = session.shared
+        try:
+            session.quit()
+        except WebDriverException, e:
+            logger.warn(u'Shared driver %s is broken: %s' % (browser, e))
+            self._discard(browser, shared)
+            return
+        with shared.lock:
+            shared.sessions -= 1
+
+    def stats(self):
+        with self.lock:
+            return dict((browser, [(shared.sessions, shared.switches)
+                    for shared in drivers]) for browser, drivers in self.drivers.items())
+
+    def close(self):
+        ''' Quit all shared drivers '''
+        with self.lock:
+            drivers = [(browser, shared) for browser, drivers in self.drivers.items()
+                    for shared in drivers]
+        for browser, shared in drivers:
+            self._discard(browser, shared)
+
+    def _discard(self, browser, shared):
+        with self.lock:
+            if shared in self.drivers.get(browser, []):
+                self.drivers[browser].remove(shared)
+        try:
+            shared.driver.quit()
+        except Exception, e:
+            logger.debug(u'Can not quit driver: %s' % e)
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
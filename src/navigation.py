@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Policy to avoid reloading pages the browser is on already.
+
+URL GOTO loads its page again even if the browser shows it, e.g. on the
+first line of a looped macro or after a pooled driver or checkpoint
+restored the page.  With NavigationPolicy(SKIP), Bridge leaves a loaded
+page with the same normalized URL as it is, and with REFRESH it reloads
+the page from cache.  The page is left as it is, including any changes made
+by the previous loop, so the policy is opt-in.
+'''
+
+import urlparse
+from selenium.common.exceptions import WebDriverException
+import scripts
+
+ALWAYS, SKIP, REFRESH = 'always', 'skip', 'refresh'
+
+MODES = (ALWAYS, SKIP, REFRESH)
+
+# Ports omitted from normalized URLs
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url):
+    '''
+    Return url with case insensitive parts lower cased, default port
+    dropped and empty path as /.
+
+    >>> normalize_url('HTTP://Example.COM:80?q=A#Top')
+    'http://example.com/?q=A#Top'
+    >>> normalize_url('https://example.com:8443/a/')
+    'https://example.com:8443/a/'
+
+    '''
+    parts = urlparse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if ':' in netloc and not netloc.endswith(']'):
+        host, port = netloc.rsplit(':', 1)
+        if port.isdigit() and int(port) == DEFAULT_PORTS.get(scheme):
+            netloc = host
+    path = parts.path
+    if not path and netloc:
+        path = '/'
+    return urlparse.urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+class NavigationPolicy(object):
+    '''
+    Whether URL GOTO loads, skips or refreshes the page.
+
+    >>> import dom
+    >>> driver = dom.DomDriver()
+    >>> driver.document = dom.Document(u'<p>Hi</p>', 'http://example.com/')
+    >>> policy = NavigationPolicy(SKIP)
+    >>> policy.action('http://EXAMPLE.com', driver)
+    'skip'
+    >>> policy.action('http://example.com/other', driver)
+    'always'
+    >>> NavigationPolicy(REFRESH).action('http://example.com/', driver)
+    'refresh'
+    >>> NavigationPolicy('never')
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid navigation mode: never
+
+    '''
+
+    def __init__(self, mode=SKIP):
+        if mode not in MODES:
+            raise ValueError, 'Invalid navigation mode: %s' % mode
+        self.mode = mode
+
+    def action(self, url, driver):
+        ''' Return ALWAYS, SKIP or REFRESH for loading url in driver '''
+        if self.mode == ALWAYS:
+            return ALWAYS
+        try:
+            if normalize_url(driver.current_url) != normalize_url(url):
+                return ALWAYS
+            # Pages still loading or being left are loaded again
+            if driver.execute_script(scripts.LOAD_STATE) != 'complete':
+                return ALWAYS
+        except WebDriverException:
+            return ALWAYS
+        return self.mode
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
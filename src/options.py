@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Options which web drivers are started with.
+
+Resource filters and page load strategy could not be changed once a browser
+is started, so they are turned into browser preferences and capabilities by
+the factory which starts drivers.
+'''
+
+import logging
+
+logger = logging.getLogger('seleniumacros')
+
+# Resource types of FILTER
+IMAGES = 'IMAGES'
+MEDIA  = 'MEDIA'
+FONTS  = 'FONTS'
+FILTERS = (IMAGES, MEDIA, FONTS)
+
+# Page load strategies, EAGER returns from URL GOTO once DOM is usable
+NORMAL = 'normal'
+EAGER  = 'eager'
+LOAD_STRATEGIES = (NORMAL, EAGER)
+
+FIREFOX_PREFERENCES = {
+    IMAGES: {
+        'permissions.default.image': 2,
+    },
+    MEDIA: {
+        'media.autoplay.enabled': False,
+        'media.ogg.enabled': False,
+        'media.webm.enabled': False,
+        'media.wave.enabled': False,
+        'media.mp4.enabled': False,
+        'plugin.state.flash': 0,
+    },
+    FONTS: {
+        'gfx.downloadable_fonts.enabled': False,
+        'browser.display.use_document_fonts': 0,
+    },
+}
+
+CHROME_PREFERENCES = {
+    IMAGES: {
+        'profile.managed_default_content_settings.images': 2,
+    },
+    MEDIA: {
+        'profile.managed_default_content_settings.plugins': 2,
+        'profile.managed_default_content_settings.media_stream': 2,
+    },
+}
+
+CHROME_ARGUMENTS = {
+    MEDIA: ['--autoplay-policy=user-gesture-required'],
+    FONTS: ['--disable-remote-fonts'],
+}
+
+class DriverOptions(object):
+    '''
+    Immutable options of drivers started by a bridge.
+
+    >>> options = DriverOptions().with_filter('images', True)
+    >>> options.filters, options.key
+    (('IMAGES',), (('IMAGES',), 'normal', None))
+    >>> options.with_filter('NONE', True).is_default()
+    True
+    >>> options.with_proxy('127.0.0.1:3128').key
+    (('IMAGES',), 'normal', '127.0.0.1:3128')
+    >>> DriverOptions(load_strategy='fast')
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid page load strategy: fast
+
+    '''
+
+    def __init__(self, filters=(), load_strategy=NORMAL, proxy=None):
+        filters = tuple(sorted(set(str(filter.upper()) for filter in filters)))
+        for filter in filters:
+            if filter not in FILTERS:
+                raise ValueError, 'Invalid filter type: %s' % filter
+        if load_strategy not in LOAD_STRATEGIES:
+            raise ValueError, 'Invalid page load strategy: %s' % load_strategy
+        self.filters = filters
+        self.load_strategy = load_strategy
+        # host:port of HTTP proxy, None to connect directly
+        self.proxy = str(proxy) if proxy else None
+        # Drivers started with equal keys are interchangeable
+        self.key = (filters, load_strategy, self.proxy)
+
+    def __eq__(self, other):
+        return isinstance(other, DriverOptions) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def is_default(self):
+        return self.key == DriverOptions().key
+
+    def with_filter(self, type, enabled):
+        ''' Return options with filter type turned on or off, NONE for all '''
+        type = type.upper()
+        if type == 'NONE':
+            filters = ()
+        elif enabled:
+            filters = self.filters + (type,)
+        else:
+            filters = [filter for filter in self.filters if filter != type]
+        return DriverOptions(filters, self.load_strategy, self.proxy)
+
+    def with_proxy(self, proxy):
+        ''' Return options with proxy address, None to connect directly '''
+        return DriverOptions(self.filters, self.load_strategy, proxy)
+
+    def factory(self, browser, driver_class):
+        '''
+        Return a function which starts driver_class of browser with these
+        options.  Browsers without known preferences are started as usual.
+        '''
+        if self.is_default():
+            return driver_class
+        if browser == 'http':
+            # Resources of pages are never loaded without a browser
+            proxy = self.proxy
+            return lambda: driver_class(proxy=proxy)
+        if browser == 'fx':
+            return self._firefox_factory(driver_class)
+        if browser == 'cr':
+            return self._chrome_factory(driver_class)
+        logger.warn(u'Driver options are not supported by browser %s' % browser)
+        return driver_class
+
+    def _firefox_factory(self, driver_class):
+        # Drivers are imported once a browser is selected
+        from selenium import webdriver
+        from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+        preferences = {}
+        for filter in self.filters:
+            preferences.update(FIREFOX_PREFERENCES.get(filter, {}))
+        capabilities = DesiredCapabilities.FIREFOX.copy()
+        if self.load_strategy == EAGER:
+            # Legacy FirefoxDriver returns once DOM is loaded
+            preferences['webdriver.load.strategy'] = 'unstable'
+            capabilities['pageLoadStrategy'] = EAGER
+        if self.proxy:
+            host, port = self.proxy.rsplit(':', 1)
+            preferences.update({
+                'network.proxy.type': 1,
+                'network.proxy.http': host,
+                'network.proxy.http_port': int(port),
+                'network.proxy.ssl': host,
+                'network.proxy.ssl_port': int(port),
+                'network.proxy.no_proxies_on': '',
+            })
+
+        def factory():
+            # Every browser needs its own profile directory
+            profile = webdriver.FirefoxProfile()
+            for name, value in preferences.items():
+                profile.set_preference(name, value)
+            return driver_class(firefox_profile=profile, capabilities=capabilities)
+        return factory
+
+    def _chrome_factory(self, driver_class):
+        from selenium import webdriver
+        from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+        preferences, arguments = {}, []
+        for filter in self.filters:
+            preferences.update(CHROME_PREFERENCES.get(filter, {}))
+            arguments.extend(CHROME_ARGUMENTS.get(filter, []))
+        capabilities = DesiredCapabilities.CHROME.copy()
+        if self.load_strategy == EAGER:
+            # chromedriver 2.x only knows none, Bridge polls for DOM after
+            # every page load
+            capabilities['pageLoadStrategy'] = 'none'
+        if self.proxy:
+            arguments.append('--proxy-server=http://%s' % self.proxy)
+
+        def factory():
+            chrome_options = webdriver.ChromeOptions()
+            if preferences:
+                chrome_options.add_experimental_option('prefs', preferences)
+            for argument in arguments:
+                chrome_options.add_argument(argument)
+            return driver_class(chrome_options=chrome_options,
+                    desired_capabilities=capabilities)
+        return factory
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Group compiled commands of a macro into steps played by Bridge.
+
+Most commands are played one by one.  Runs of commands which could be
+played with a single call to the browser are grouped into a Batch, which
+is played by one handler receiving rendered arguments of every command.
+'''
+
+class Batch(object):
+    '''
+    Consecutive commands played by one handler call.
+
+    It behaves like the first command for logging, tracing and error
+    handling, and renders a list of arguments per command.
+    '''
+
+    def __init__(self, handler, commands):
+        self.handler = handler
+        self.commands = commands
+        self.line = commands[0].line
+        self.name = commands[0].name
+        self.source = u'\n'.join(command.source for command in commands)
+        self.variables = frozenset().union(*[command.variables
+                for command in commands])
+
+    def render_args(self, variables, builtin_variables):
+        return [command.render_args(variables, builtin_variables)
+                for command in self.commands]
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __repr__(self):
+        return '<Batch lines %d-%d: %s>' % (self.line,
+                self.commands[-1].line, self.handler)
+
+def _tag_options(command):
+    ''' Sources of TAG arguments by name, or None if it is not a TAG '''
+    if command.handler != 'execute_tag_command':
+        return None
+    return dict(arg.source.split('=', 1) for arg in command.args if '=' in arg.source)
+
+def plan(commands):
+    '''
+    Return steps of commands, where consecutive extracting TAG commands, and
+    consecutive TAG commands filling fields of the same form, are grouped
+    into batches.
+
+    >>> import macro
+    >>> steps = plan(macro.compile_lines([
+    ...     'URL GOTO=http://a.com/',
+    ...     'TAG POS=1 TYPE=H1 ATTR=* EXTRACT=TXT',
+    ...     "' Comments do not break batches",
+    ...     'TAG POS=1 TYPE=A ATTR=* EXTRACT=HREF',
+    ...     'TAG POS=1 TYPE=INPUT:TEXT FORM=NAME:F1 ATTR=NAME:a CONTENT=1',
+    ...     'TAG POS=1 TYPE=INPUT:TEXT FORM=NAME:F1 ATTR=NAME:b CONTENT=2',
+    ...     'TAG POS=1 TYPE=INPUT:TEXT FORM=NAME:F2 ATTR=NAME:c CONTENT=3',
+    ...     'TAG POS=1 TYPE=A ATTR=*',
+    ... ], ('TAG', 'URL')))
+    >>> for step in steps: print step
+    <Command line 1: URL GOTO=http://a.com/>
+    <Batch lines 2-4: execute_extract_batch>
+    <Batch lines 5-6: execute_fill_batch>
+    <Command line 7: TAG POS=1 TYPE=INPUT:TEXT FORM=NAME:F2 ATTR=NAME:c CONTENT=3>
+    <Command line 8: TAG POS=1 TYPE=A ATTR=*>
+    >>> len(steps[1])
+    2
+
+    '''
+    steps = []
+    # Handler and key of commands in the batch being built
+    batch, handler, key = [], None, None
+
+    def flush():
+        if len(batch) > 1 or handler == 'execute_extract_batch':
+            steps.append(Batch(handler, list(batch)))
+        else:
+            # A single field is filled as usual
+            steps.extend(batch)
+        del batch[:]
+
+    for command in commands:
+        options = _tag_options(command)
+        if options is None or ('CONTENT' in options) == ('EXTRACT' in options):
+            next_handler = None
+        elif 'EXTRACT' in options:
+            next_handler, next_key = 'execute_extract_batch', None
+        elif 'FORM' in options:
+            next_handler, next_key = 'execute_fill_batch', options['FORM']
+        else:
+            next_handler = None
+        if next_handler is None:
+            if command.name is None and batch:
+                # Comments are only logged, keep them out of the batch
+                continue
+            if batch:
+                flush()
+            steps.append(command)
+            continue
+        if batch and (next_handler, next_key) != (handler, key):
+            flush()
+        batch.append(command)
+        handler, key = next_handler, next_key
+    if batch:
+        flush()
+    return steps
+
+def dump(steps, commands):
+    '''
+    Return steps as builtin types which could be marshaled, where commands
+    are referred to by index, so that loading a cached macro does not plan
+    it again.
+    '''
+    indexes = dict((id(command), index) for index, command in enumerate(commands))
+    return [(step.handler, [indexes[id(command)] for command in step.commands])
+            if isinstance(step, Batch) else (None, [indexes[id(step)]])
+            for step in steps]
+
+def load(data, commands):
+    return [Batch(handler, [commands[index] for index in indexes])
+            if handler is not None else commands[indexes[0]]
+            for handler, indexes in data]
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import logging
+import threading
+import scripts
+
+logger = logging.getLogger('seleniumacros')
+
+class DriverPool(object):
+    '''
+    Pool of started web drivers shared by bridges.
+
+    Bridges lease a driver by browser code on iimInit and return it on
+    iimExit.  By default every driver is used once and quit on release,
+    while drivers started in background keep leases fast, so that jobs never
+    see cookies or storage of each other.
+
+    Drivers used max_uses times more are scrubbed and kept for next lease,
+    which is only safe for jobs which could share a session: WebDriver
+    clears cookies and storage of the current page only, so those of other
+    sites visited before survive scrubbing.
+
+    >>> from httpdriver import HttpDriver
+    >>> started = []
+    >>> def factory():
+    ...     started.append(HttpDriver())
+    ...     return started[-1]
+    >>> pool = DriverPool(warm=False)
+    >>> driver = pool.lease('http', factory)
+    >>> pool.release('http', driver)
+    >>> pool.lease('http', factory) is driver, len(started)
+    (False, 2)
+    >>> pool = DriverPool(max_uses=100, warm=False)
+    >>> driver = pool.lease('http', factory)
+    >>> pool.release('http', driver)
+    >>> pool.lease('http', factory) is driver, len(started)
+    (True, 3)
+
+    '''
+
+    def __init__(self, size=1, max_uses=1, warm=True):
+        # Number of idle drivers kept for each browser
+        self.size = size
+        # Times a driver could be leased before it is recycled, 1 to isolate
+        # every lease
+        self.max_uses = max_uses
+        # Start new drivers in background when pool is drained
+        self.warm = warm
+        self.idle = {}
+        self.starting = {}
+        self.uses = {}
+        self.lock = threading.Lock()
+
+    def prestart(self, browser, factory, count=None):
+        ''' Start drivers until there are count idle drivers of browser '''
+        count = self.size if count is None else count
+        while True:
+            with self.lock:
+                idle = self.idle.setdefault(browser, [])
+                if len(idle) + self.starting.get(browser, 0) >= count:
+                    return
+                self.starting[browser] = self.starting.get(browser, 0) + 1
+            try:
+                logger.info(u'Prestarting driver %s' % browser)
+                driver = factory()
+            except Exception, e:
+                logger.error(u'Can not start driver %s: %s' % (browser, e))
+                return
+            finally:
+                with self.lock:
+                    self.starting[browser] -= 1
+            with self.lock:
+                self.uses[id(driver)] = 0
+                self.idle[browser].append(driver)
+
+    def lease(self, browser, factory):
+        ''' Get a healthy driver of browser, start one if pool is empty '''
+        while True:
+            with self.lock:
+                idle = self.idle.get(browser)
+                driver = idle.pop() if idle else None
+            if driver is None:
+                driver = factory()
+                with self.lock:
+                    self.uses[id(driver)] = 0
+                break
+            if self.is_healthy(driver):
+                break
+            logger.warn(u'Discard unhealthy driver %s' % browser)
+            self.discard(driver)
+
+        with self.lock:
+            self.uses[id(driver)] += 1
+        if self.warm:
+            self._refill(browser, factory)
+        return driver
+
+    def release(self, browser, driver):
+        ''' Scrub driver and put it back to pool '''
+        with self.lock:
+            uses = self.uses.get(id(driver), 0)
+            full = len(self.idle.get(browser, [])) >= self.size
+        if uses >= self.max_uses or full:
+            self.discard(driver)
+            return
+        try:
+            self.scrub(driver)
+        except Exception, e:
+            logger.warn(u'Can not scrub driver %s: %s' % (browser, e))
+            self.discard(driver)
+            return
+        with self.lock:
+            self.idle.setdefault(browser, []).append(driver)
+
+    @staticmethod
+    def scrub(driver):
+        '''
+        Close other windows, clear storage and cookies of current page and
+        navigate to a blank page.  Cookies and storage of other sites are
+        kept, see DriverPool.
+        '''
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to_window(handle)
+            driver.close()
+        driver.switch_to_window(handles[0])
+        driver.switch_to_default_content()
+        driver.execute_script(scripts.CLEAR_STORAGE)
+        driver.delete_all_cookies()
+        driver.get('about:blank')
+
+    def is_healthy(self, driver):
+        try:
+            return driver.execute_script(scripts.HEALTH_CHECK) == 1
+        except Exception, e:
+            logger.debug(u'Health check failed: %s' % e)
+            return False
+
+    def discard(self, driver):
+        with self.lock:
+            self.uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception, e:
+            logger.debug(u'Can not quit driver: %s' % e)
+
+    def close(self):
+        ''' Quit all idle drivers '''
+        with self.lock:
+            drivers = [driver for idle in self.idle.values() for driver in idle]
+            self.idle = {}
+        for driver in drivers:
+            self.discard(driver)
+
+    def _refill(self, browser, factory):
+        thread = threading.Thread(target=self.prestart, args=(browser, factory))
+        thread.daemon = True
+        thread.start()
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,569 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+A local HTTP proxy which caches static resources for browsers started by
+Bridge.
+
+Browsers started with fresh profiles have cold caches, so every macro run
+would download the same scripts, styles and images again.  Routing them
+through CachingProxy serves those resources from a store on disk, which
+could be shared by proxies of many bridges and processes.  The store is
+kept under a size limit by evicting least recently used entries, which
+processes sharing it find by scanning the directory under a file lock.
+
+A stored response is only served to requests which send the same values
+of the headers its Vary names, and accept its Content-Encoding, so that
+clients like HttpDriver never get gzip they did not ask for.  Requests with
+Cache-Control no-cache or max-age=0 are forwarded to the origin.
+
+HTTPS is tunneled with CONNECT and can not be cached.
+'''
+
+import os
+import time
+import errno
+import select
+import socket
+import hashlib
+import httplib
+import logging
+import marshal
+import tempfile
+import threading
+import urlparse
+import contextlib
+import collections
+import SocketServer
+import BaseHTTPServer
+from email.utils import parsedate_tz, mktime_tz
+import cachedir
+
+try:
+    import fcntl
+except ImportError:
+    # Stores are not locked on Windows, processes may exceed size limit
+    fcntl = None
+
+logger = logging.getLogger('seleniumacros')
+
+DEFAULT_DIRECTORY = cachedir.user_cache_directory('proxy')
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# Part of max size a process stores before it scans the store again, which
+# bounds how much processes sharing the store could exceed the limit by
+RESCAN_RATIO = 0.05
+
+# Seconds to keep resources which have validators but no explicit lifetime
+HEURISTIC_TTL = 3600
+# Seconds to wait for origin servers
+TIMEOUT = 60
+
+HOP_BY_HOP_HEADERS = frozenset(('connection', 'keep-alive', 'proxy-connection',
+        'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+        'transfer-encoding', 'upgrade'))
+
+def parse_address(address):
+    '''
+    >>> parse_address('127.0.0.1:3128')
+    ('127.0.0.1', 3128)
+    >>> parse_address('proxy.example.com')
+    ('proxy.example.com', 8080)
+
+    '''
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address, 8080
+
+def freshness(headers, now=None):
+    '''
+    Return seconds a response could be served from cache, 0 if it must not
+    be cached.  headers is a dict with lower case names.
+
+    >>> freshness({'cache-control': 'public, max-age=600'})
+    600
+    >>> freshness({'cache-control': 'private, max-age=600'})
+    0
+    >>> freshness({'content-type': 'text/css', 'last-modified': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+    3600
+    >>> freshness({'content-type': 'text/html', 'last-modified': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+    0
+    >>> freshness({'expires': 'Thu, 01 Jan 1970 00:01:40 GMT'}, now=40)
+    60
+
+    '''
+    if 'set-cookie' in headers or headers.get('vary') == '*':
+        return 0
+    directives = {}
+    for directive in headers.get('cache-control', '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name] = value.strip('"')
+    if set(('no-store', 'no-cache', 'private')) & set(directives):
+        return 0
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return max(int(directives[name]), 0)
+            except ValueError:
+                return 0
+    if 'expires' in headers:
+        expires = parsedate_tz(headers['expires'])
+        if expires is None:
+            return 0
+        now = time.time() if now is None else now
+        return max(int(mktime_tz(expires) - now), 0)
+    # Pages change between runs, but static resources with validators
+    # rarely do
+    if 'last-modified' in headers or 'etag' in headers:
+        if not headers.get('content-type', '').startswith('text/html'):
+            return HEURISTIC_TTL
+    return 0
+
+def request_max_age(headers):
+    '''
+    Return seconds a cached response could have been stored for to serve a
+    request, None if any fresh one would do.  headers is a dict with lower
+    case names.
+
+    >>> request_max_age({'cache-control': 'max-age=0'}), request_max_age({'pragma': 'no-cache'})
+    (0, 0)
+    >>> request_max_age({'cache-control': 'no-cache'}), request_max_age({'cache-control': 'max-age=60'})
+    (0, 60)
+    >>> request_max_age({})
+
+    '''
+    directives = {}
+    for directive in headers.get('cache-control', '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name] = value.strip('"')
+    if 'no-cache' in directives or \
+            'no-cache' in headers.get('pragma', '').lower():
+        return 0
+    if 'max-age' in directives:
+        try:
+            return max(int(directives['max-age']), 0)
+        except ValueError:
+            return 0
+    return None
+
+def accepts_encoding(headers, coding):
+    '''
+    Return if a request with headers accepts content coding.
+
+    >>> accepts_encoding({'accept-encoding': 'gzip, deflate'}, 'gzip')
+    True
+    >>> accepts_encoding({}, 'gzip'), accepts_encoding({'accept-encoding': 'gzip;q=0'}, 'gzip')
+    (False, False)
+    >>> accepts_encoding({}, 'identity'), accepts_encoding({'accept-encoding': '*'}, 'br')
+    (True, True)
+
+    '''
+    coding = coding.strip().lower()
+    if coding in ('', 'identity'):
+        return True
+    for item in headers.get('accept-encoding', '').lower().split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip() in (coding, '*'):
+            params = params.replace(' ', '')
+            if not params.startswith('q='):
+                return True
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+def vary_names(headers):
+    '''
+    Return sorted request headers named by Vary of response headers, a dict
+    with lower case names.
+
+    >>> vary_names({'vary': 'User-Agent, accept-encoding'})
+    ['accept-encoding', 'user-agent']
+
+    '''
+    return sorted(set(name.strip().lower() for name in
+            headers.get('vary', '').split(',') if name.strip()))
+
+def vary_digest(names, headers):
+    ''' Digest of values of request headers names, not to keep cookies '''
+    return hashlib.sha1(repr([(name, headers.get(name, '').strip())
+            for name in names])).hexdigest()
+
+class CachingProxy(object):
+    '''
+    Threaded caching proxy listening on a local port.
+
+    >>> import urllib2, shutil, SimpleHTTPServer
+    >>> root = tempfile.mkdtemp()
+    >>> open(os.path.join(root, 'style.css'), 'wb').write('p {}')
+    >>> class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    ...     def translate_path(self, path):
+    ...         return os.path.join(root, path.lstrip('/'))
+    ...     def log_message(self, *args):
+    ...         pass
+    >>> origin = _Server(('127.0.0.1', 0), Handler)
+    >>> thread = threading.Thread(target=origin.serve_forever)
+    >>> thread.daemon = True
+    >>> thread.start()
+    >>> url = 'http://127.0.0.1:%d/style.css' % origin.server_address[1]
+
+    >>> proxy = CachingProxy(os.path.join(root, 'cache'))
+    >>> proxy.start()
+    >>> opener = urllib2.build_opener(urllib2.ProxyHandler({'http': proxy.address}))
+    >>> [opener.open(url).read() for i in range(3)]
+    ['p {}', 'p {}', 'p {}']
+    >>> proxy.stats()['hits'], proxy.stats()['misses']
+    (2, 1)
+    >>> reload = urllib2.Request(url, headers={'Cache-Control': 'max-age=0'})
+    >>> opener.open(reload).info()['X-Cache']
+    'MISS'
+
+    >>> proxy.stop()
+    >>> origin.shutdown()
+
+    Proxies sharing a store keep it under max_size together:
+
+    >>> a = CachingProxy(os.path.join(root, 'shared'), max_size=1000)
+    >>> b = CachingProxy(os.path.join(root, 'shared'), max_size=1000)
+    >>> for i in range(6):
+    ...     (a, b)[i % 2].store('http://a.com/%d' % i, 200, 'OK', [], 'x' * 300, 60)
+    >>> sorted(b.entries) == sorted(b._scan()[0]), b.size <= 1000
+    (True, True)
+
+    Variants named by Vary, and encodings not accepted, are not served:
+
+    >>> headers = [('Vary', 'Accept-Language'), ('Content-Encoding', 'gzip')]
+    >>> request = {'accept-language': 'en', 'accept-encoding': 'gzip'}
+    >>> a.store('http://a.com/v', 200, 'OK', headers, 'x', 60, request)
+    >>> a.lookup('http://a.com/v', request)[3]
+    'x'
+    >>> a.lookup('http://a.com/v', {'accept-language': 'de', 'accept-encoding': 'gzip'})
+    >>> a.lookup('http://a.com/v', {'accept-language': 'en'})
+    >>> shutil.rmtree(root)
+
+    '''
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_size=DEFAULT_MAX_SIZE,
+            upstream=None, host='127.0.0.1', port=0):
+        self.directory = directory
+        self.max_size = max_size
+        # (host, port) of another proxy to chain requests to
+        self.upstream = upstream
+        self.host = host
+        self.port = port
+        self.server = None
+        self.lock = threading.Lock()
+        # Entry sizes by key, least recently used first
+        self.size = 0
+        self.counters = dict.fromkeys(('hits', 'misses', 'stored',
+                'evictions', 'bytes_hit', 'bytes_missed'), 0)
+        # Bytes stored since store was scanned
+        self.written = 0
+        # If directory is private to the user, checked on first use
+        self.private = None
+        self.entries, self.size = self._scan()
+
+    @property
+    def address(self):
+        return '%s:%d' % (self.host, self.port)
+
+    def start(self):
+        ''' Start serving in a background thread unless it is started '''
+        if self.server is not None:
+            return
+        self.server = _Server((self.host, self.port), _Handler)
+        self.server.proxy = self
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info(u'Caching proxy is listening on %s' % self.address)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stats(self):
+        ''' Return cache counters and current size of store '''
+        with self.lock:
+            stats = dict(self.counters)
+            stats['size'] = self.size
+            stats['entries'] = len(self.entries)
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = float(stats['hits']) / requests if requests else 0.0
+        return stats
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    # Store
+    def lookup(self, url, request_headers={}):
+        '''
+        Return fresh (status, reason, headers, body) of url which could be
+        served to a request with headers, a dict with lower case names, or
+        None.
+        '''
+        max_age = request_max_age(request_headers)
+        if max_age == 0 or not self._usable():
+            # Request must be revalidated with origin
+            return None
+        key = self._key(url)
+        try:
+            with open(self._filename(key), 'rb') as f:
+                cached_url, status, reason, headers, body, expires, stored, \
+                        names, digest = marshal.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                logger.warn(u'Can not read proxy cache: %s' % e)
+            return None
+        except Exception, e:
+            logger.warn(u'Can not load proxy cache: %s' % e)
+            return None
+        now = time.time()
+        if cached_url != url or expires < now:
+            return None
+        if max_age is not None and now - stored > max_age:
+            return None
+        encoding = dict((name.lower(), value) for name, value in headers) \
+                .get('content-encoding', '')
+        if vary_digest(names, request_headers) != digest or \
+                not accepts_encoding(request_headers, encoding):
+            # Variant of another client, a response for this one replaces it
+            return None
+        with self.lock:
+            if key in self.entries:
+                # Mark as recently used
+                self.entries[key] = self.entries.pop(key)
+        try:
+            # Other processes order entries by modification time
+            os.utime(self._filename(key), None)
+        except OSError:
+            pass
+        return status, reason, headers, body
+
+    def store(self, url, status, reason, headers, body, seconds, request_headers={}):
+        ''' Store response to a request with headers for seconds '''
+        if not self._usable():
+            return
+        key = self._key(url)
+        names = vary_names(dict((name.lower(), value) for name, value in headers))
+        now = time.time()
+        data = marshal.dumps((url, status, reason, headers, body, now + seconds,
+                now, names, vary_digest(names, request_headers)))
+        try:
+            # Write to a temporary file first, so that other proxies sharing
+            # the directory never read a partial entry
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp, self._filename(key))
+        except (IOError, OSError), e:
+            logger.warn(u'Can not write proxy cache: %s' % e)
+            return
+        with self.lock:
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.counters['stored'] += 1
+            self.written += len(data)
+            # Entries stored by other processes are only seen by scanning
+            due = self.size > self.max_size or \
+                    self.written > self.max_size * RESCAN_RATIO
+        if due:
+            self._collect()
+
+    def _usable(self):
+        if self.private is None:
+            self.private = cachedir.make_private(self.directory)
+        return self.private
+
+    @contextlib.contextmanager
+    def _store_lock(self):
+        ''' Lock store against other processes '''
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _collect(self):
+        '''
+        Scan store and drop least recently used entries of all processes
+        until size is under limit.
+        '''
+        with self._store_lock():
+            entries, size = self._scan()
+            evicted = 0
+            while size > self.max_size and entries:
+                key, entry_size = entries.popitem(last=False)
+                size -= entry_size
+                try:
+                    os.remove(self._filename(key))
+                    evicted += 1
+                except OSError:
+                    pass
+        with self.lock:
+            self.entries, self.size = entries, size
+            self.written = 0
+            self.counters['evictions'] += evicted
+
+    def _scan(self):
+        ''' Return sizes of entries in store, oldest first, and their total '''
+        entries, total = collections.OrderedDict(), 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries, total
+        files = []
+        for name in names:
+            if name.endswith('.cache'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name[:-len('.cache')], stat.st_size))
+        for mtime, key, size in sorted(files):
+            entries[key] = size
+            total += size
+        return entries, total
+
+    def _key(self, url):
+        # Version of entry format, entries of older versions are not found
+        return hashlib.sha1('2:' + url).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    ''' Forward a request to origin or upstream proxy, caching GET responses '''
+
+    # Close connection after every response, so that responses need not be
+    # chunked
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        no_store = 'no-store' in self.headers.get('Cache-Control', '')
+        request_headers = dict((name.lower(), value) for name, value in self.headers.items())
+        cached = None if no_store else proxy.lookup(self.path, request_headers)
+        if cached is not None:
+            status, reason, headers, body = cached
+            proxy.count('hits')
+            proxy.count('bytes_hit', len(body))
+            self._respond(status, reason, headers + [('X-Cache', 'HIT')], body)
+            return
+        proxy.count('misses')
+        response = self._forward()
+        if response is None:
+            return
+        status, reason, headers, body = response
+        proxy.count('bytes_missed', len(body))
+        if status == 200 and not no_store and \
+                'authorization' not in self.headers:
+            seconds = freshness(dict((name.lower(), value) for name, value in headers))
+            if seconds > 0:
+                proxy.store(self.path, status, reason, headers, body, seconds,
+                        request_headers)
+        self._respond(status, reason, headers + [('X-Cache', 'MISS')], body)
+
+    def do_POST(self):
+        response = self._forward()
+        if response is not None:
+            self._respond(*response)
+
+    do_HEAD = do_PUT = do_DELETE = do_OPTIONS = do_PATCH = do_POST
+
+    def do_CONNECT(self):
+        upstream = self.server.proxy.upstream
+        try:
+            if upstream:
+                target = socket.create_connection(upstream, TIMEOUT)
+                target.sendall('CONNECT %s HTTP/1.0\r\n\r\n' % self.path)
+                reply = target.recv(4096)
+                if not reply.split(' ', 2)[1:2] == ['200']:
+                    raise socket.error('Upstream refused CONNECT')
+            else:
+                target = socket.create_connection(parse_address(self.path), TIMEOUT)
+        except socket.error, e:
+            self.send_error(502, str(e))
+            return
+        self.send_response(200, 'Connection established')
+        self.end_headers()
+        self._tunnel(self.connection, target)
+
+    def log_message(self, format, *args):
+        logger.debug(u'Proxy: ' + format % args)
+
+    def _forward(self):
+        ''' Return (status, reason, headers, body) from origin or None '''
+        url = urlparse.urlsplit(self.path)
+        if url.scheme != 'http':
+            self.send_error(400, 'Only http URLs are proxied')
+            return None
+        upstream = self.server.proxy.upstream
+        if upstream:
+            host, port = upstream
+            path = self.path
+        else:
+            host, port = url.hostname, url.port or 80
+            path = urlparse.urlunsplit(('', '', url.path or '/', url.query, ''))
+        headers = dict((name, value) for name, value in self.headers.items()
+                if name.lower() not in HOP_BY_HOP_HEADERS)
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        body = self.rfile.read(length) if length else None
+        connection = httplib.HTTPConnection(host, port, timeout=TIMEOUT)
+        try:
+            connection.request(self.command, path, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (socket.error, httplib.HTTPException), e:
+            self.send_error(502, str(e))
+            return None
+        finally:
+            connection.close()
+        headers = [(name, value) for name, value in response.getheaders()
+                if name.lower() not in HOP_BY_HOP_HEADERS and
+                name.lower() != 'content-length']
+        return response.status, response.reason, headers, data
+
+    def _respond(self, status, reason, headers, body):
+        self.send_response(status, reason)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _tunnel(self, client, target):
+        sockets = [client, target]
+        try:
+            while True:
+                readable, _, failed = select.select(sockets, [], sockets, TIMEOUT)
+                if failed or not readable:
+                    break
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    (target if sock is client else client).sendall(data)
+        except socket.error:
+            pass
+        finally:
+            target.close()
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Policy to recover macros from crashed browsers.
+
+When a command fails with an error the policy retries, Bridge restarts the
+driver and resumes the macro from its last resume point instead of line 1.
+Resume points are taken after every URL and CHECKPOINT command: the current
+URL, cookies, storage, variables and extracted data, so that the replay
+starts from the same page and state.
+'''
+
+import socket
+import httplib
+import urllib2
+from selenium.common.exceptions import WebDriverException, \
+        NoSuchElementException, StaleElementReferenceException, \
+        TimeoutException, ElementNotVisibleException, InvalidSelectorException, \
+        UnexpectedAlertPresentException, NoSuchFrameException, \
+        NoSuchWindowException, InvalidElementStateException
+
+class RetryPolicy(object):
+    '''
+    Which errors are retried and how many times per macro run.
+
+    >>> policy = RetryPolicy(max_retries=1)
+    >>> policy.should_retry(socket.error(111, 'Connection refused'), 0)
+    True
+    >>> policy.should_retry(WebDriverException('chrome not reachable'), 0)
+    True
+    >>> policy.should_retry(WebDriverException('chrome not reachable'), 1)
+    False
+    >>> policy.should_retry(TimeoutException('Timed out receiving message'), 0)
+    False
+    >>> policy.should_retry(WebDriverException('Element is not clickable'), 0)
+    False
+    >>> policy.should_retry(ValueError('Invalid argument format'), 0)
+    False
+
+    '''
+
+    # Errors of lost connections to drivers
+    CRASH_ERRORS = (socket.error, httplib.HTTPException, urllib2.URLError)
+    # Messages of WebDriverException once browser or its session is gone
+    SESSION_LOST_MESSAGES = ('no such session', 'invalid session id',
+            'session deleted', 'not reachable', 'disconnected',
+            'without establishing a connection', 'browser has closed',
+            'unable to connect')
+    # Errors of pages rather than drivers, which a restart does not fix
+    PAGE_ERRORS = (NoSuchElementException, StaleElementReferenceException,
+            TimeoutException, ElementNotVisibleException, InvalidSelectorException,
+            UnexpectedAlertPresentException, NoSuchFrameException,
+            NoSuchWindowException, InvalidElementStateException)
+
+    def __init__(self, max_retries=2, delay=1, errors=CRASH_ERRORS,
+            ignored=PAGE_ERRORS, messages=SESSION_LOST_MESSAGES):
+        # Restarts per macro run
+        self.max_retries = max_retries
+        # Seconds to wait before restarting driver
+        self.delay = delay
+        self.errors = errors
+        self.ignored = ignored
+        # Other WebDriverException are retried if message contains one of these
+        self.messages = messages
+
+    def should_retry(self, error, retries):
+        ''' Return if a macro which has been retried retries times is retried on error '''
+        if retries >= self.max_retries or isinstance(error, self.ignored):
+            return False
+        if isinstance(error, self.errors):
+            return True
+        if isinstance(error, WebDriverException):
+            message = (error.msg or u'').lower()
+            return any(text in message for text in self.messages)
+        return False
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
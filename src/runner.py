@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Run batches of macros in parallel.
+
+Jobs are spread across worker processes, where every worker owns its own
+Interface, Bridge and browser.
+
+    $ python runner.py -p 4 -b fx -t 120 jobs.txt > results.txt
+
+Every line of jobs file is a JSON object like:
+
+    {"macro": "/path/to/FillForm.iim", "variables": {"NAME": "Tom"}}
+
+Optional keys are "group", which is used to schedule jobs fairly between
+groups, and "timeout" in seconds.
+
+Between jobs the browser of a worker is scrubbed: other windows are closed
+and cookies and storage of its page cleared.  Cookies of other sites the
+previous job visited survive that, so jobs of different users should be run
+with --session restart, which starts a new browser for every job.  With
+--session keep jobs continue on the page and session left by the previous
+one, which lets --navigation skip loading it again.
+'''
+
+import sys
+import json
+import time
+import signal
+import logging
+import optparse
+import multiprocessing
+from multiprocessing import util
+from bridge import Bridge
+from error import Timeout
+from navigation import ALWAYS, MODES
+
+logger = logging.getLogger('seleniumacros')
+
+# What is left of the session of a job for the next one on the same worker
+SCRUB, RESTART, KEEP = 'scrub', 'restart', 'keep'
+SESSION_MODES = (SCRUB, RESTART, KEEP)
+
+class Job(object):
+    ''' A macro to be played with variables '''
+
+    def __init__(self, macro, variables=None, group=None, timeout=None):
+        self.macro = macro
+        self.variables = variables or {}
+        # Jobs of different groups are interleaved, default group is macro
+        self.group = group if group is not None else macro
+        self.timeout = timeout
+
+class JobResult(object):
+    ''' Return code, errors and extracts of a played job '''
+
+    def __init__(self, index, job, retcode, errors, extracts, elapsed, pid,
+            retries=0, time_lost=0.0, avoided_loads=0):
+        self.index = index
+        self.job = job
+        self.retcode = retcode
+        self.errors = errors
+        self.extracts = extracts
+        self.elapsed = elapsed
+        self.pid = pid
+        # Driver restarts and seconds of commands played again after them
+        self.retries = retries
+        self.time_lost = time_lost
+        # Page loads skipped or refreshed by navigation policy
+        self.avoided_loads = avoided_loads
+
+    def to_dict(self):
+        return {
+            'index':     self.index,
+            'macro':     self.job.macro,
+            'variables': self.job.variables,
+            'retcode':   self.retcode,
+            'errors':    self.errors,
+            'extracts':  self.extracts,
+            'elapsed':   self.elapsed,
+            'pid':       self.pid,
+            'retries':   self.retries,
+            'time_lost': self.time_lost,
+            'avoided_loads': self.avoided_loads,
+        }
+
+class Stats(object):
+    '''
+    Live throughput statistics of a batch.
+
+    >>> stats = Stats(started=0)
+    >>> stats.add(JobResult(0, None, Bridge.OK, [], [], 2.0, 1), now=4)
+    >>> stats.add(JobResult(1, None, Bridge.TIMEOUT, [], [], 4.0, 1, 1, 1.5), now=4)
+    >>> stats.completed, stats.succeeded, stats.failed, stats.timeouts
+    (2, 1, 0, 1)
+    >>> stats.retries, stats.time_lost
+    (1, 1.5)
+    >>> stats.throughput(now=4), stats.average()
+    (0.5, 3.0)
+
+    '''
+
+    def __init__(self, total=0, started=None):
+        self.total = total
+        self.started = time.time() if started is None else started
+        self.completed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.busy = 0.0
+        self.retries = 0
+        self.time_lost = 0.0
+        self.avoided_loads = 0
+        self.now = self.started
+
+    def add(self, result, now=None):
+        self.now = time.time() if now is None else now
+        self.completed += 1
+        self.busy += result.elapsed
+        self.retries += result.retries
+        self.time_lost += result.time_lost
+        self.avoided_loads += result.avoided_loads
+        if result.retcode == Bridge.OK:
+            self.succeeded += 1
+        elif result.retcode == Bridge.TIMEOUT:
+            self.timeouts += 1
+        else:
+            self.failed += 1
+
+    def throughput(self, now=None):
+        ''' Completed jobs per second '''
+        elapsed = (self.now if now is None else now) - self.started
+        return float(self.completed) / elapsed if elapsed > 0 else 0.0
+
+    def average(self):
+        ''' Average seconds per job '''
+        return self.busy / self.completed if self.completed else 0.0
+
+    def __str__(self):
+        return '%d/%d done, %d ok, %d failed, %d timeout, %.2f jobs/s, %.2fs/job, ' \
+                '%d retries, %.2fs lost, %d loads avoided' % (self.completed,
+                self.total, self.succeeded, self.failed, self.timeouts,
+                self.throughput(), self.average(), self.retries, self.time_lost,
+                self.avoided_loads)
+
+def interleave(jobs):
+    '''
+    Order jobs round robin by group, so that a large group does not delay
+    jobs of other groups.
+
+    >>> jobs = [Job('a.iim'), Job('a.iim'), Job('a.iim'), Job('b.iim')]
+    >>> [jobs.index(job) for index, job in interleave(jobs)]
+    [0, 3, 1, 2]
+
+    '''
+    groups, queues = [], {}
+    for index, job in enumerate(jobs):
+        if job.group not in queues:
+            groups.append(job.group)
+            queues[job.group] = []
+        queues[job.group].append((index, job))
+
+    ordered = []
+    depth = 0
+    while len(ordered) < len(jobs):
+        for group in groups:
+            if depth < len(queues[group]):
+                ordered.append(queues[group][depth])
+        depth += 1
+    return ordered
+
+# Interface owned by worker process, session mode and if it played a job
+_interface = None
+_session = SCRUB
+_played = False
+# If alarm of job timeout has fired
+_alarmed = False
+
+def _init_worker(browser, cache_directory=None, retries=0, navigation=ALWAYS,
+        session=SCRUB):
+    global _interface, _session
+    from interface import Interface
+    from proxy import CachingProxy
+    from retry import RetryPolicy
+    from navigation import NavigationPolicy
+
+    # Let parent process handle Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Proxies of workers share the store on disk
+    cache_proxy = CachingProxy(cache_directory) if cache_directory else None
+    # Restart crashed browser and resume macro up to retries times
+    retry_policy = RetryPolicy(retries) if retries > 0 else None
+    # Skip loading start page of jobs again if allowed
+    navigation_policy = NavigationPolicy(navigation) if navigation != ALWAYS else None
+    _interface = Interface(cache_proxy=cache_proxy, retry_policy=retry_policy,
+            navigation_policy=navigation_policy)
+    _interface.iimInit('-%s' % browser)
+    _session = session
+    util.Finalize(None, _exit_worker, exitpriority=10)
+
+def _exit_worker():
+    try:
+        _interface.iimExit()
+    except Exception, e:
+        logger.warn(u'Can not exit browser: %s' % e)
+
+def _on_alarm(signum, frame):
+    global _alarmed
+    _alarmed = True
+    raise Timeout, 'Job has been running too much time'
+
+def _prepare_session(bridge):
+    ''' Leave session of previous job as session mode says '''
+    if not _played or _session == KEEP:
+        return
+    if _session == SCRUB:
+        try:
+            bridge.scrub_driver()
+            return
+        except Exception, e:
+            logger.warn(u'Can not scrub browser, restart it: %s' % e)
+    bridge.restart_driver()
+
+def _run_job(item):
+    global _played, _alarmed
+    (index, job), timeout = item
+    bridge = _interface.bridge
+    try:
+        _prepare_session(bridge)
+    except Exception, e:
+        # Job fails on its own if browser is gone
+        logger.error(u'Can not prepare browser for job %d: %s' % (index, e))
+    _played = True
+    bridge.reset_variables()
+    for name, value in job.variables.items():
+        _interface.iimSet(name, value)
+
+    timeout = job.timeout or timeout
+    # Signals are not available on Windows, where timeout only applies to
+    # macro itself
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    started = time.time()
+    _alarmed = False
+    try:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, _on_alarm)
+            signal.alarm(int(timeout))
+        retcode = _interface.iimPlay(job.macro, timeout)
+    except Timeout, e:
+        bridge.errors.append(e)
+        retcode = Bridge.TIMEOUT
+    except Exception, e:
+        bridge.errors.append(e)
+        retcode = Bridge.FAIL
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+    elapsed = time.time() - started
+    if _alarmed:
+        # Alarm may have interrupted a call to driver half way
+        logger.warn(u'Restart browser after job %d timed out' % index)
+        try:
+            bridge.restart_driver()
+        except Exception, e:
+            logger.error(u'Can not restart browser: %s' % e)
+    if retcode != Bridge.OK and \
+            any(isinstance(error, Timeout) for error in bridge.errors):
+        # Timeout raised inside macro is recorded as a failed command
+        retcode = Bridge.TIMEOUT
+
+    retries, time_lost = bridge.performance.retry_time()
+    return JobResult(index, job, retcode,
+            [unicode(error) for error in bridge.errors],
+            list(bridge.extracts), elapsed, multiprocessing.current_process().pid,
+            retries, time_lost, len(bridge.performance.avoided_loads))
+
+class Runner(object):
+    '''
+    Play jobs in a pool of worker processes.
+
+    >>> runner = Runner(processes=4, browser=Bridge.FIREFOX) # doctest: +SKIP
+    >>> for result in runner.run([Job('FillForm.iim', {'NAME': 'Tom'})]): # doctest: +SKIP
+    ...     print result.retcode, result.extracts
+
+    '''
+
+    def __init__(self, processes=4, browser=Bridge.FIREFOX, timeout=0,
+            max_jobs_per_worker=None, cache_directory=None, retries=0,
+            navigation=ALWAYS, session=SCRUB):
+        self.processes = processes
+        self.browser = browser
+        # Default timeout in seconds of each job, 0 means unlimited
+        self.timeout = timeout
+        # Restart worker and its browser after playing this number of jobs
+        self.max_jobs_per_worker = max_jobs_per_worker
+        # Directory of caching proxies of workers, None to connect directly
+        self.cache_directory = cache_directory
+        # Times a crashed browser is restarted to resume a job
+        self.retries = retries
+        # Navigation mode of URL GOTO to a page browser is on already
+        self.navigation = navigation
+        # Session mode between jobs of a worker, see SESSION_MODES
+        if session not in SESSION_MODES:
+            raise ValueError, 'Invalid session mode: %s' % session
+        self.session = session
+        self.stats = None
+
+    def run(self, jobs, callback=None):
+        ''' Yield results in completion order, call callback with stats '''
+        jobs = list(jobs)
+        self.stats = Stats(len(jobs))
+        pool = multiprocessing.Pool(self.processes, _init_worker,
+                (self.browser, self.cache_directory, self.retries, self.navigation,
+                self.session),
+                self.max_jobs_per_worker)
+        try:
+            # chunksize of 1 lets idle workers pull next job as soon as
+            # they are done, so that slow jobs do not hold up a whole chunk
+            items = [(item, self.timeout) for item in interleave(jobs)]
+            for result in pool.imap_unordered(_run_job, items, 1):
+                self.stats.add(result)
+                if callback is not None:
+                    callback(result, self.stats)
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+def load_jobs(lines):
+    jobs = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            data = json.loads(line)
+            jobs.append(Job(data['macro'], data.get('variables'),
+                    data.get('group'), data.get('timeout')))
+    return jobs
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] JOBS_FILE')
+    parser.add_option('-p', '--processes', type='int', default=4,
+            help='number of worker processes [default: %default]')
+    parser.add_option('-b', '--browser', default=Bridge.FIREFOX,
+            help='browser code, e.g. fx, cr or ie [default: %default]')
+    parser.add_option('-t', '--timeout', type='int', default=0,
+            help='seconds before a job times out, 0 means unlimited')
+    parser.add_option('-m', '--max-jobs-per-worker', type='int', default=None,
+            help='restart worker after playing this number of jobs')
+    parser.add_option('-c', '--cache-directory', default=None,
+            help='route browsers through caching proxies storing in directory')
+    parser.add_option('-r', '--retries', type='int', default=0,
+            help='restart crashed browser and resume job up to this many times')
+    parser.add_option('-n', '--navigation', type='choice', default=ALWAYS,
+            choices=MODES, help='URL GOTO to current page: always load, '
+            'skip or refresh it [default: %default]')
+    parser.add_option('-s', '--session', type='choice', default=SCRUB,
+            choices=SESSION_MODES, help='session of previous job on a worker: '
+            'scrub its page, restart browser or keep it [default: %default]')
+    parser.add_option('-q', '--quiet', action='store_true', default=False,
+            help='do not print statistics')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('Jobs file is required')
+
+    jobs = load_jobs(open(args[0], 'rb') if args[0] != '-' else sys.stdin)
+
+    def report(result, stats):
+        if not options.quiet:
+            sys.stderr.write('\r%s' % stats)
+            sys.stderr.flush()
+
+    runner = Runner(options.processes, options.browser, options.timeout,
+            options.max_jobs_per_worker, options.cache_directory, options.retries,
+            options.navigation, options.session)
+    failed = 0
+    for result in runner.run(jobs, report):
+        sys.stdout.write(json.dumps(result.to_dict()) + '\n')
+        sys.stdout.flush()
+        failed += result.retcode != Bridge.OK
+    if not options.quiet:
+        sys.stderr.write('\n')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Browser screenshots taken without holding up the macro.
+
+Only capture talks to the driver on the macro thread.  Base64 decoding,
+conversion to the format of the file and writing it are done by the
+threads of a ScreenshotWriter, whose queue is bounded: once max_pending
+screenshots wait to be written, capturing another blocks until one is
+done, so that a slow disk never piles up screenshots in memory.
+
+Drivers return PNG, other formats are converted with PIL if it is
+installed.
+
+Auditor takes screenshots of failed commands and of every N commands of
+macros played by Bridge.
+'''
+
+import os
+import base64
+import logging
+import tempfile
+import threading
+import collections
+from cStringIO import StringIO
+import scripts
+import clock
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger('seleniumacros')
+
+# Image types of iimTakeBrowserScreenshot: visible part of page or whole page
+VIEWPORT, PAGE = 0, 1
+
+# PIL formats by file extension
+FORMATS = {
+    '.png':  'PNG',
+    '.jpg':  'JPEG',
+    '.jpeg': 'JPEG',
+    '.bmp':  'BMP',
+    '.gif':  'GIF',
+}
+
+def image_format(path):
+    '''
+    Return PIL format of path by its extension.
+
+    >>> image_format('shots/Login.PNG')
+    'PNG'
+    >>> image_format('shots/login.tiff')
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported image format: .tiff
+
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError, 'Unsupported image format: %s' % extension
+    if FORMATS[extension] != 'PNG' and Image is None:
+        raise ValueError, 'PIL is required to save %s images' % extension
+    return FORMATS[extension]
+
+def capture(driver, img_type=VIEWPORT):
+    '''
+    Return base64 PNG of the visible part of page, or whole page which the
+    window is resized to fit for a moment.
+    '''
+    if img_type not in (VIEWPORT, PAGE):
+        raise ValueError, 'Invalid image type: %s' % img_type
+    if img_type == VIEWPORT:
+        return driver.get_screenshot_as_base64()
+    width, height, frame_width, frame_height = driver.execute_script(scripts.PAGE_SIZE)
+    size = driver.get_window_size()
+    driver.set_window_size(width + frame_width, height + frame_height)
+    try:
+        return driver.get_screenshot_as_base64()
+    finally:
+        driver.set_window_size(size['width'], size['height'])
+
+def save(data, path):
+    '''
+    Decode base64 PNG data and write it to path in the format of its
+    extension.  The file is replaced at once, so that it is never seen
+    partially written.
+
+    >>> import shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> png = base64.b64encode('\\x89PNG\\r\\n\\x1a\\n')
+    >>> save(png, os.path.join(directory, 'a', 'shot.png'))
+    >>> open(os.path.join(directory, 'a', 'shot.png'), 'rb').read()[1:4]
+    'PNG'
+    >>> shutil.rmtree(directory)
+
+    '''
+    format = image_format(path)
+    image = base64.b64decode(data)
+    if format != 'PNG':
+        output = StringIO()
+        converted = Image.open(StringIO(image))
+        if format == 'JPEG':
+            converted = converted.convert('RGB')
+        converted.save(output, format)
+        image = output.getvalue()
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image)
+        if os.name == 'nt' and os.path.exists(path):
+            # Files are not replaced by rename on Windows
+            os.remove(path)
+        os.rename(temp, path)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+class ScreenshotWriter(object):
+    '''
+    Threads which save captured screenshots, at most max_pending queued.
+
+    >>> import shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> writer = ScreenshotWriter(workers=2, max_pending=1)
+    >>> png = base64.b64encode('\\x89PNG\\r\\n\\x1a\\n')
+    >>> for i in range(4):
+    ...     writer.submit(png, os.path.join(directory, '%d.png' % i))
+    >>> writer.flush(5)
+    True
+    >>> writer.written, sorted(os.listdir(directory))
+    (4, ['0.png', '1.png', '2.png', '3.png'])
+    >>> writer.close()
+    >>> shutil.rmtree(directory)
+
+    '''
+
+    def __init__(self, workers=2, max_pending=8):
+        self.max_pending = max_pending
+        self.queue = collections.deque()
+        # Screenshots queued or being saved
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        # Screenshots saved, seconds submit was blocked by a full queue and
+        # recent (path, error) of screenshots which could not be saved
+        self.written = 0
+        self.blocked = 0.0
+        self.errors = collections.deque(maxlen=100)
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                    name='ScreenshotWriter-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, data, path):
+        ''' Queue base64 PNG data to be saved to path, wait while queue is full '''
+        # Fail on the macro thread if the file could never be written
+        image_format(path)
+        with self.condition:
+            started = clock.monotonic()
+            while self.pending >= self.max_pending and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                raise ValueError, 'Screenshot writer is closed'
+            self.blocked += clock.monotonic() - started
+            self.queue.append((data, path))
+            self.pending += 1
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        ''' Wait until queued screenshots are saved, return False on timeout '''
+        expires = None if timeout is None else clock.monotonic() + timeout
+        with self.condition:
+            while self.pending:
+                if expires is None:
+                    self.condition.wait()
+                    continue
+                remaining = expires - clock.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self):
+        ''' Save queued screenshots and stop threads '''
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                data, path = self.queue.popleft()
+            saved = False
+            try:
+                save(data, path)
+                saved = True
+            except Exception, e:
+                logger.error(u'Can not save screenshot %s: %s' % (path, e))
+                self.errors.append((path, e))
+            with self.condition:
+                self.written += saved
+                self.pending -= 1
+                self.condition.notify_all()
+
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+def default_writer(start=True):
+    '''
+    Return writer shared by bridges, started on first use, or None if it is
+    not started and start is false.
+    '''
+    global _default_writer
+    with _default_writer_lock:
+        if _default_writer is None and start:
+            _default_writer = ScreenshotWriter()
+        return _default_writer
+
+class Auditor(object):
+    '''
+    Screenshots of failed commands of macros, and of every N-th command if
+    every is N, saved under directory as <macro>-<run>-<line>-<reason>.png.
+
+    >>> auditor = Auditor('shots', every=10)
+    >>> auditor.should_take(9), auditor.should_take(20), Auditor('shots').should_take(10)
+    (False, True, False)
+    >>> auditor.path('/macros/Login.iim', 3, 12, 'failed')
+    'shots/Login-3-L12-failed.png'
+
+    '''
+
+    def __init__(self, directory, every=0, on_failure=True, img_type=VIEWPORT,
+            extension='.png', writer=None):
+        self.directory = directory
+        # Commands between screenshots, 0 to take them of failures only
+        self.every = every
+        self.on_failure = on_failure
+        self.img_type = img_type
+        self.extension = extension
+        image_format('shot' + extension)
+        self.writer = writer
+        # Macro runs, to tell screenshots of looped macros apart
+        self.runs = 0
+        self.lock = threading.Lock()
+
+    def start_run(self):
+        with self.lock:
+            self.runs += 1
+            return self.runs
+
+    def should_take(self, commands):
+        ''' Return if a screenshot is due after commands played '''
+        return self.every > 0 and commands > 0 and commands % self.every == 0
+
+    def path(self, macro_path, run, line, reason):
+        name = os.path.splitext(os.path.basename(macro_path or 'macro'))[0]
+        return os.path.join(self.directory, '%s-%d-L%d-%s%s' % (name, run, line,
+                reason, self.extension))
+
+    def take(self, driver, path):
+        ''' Capture on this thread, save in background '''
+        started = clock.monotonic()
+        data = capture(driver, self.img_type)
+        (self.writer or default_writer()).submit(data, path)
+        return clock.monotonic() - started
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+JavaScript snippets executed in browser by Bridge.
+
+Every snippet is sent with a single execute_script call, so that work which
+would otherwise cost one WebDriver round trip per element stays in browser.
+'''
+
+# Shared helpers to match elements the same way as iMacros TAG command.
+# Attribute values are compared by prefix, TXT is compared by whole text and
+# URL attributes are made absolute before comparing.
+_MATCHER = u'''
+function _text(el) {
+    return (el.innerText || el.textContent || '').replace(/^\\s+|\\s+$/g, '');
+}
+function _absolute(url) {
+    var a = document.createElement('a');
+    a.href = url;
+    return a.href;
+}
+function _attribute(el, name) {
+    if (name == 'class') return el.className;
+    if (name == 'href' || name == 'src' || name == 'action' || name == 'value') {
+        if (typeof el[name] == 'string') return el[name];
+    }
+    return el.getAttribute(name);
+}
+function _matches(el, attrs) {
+    for (var name in attrs) {
+        if (!attrs.hasOwnProperty(name)) continue;
+        var expected = attrs[name];
+        if (name == 'txt') {
+            if (_text(el) != String(expected).replace(/^\\s+|\\s+$/g, '')) return false;
+            continue;
+        }
+        var actual = _attribute(el, name);
+        if (expected === true) {
+            if (!actual) return false;
+            continue;
+        }
+        expected = String(expected);
+        if (name == 'href' || name == 'src' || name == 'action') {
+            expected = _absolute(expected);
+        }
+        if (actual === null || actual === undefined ||
+                String(actual).indexOf(expected) !== 0) return false;
+    }
+    return true;
+}
+function _find(root, pos, selector, attrs) {
+    if (attrs.hasOwnProperty('id') && attrs.id !== true) {
+        // Assume elements can only have unique id
+        return document.getElementById(String(attrs.id));
+    }
+    if (pos < 1) return null;
+    var elements = root.querySelectorAll(selector);
+    for (var i = 0, n = 0; i < elements.length; i++) {
+        if (_matches(elements[i], attrs) && ++n == pos) return elements[i];
+    }
+    return null;
+}
+function _lookup(pos, selector, form, attrs) {
+    var root = document;
+    if (form) {
+        root = _find(document, 1, 'form', form);
+        if (!root) return null;
+    }
+    return _find(root, pos, selector, attrs);
+}
+'''
+
+# Find the POS-th element of TYPE matching ATTR, inside the first form
+# matching FORM if given.  Returns the element or null.
+#
+# arguments: pos, selector, form attributes or null, element attributes
+FIND_ELEMENT = _MATCHER + u'''
+return _lookup(arguments[0], arguments[1], arguments[2], arguments[3]);
+'''
+
+# Extract data from elements found like FIND_ELEMENT, so that consecutive
+# TAG ... EXTRACT= commands cost a single call.  Returns a list with the
+# extracted value of every element, or null if it is not found.
+#
+# arguments: list of [pos, selector, form attributes or null, element
+#            attributes, extract type]
+EXTRACT = _MATCHER + u'''
+function _extract(el, type) {
+    var tag = el.tagName.toLowerCase();
+    switch (type) {
+    case 'TXT':
+        if (tag == 'input' || tag == 'textarea') return el.value;
+        if (tag == 'select') {
+            var option = el.options[el.selectedIndex >= 0 ? el.selectedIndex : 0];
+            return option ? _text(option) : '';
+        }
+        return _text(el);
+    case 'HTM':
+        return el.outerHTML;
+    case 'HREF':
+        return el.href || el.src || '';
+    default:
+        return el.getAttribute(type.toLowerCase()) || '';
+    }
+}
+var specs = arguments[0], values = [];
+for (var i = 0; i < specs.length; i++) {
+    var el = _lookup(specs[i][0], specs[i][1], specs[i][2], specs[i][3]);
+    values.push(el ? _extract(el, specs[i][4]) : null);
+}
+return values;
+'''
+
+# Fill form fields found like FIND_ELEMENT in order, setting values directly
+# and firing input and change events, so that consecutive TAG ... CONTENT=
+# commands cost a single call.  Values are set with the native setter of
+# the element class, since frameworks like React shadow the value property
+# of controlled inputs and ignore assignments to it.  Fields which need real
+# key events (special keys in content, file inputs, inline key handlers or
+# non form controls) are left to WebDriver.
+#
+# Fields are filled until one is not found, which may only appear once the
+# fields before it are filled, so the caller plays it as a separate command.
+# Returns [number of fields filled, status], where status is 'done', 'keys'
+# if the next field needs key events, or 'missing' if the next field is not
+# found.
+#
+# arguments: list of [pos, selector, form attributes or null, element
+#            attributes, content]
+FILL_FORM = _MATCHER + u'''
+function _fire(el, type) {
+    var event = document.createEvent('HTMLEvents');
+    event.initEvent(type, true, true);
+    el.dispatchEvent(event);
+}
+function _option(select, content) {
+    var options = select.options;
+    for (var i = 0; i < options.length; i++) {
+        if (content.charAt(0) == '%') {
+            if (options[i].value == content.substring(1).replace(/^\\s+|\\s+$/g, '')) return options[i];
+        } else {
+            var text = content.charAt(0) == '$' ? content.substring(1) : content;
+            if (_text(options[i]) == text.replace(/^\\s+|\\s+$/g, '')) return options[i];
+        }
+    }
+    return null;
+}
+function _fill(el, content) {
+    var tag = el.tagName.toLowerCase();
+    var type = (el.getAttribute('type') || 'text').toLowerCase();
+    if (tag == 'input' && (type == 'checkbox' || type == 'radio')) {
+        if (el.checked != (content == 'YES')) el.click();
+        return true;
+    }
+    if (tag == 'select') {
+        var values = content.split(':');
+        if (!el.multiple) values = values.slice(-1);
+        for (var i = 0; i < values.length; i++) {
+            var option = _option(el, values[i]);
+            if (option) option.selected = true;
+        }
+        _fire(el, 'change');
+        return true;
+    }
+    if ((tag != 'input' && tag != 'textarea') || type == 'file' ||
+            /[\\ue000-\\ue0ff]/.test(content) ||
+            el.onkeydown || el.onkeypress || el.onkeyup) {
+        return false;
+    }
+    var proto = tag == 'textarea' ? HTMLTextAreaElement.prototype :
+            HTMLInputElement.prototype;
+    var descriptor = Object.getOwnPropertyDescriptor(proto, 'value');
+    if (descriptor && descriptor.set) {
+        descriptor.set.call(el, content);
+    } else {
+        el.value = content;
+    }
+    _fire(el, 'input');
+    _fire(el, 'change');
+    return true;
+}
+var specs = arguments[0];
+for (var i = 0; i < specs.length; i++) {
+    // Look fields up one by one, filling one may add or replace the next
+    var el = _lookup(specs[i][0], specs[i][1], specs[i][2], specs[i][3]);
+    if (!el) return [i, 'missing'];
+    if (!_fill(el, specs[i][4])) return [i, 'keys'];
+}
+return [specs.length, 'done'];
+'''
+
+# Report if page is ready for next command: document is loaded, there is no
+# pending XMLHttpRequest or fetch and DOM has not changed for a while.
+# Attributes are not watched, since spinners and carousels change style and
+# class attributes without end.
+# Hooks are installed once per document on first call.
+#
+# arguments: milliseconds without DOM mutations, if interactive document is
+#            ready enough
+PAGE_READY = u'''
+var quiet = arguments[0], eager = arguments[1];
+var now = function() { return new Date().getTime(); };
+if (!window.__seleniumacros_ready) {
+    var state = window.__seleniumacros_ready = {
+        pending: 0, mutated: 0, unloading: false
+    };
+    var XHR = window.XMLHttpRequest;
+    if (XHR && XHR.prototype.addEventListener) {
+        var send = XHR.prototype.send;
+        XHR.prototype.send = function() {
+            var done = false;
+            var finish = function() {
+                if (!done) { done = true; state.pending--; }
+            };
+            state.pending++;
+            this.addEventListener('loadend', finish);
+            try {
+                return send.apply(this, arguments);
+            } catch (e) {
+                finish();
+                throw e;
+            }
+        };
+    }
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function() {
+            state.pending++;
+            var finish = function() { state.pending--; };
+            return fetch.apply(this, arguments).then(
+                function(response) { finish(); return response; },
+                function(error) { finish(); throw error; });
+        };
+    }
+    if (window.MutationObserver) {
+        new MutationObserver(function() { state.mutated = now(); }).observe(
+            document, {childList: true, subtree: true, characterData: true});
+    }
+    if (window.addEventListener) {
+        window.addEventListener('beforeunload', function() {
+            state.unloading = true;
+        }, false);
+    }
+}
+var state = window.__seleniumacros_ready;
+return (document.readyState == 'complete' ||
+        eager && document.readyState == 'interactive') && !state.unloading &&
+    state.pending <= 0 && now() - state.mutated >= quiet;
+'''
+
+# Return local and session storage of current page as
+# {local: {key: value}, session: {key: value}}
+SNAPSHOT_STORAGE = u'''
+function _copy(storage) {
+    var items = {};
+    try {
+        for (var i = 0; i < storage.length; i++) {
+            var key = storage.key(i);
+            items[key] = storage.getItem(key);
+        }
+    } catch (e) {}
+    return items;
+}
+return {local: _copy(window.localStorage), session: _copy(window.sessionStorage)};
+'''
+
+# Put items into local and session storage of current page
+#
+# arguments: local storage items, session storage items
+RESTORE_STORAGE = u'''
+var storages = [[window.localStorage, arguments[0]], [window.sessionStorage, arguments[1]]];
+for (var i = 0; i < storages.length; i++) {
+    try {
+        for (var key in storages[i][1]) {
+            storages[i][0].setItem(key, storages[i][1][key]);
+        }
+    } catch (e) {}
+}
+'''
+
+# Report a live driver, 1 is returned
+HEALTH_CHECK = u'''
+return 1;
+'''
+
+# Clear local and session storage of current page
+CLEAR_STORAGE = u'''
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+'''
+
+# Open a blank window, which WebDriver lists in window handles
+OPEN_WINDOW = u'''
+window.open('about:blank', '_blank');
+'''
+
+# Start loading a URL in current window without waiting for it, so that a
+# driver shared by several windows is not blocked by page loads.  Old
+# document is marked to tell it from the new one.
+#
+# arguments: URL
+NAVIGATE = u'''
+window.__seleniumacros_leaving = true;
+window.location.href = arguments[0];
+'''
+
+# Report if page loading started by NAVIGATE is complete
+NAVIGATED = u'''
+return !window.__seleniumacros_leaving && document.readyState == 'complete';
+'''
+
+# Return [width, height] of whole page and [width, height] the window is
+# larger than its viewport by, to resize the window for a full page screenshot
+PAGE_SIZE = u'''
+var root = document.documentElement, body = document.body || root;
+return [Math.max(root.scrollWidth, body.scrollWidth, window.innerWidth),
+        Math.max(root.scrollHeight, body.scrollHeight, window.innerHeight),
+        window.outerWidth - window.innerWidth,
+        window.outerHeight - window.innerHeight];
+'''
+
+# Report readyState of document, or 'leaving' once NAVIGATE started to
+# leave it
+LOAD_STATE = u'''
+return window.__seleniumacros_leaving ? 'leaving' : document.readyState;
+'''
+
+# List frames of page in document order, which FRAME F=n counts, as
+# [[path of frame indexes from top window, name or id]].  Frames of other
+# origins are listed without their own frames.
+FRAME_TREE = u'''
+var frames = [];
+function _walk(win, path) {
+    var elements;
+    try {
+        elements = win.document.querySelectorAll('frame, iframe');
+    } catch (e) {
+        return;
+    }
+    for (var i = 0; i < elements.length; i++) {
+        var framePath = path.concat([i]);
+        frames.push([framePath, elements[i].name || elements[i].id || '']);
+        _walk(elements[i].contentWindow, framePath);
+    }
+}
+_walk(window, []);
+return frames;
+'''
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Serve the iMacros interface over HTTP/JSON, so that short-lived clients
+reuse interpreters and browsers kept alive by a daemon.
+
+    POST   /sessions                create a session, returns {"session": id}
+    POST   /sessions/<id>/<method>  call an Interface method with a JSON list
+                                    of arguments, returns {"result": value}
+    DELETE /sessions/<id>           exit browser and drop the session
+    GET    /stats                   sessions and queue counters
+
+Calls of a session are played one at a time in request order.  At most
+workers calls of all sessions run concurrently and others wait for a slot;
+once max_pending calls are waiting or running, new calls are refused with
+503, so that clients back off instead of piling up.
+
+Macros read and write files, so every request must carry the token of the
+server in an X-Token header, and POST requests a JSON Content-Type, which
+browsers never send cross-origin without asking first.  The token is read
+from SELENIUMACROS_TOKEN or --token-file, or generated into a file private
+to the user, where RemoteInterface of the same user finds it.  Addresses
+other than loopback are only served with a token given by the user.
+
+    $ python server.py --port 8780 --workers 8
+'''
+
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import uuid
+import errno
+import binascii
+import logging
+import optparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from interface import Interface
+from pool import DriverPool
+from multiplex import Multiplexer
+import cachedir
+
+logger = logging.getLogger('seleniumacros')
+
+DEFAULT_PORT = 8780
+
+RE_SESSION_PATH = re.compile(r'^/sessions/([0-9a-f]+)(?:/(\w+))?$')
+
+TOKEN_ENVIRONMENT = 'SELENIUMACROS_TOKEN'
+DEFAULT_TOKEN_FILE = os.path.join(cachedir.user_cache_directory('server'), 'token')
+TOKEN_HEADER = 'X-Token'
+
+def load_token(path=None):
+    '''
+    Return token of file path if given, otherwise of SELENIUMACROS_TOKEN or
+    of the generated token file, or None if there is none.
+    '''
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read().strip() or None
+    token = os.environ.get(TOKEN_ENVIRONMENT, '').strip()
+    if token:
+        return token
+    try:
+        with open(DEFAULT_TOKEN_FILE, 'rb') as f:
+            return f.read().strip() or None
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+    return None
+
+def create_token(path=DEFAULT_TOKEN_FILE):
+    ''' Write a new random token to path readable by the user only '''
+    directory = os.path.dirname(path)
+    if not cachedir.make_private(directory):
+        raise ValueError, 'Directory of token file is not private: %s' % directory
+    token = binascii.hexlify(os.urandom(16))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(token)
+    return token
+
+def is_loopback(host):
+    '''
+    Return if only local clients could connect to host.
+
+    >>> is_loopback('127.0.0.1'), is_loopback('localhost'), is_loopback('::1')
+    (True, True, True)
+    >>> is_loopback('0.0.0.0'), is_loopback('192.168.1.5'), is_loopback('')
+    (False, False, False)
+
+    '''
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+class Busy(Exception):
+    ''' Server can not accept more requests now '''
+
+class Session(object):
+    ''' An Interface with a lock to play its calls in order '''
+
+    def __init__(self, id, interface):
+        self.id = id
+        self.interface = interface
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+class MacroServer(object):
+    '''
+    Sessions of Interface kept alive between requests.
+
+    >>> server = MacroServer(workers=1, max_pending=1)
+    >>> id = server.create_session()
+    >>> server.call(id, 'iimSet', ['NAME', 'Tom'])
+    1
+    >>> server.sessions[id].interface.bridge.variables
+    {'NAME': 'Tom'}
+    >>> server.call(id, 'iimGetLastError', [])
+    Traceback (most recent call last):
+    ...
+    IndexError: deque index out of range
+    >>> server.call(id, 'reset', [])
+    Traceback (most recent call last):
+    ...
+    ValueError: Method reset is not allowed
+    >>> server.close_session(id)
+    >>> server.stats()['sessions']
+    0
+    >>> server.close()
+
+    Idle sessions are closed in background, even if no request comes:
+
+    >>> server = MacroServer(session_timeout=0.1, reap_interval=0.1)
+    >>> id = server.create_session()
+    >>> time.sleep(0.5)
+    >>> server.stats()['sessions']
+    0
+    >>> server.close()
+
+    '''
+
+    # Interface methods clients could call
+    METHODS = ('iimInit', 'iimPlay', 'iimSet', 'iimDisplay', 'iimExit',
+            'iimGetLastError', 'iimGetLastExtract', 'iimGetLastPerformance')
+
+    def __init__(self, workers=4, max_pending=64, max_sessions=32,
+            session_timeout=3600, pool=None, reap_interval=60):
+        # Number of calls running concurrently
+        self.workers = threading.Semaphore(workers)
+        # Number of calls running or waiting, more are refused
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        # Seconds before an idle session is closed
+        self.session_timeout = session_timeout
+        # DriverPool or Multiplexer shared by sessions, so that browsers
+        # outlive sessions
+        self.pool = pool
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.counters = dict.fromkeys(('calls', 'refused', 'errors'), 0)
+        # Close idle sessions every reap_interval seconds
+        self.closed = threading.Event()
+        self.reaper = threading.Thread(target=self._reap, args=(reap_interval,),
+                name='MacroServer-reaper')
+        self.reaper.daemon = True
+        self.reaper.start()
+
+    def create_session(self):
+        self.close_idle_sessions()
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                self.counters['refused'] += 1
+                raise Busy, 'Too many sessions'
+            id = uuid.uuid4().hex
+            self.sessions[id] = Session(id, Interface(self.pool))
+        logger.info(u'Created session %s' % id)
+        return id
+
+    def close_session(self, id):
+        with self.lock:
+            session = self.sessions.pop(id, None)
+        if session is None:
+            raise KeyError, id
+        with session.lock:
+            session.interface.iimExit()
+        logger.info(u'Closed session %s' % id)
+
+    def close_idle_sessions(self):
+        deadline = time.time() - self.session_timeout
+        with self.lock:
+            ids = [id for id, session in self.sessions.items()
+                    if session.last_used < deadline and not session.lock.locked()]
+        for id in ids:
+            try:
+                self.close_session(id)
+            except KeyError:
+                pass
+
+    def call(self, id, method, args):
+        ''' Call method of Interface of session id '''
+        if method not in self.METHODS:
+            raise ValueError, 'Method %s is not allowed' % method
+        session = self.sessions.get(id)
+        if session is None:
+            raise KeyError, id
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.counters['refused'] += 1
+                raise Busy, 'Too many pending calls'
+            self.pending += 1
+            self.counters['calls'] += 1
+        try:
+            with session.lock:
+                with self.workers:
+                    session.last_used = time.time()
+                    try:
+                        return getattr(session.interface, method)(*args)
+                    except Exception:
+                        with self.lock:
+                            self.counters['errors'] += 1
+                        raise
+                    finally:
+                        session.last_used = time.time()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['sessions'] = len(self.sessions)
+            stats['pending'] = self.pending
+        return stats
+
+    def close(self):
+        self.closed.set()
+        self.reaper.join()
+        for id in list(self.sessions):
+            try:
+                self.close_session(id)
+            except Exception, e:
+                logger.warn(u'Can not close session %s: %s' % (id, e))
+
+    def _reap(self, interval):
+        while not self.closed.wait(interval):
+            try:
+                self.close_idle_sessions()
+            except Exception, e:
+                logger.warn(u'Can not close idle sessions: %s' % e)
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    ''' Map HTTP requests to MacroServer calls '''
+
+    # Keep connections alive, so that clients pay one connect per session
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if not self._authorized(json_body=True):
+            return
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        body = self.rfile.read(length) if length else ''
+        server = self.server.macro_server
+        if self.path == '/sessions':
+            self._run(lambda: {'session': server.create_session()})
+            return
+        match = RE_SESSION_PATH.match(self.path)
+        if not match or not match.group(2):
+            self._reply(404, {'error': 'Not found'})
+            return
+        try:
+            args = json.loads(body) if body else []
+            if not isinstance(args, list):
+                raise ValueError, 'Arguments must be a list'
+        except ValueError, e:
+            self._reply(400, {'error': unicode(e)})
+            return
+        self._run(lambda: {'result': self._jsonable(
+                server.call(match.group(1), match.group(2), args))})
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        match = RE_SESSION_PATH.match(self.path)
+        if not match or match.group(2):
+            self._reply(404, {'error': 'Not found'})
+            return
+        server = self.server.macro_server
+        self._run(lambda: server.close_session(match.group(1)) or {})
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == '/stats':
+            self._reply(200, self.server.macro_server.stats())
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        logger.debug(u'Server: ' + format % args)
+
+    def _authorized(self, json_body=False):
+        ''' Reply with an error and return False if request is refused '''
+        error = None
+        token = self.headers.get(TOKEN_HEADER) or ''
+        if json_body and self.headers.get('Content-Type', '').split(';')[0] \
+                .strip().lower() != 'application/json':
+            status, error = 415, 'Content-Type must be application/json'
+        elif not hmac.compare_digest(token, self.server.token):
+            status, error = 403, 'Invalid token'
+        if error is None:
+            return True
+        # Body is not read, so the connection could not be reused
+        self.close_connection = 1
+        self._reply(status, {'error': error}, [('Connection', 'close')])
+        return False
+
+    def _run(self, func):
+        try:
+            data = func()
+        except Busy, e:
+            self._reply(503, {'error': unicode(e)}, [('Retry-After', '1')])
+        except KeyError, e:
+            self._reply(404, {'error': u'No such session: %s' % e.args[0]})
+        except (ValueError, TypeError, IndexError), e:
+            self._reply(400, {'error': unicode(e)})
+        except Exception, e:
+            logger.exception(e)
+            self._reply(500, {'error': unicode(e)})
+        else:
+            self._reply(200, data)
+
+    def _reply(self, status, data, headers=()):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _jsonable(self, value):
+        # Errors are returned as exceptions by iimGetLastError
+        if isinstance(value, (list, tuple)):
+            return [self._jsonable(item) for item in value]
+        if isinstance(value, Exception):
+            return unicode(value)
+        return value
+
+def serve(macro_server, host='127.0.0.1', port=DEFAULT_PORT, token=None):
+    '''
+    Return a started HTTP server of macro_server, serving requests with
+    token.  Token is generated for loopback hosts if it is None.
+
+    >>> import httplib
+    >>> macro_server = MacroServer()
+    >>> http_server = serve(macro_server, port=0, token='secret')
+    >>> thread = threading.Thread(target=http_server.serve_forever)
+    >>> thread.daemon = True
+    >>> thread.start()
+    >>> def post(path, headers):
+    ...     connection = httplib.HTTPConnection('127.0.0.1', http_server.server_port)
+    ...     connection.request('POST', path, '[]', headers)
+    ...     response = connection.getresponse()
+    ...     response.read()
+    ...     connection.close()
+    ...     return response.status
+    >>> post('/sessions', {'Content-Type': 'text/plain', 'X-Token': 'secret'})
+    415
+    >>> post('/sessions', {'Content-Type': 'application/json', 'X-Token': 'guess'})
+    403
+    >>> post('/sessions', {'Content-Type': 'application/json', 'X-Token': 'secret'})
+    200
+    >>> http_server.shutdown()
+    >>> macro_server.close()
+    >>> serve(macro_server, '0.0.0.0', 0)
+    Traceback (most recent call last):
+    ...
+    ValueError: Refusing to serve 0.0.0.0 without a token
+
+    '''
+    if token is None:
+        if not is_loopback(host):
+            raise ValueError, 'Refusing to serve %s without a token' % host
+        token = load_token() or create_token()
+    http_server = _Server((host, port), _Handler)
+    http_server.macro_server = macro_server
+    http_server.token = token
+    return http_server
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-H', '--host', default='127.0.0.1',
+            help='address to listen on, other than loopback requires a token '
+            '[default: %default]')
+    parser.add_option('-p', '--port', type='int', default=DEFAULT_PORT,
+            help='port to listen on [default: %default]')
+    parser.add_option('-w', '--workers', type='int', default=4,
+            help='calls played concurrently [default: %default]')
+    parser.add_option('-q', '--max-pending', type='int', default=64,
+            help='calls running or waiting before 503 [default: %default]')
+    parser.add_option('-s', '--max-sessions', type='int', default=32,
+            help='sessions kept at once [default: %default]')
+    parser.add_option('-t', '--session-timeout', type='int', default=3600,
+            help='seconds before idle sessions are closed [default: %default]')
+    parser.add_option('-P', '--pool-size', type='int', default=0,
+            help='idle browsers kept for new sessions [default: %default]')
+    parser.add_option('-u', '--max-uses', type='int', default=1,
+            help='sessions a pooled browser is used for, more share cookies '
+            'of sites visited before [default: %default]')
+    parser.add_option('-m', '--multiplex', type='int', default=0, metavar='N',
+            help='play up to N sessions in windows of one browser')
+    parser.add_option('-T', '--token-file', metavar='FILE',
+            help='file of the token clients send, instead of %s' % TOKEN_ENVIRONMENT)
+    options, args = parser.parse_args(argv)
+    if options.token_file:
+        token = load_token(options.token_file)
+    else:
+        token = os.environ.get(TOKEN_ENVIRONMENT, '').strip() or None
+    if token is None and not is_loopback(options.host):
+        parser.error('--host %s requires --token-file or %s' % (options.host,
+                TOKEN_ENVIRONMENT))
+
+    if options.multiplex > 0:
+        pool = Multiplexer(options.multiplex)
+    elif options.pool_size > 0:
+        pool = DriverPool(options.pool_size, options.max_uses)
+    else:
+        pool = None
+    macro_server = MacroServer(options.workers, options.max_pending,
+            options.max_sessions, options.session_timeout, pool)
+    http_server = serve(macro_server, options.host, options.port, token)
+    logger.info(u'Serving on %s:%d' % http_server.server_address)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        macro_server.close()
+        if pool is not None:
+            pool.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
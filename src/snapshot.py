@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Store of browser sessions saved at CHECKPOINT commands.
+
+A snapshot holds cookies, local and session storage, URL and variables of
+a macro at a named checkpoint.  Later runs of the macro with the same user
+variables restore it and continue after the checkpoint instead of playing
+the commands before it, e.g. logging in.
+
+Snapshots contain session cookies, and restoring one sets cookies, URL
+and builtin variables of the session, so the store is only used if it is
+private to the current user.
+'''
+
+import os
+import json
+import time
+import errno
+import hashlib
+import logging
+import tempfile
+import cachedir
+
+logger = logging.getLogger('seleniumacros')
+
+DEFAULT_DIRECTORY = cachedir.user_cache_directory('snapshots')
+DEFAULT_TTL = 3600
+
+def snapshot_key(path, name, variables):
+    '''
+    Key of snapshot of macro at path and checkpoint name, played with user
+    variables.
+
+    >>> snapshot_key('login.iim', 'home', {'USER': 'tom'}) == \\
+    ...         snapshot_key('login.iim', 'home', {'USER': 'tom'})
+    True
+    >>> snapshot_key('login.iim', 'home', {'USER': 'tom'}) == \\
+    ...         snapshot_key('login.iim', 'home', {'USER': 'ann'})
+    False
+
+    '''
+    data = json.dumps([os.path.abspath(path or ''), name,
+            sorted((unicode(k), unicode(v)) for k, v in variables.items())])
+    return hashlib.sha1(data).hexdigest()
+
+class SnapshotStore(object):
+    '''
+    Snapshots on disk, which expire after their TTL.
+
+    >>> import shutil
+    >>> store = SnapshotStore(tempfile.mkdtemp())
+    >>> store.put('k', {'url': 'http://a.com/'}, ttl=60)
+    >>> store.get('k')['url']
+    u'http://a.com/'
+    >>> store.invalidate('k')
+    >>> store.get('k')
+    >>> store.put('k', {'url': 'http://a.com/'}, ttl=-1)
+    >>> store.get('k')
+    >>> shutil.rmtree(store.directory)
+
+    Snapshots of directories other users could write to are never loaded:
+
+    >>> store = SnapshotStore(tempfile.mkdtemp())
+    >>> store.put('k', {'url': 'http://a.com/'})
+    >>> os.chmod(store.directory, 0777)
+    >>> SnapshotStore(store.directory).get('k')
+    >>> shutil.rmtree(store.directory)
+
+    '''
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        # If directory is private to the user, checked on first use
+        self.private = None
+
+    def get(self, key):
+        ''' Return snapshot of key, or None if it is missing or expired '''
+        if not self._usable():
+            return None
+        try:
+            with open(self._filename(key), 'rb') as f:
+                data = json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                logger.warn(u'Can not read snapshot: %s' % e)
+            return None
+        except ValueError, e:
+            logger.warn(u'Can not load snapshot: %s' % e)
+            self.invalidate(key)
+            return None
+        if data['expires'] < time.time():
+            self.invalidate(key)
+            return None
+        return data['snapshot']
+
+    def put(self, key, snapshot, ttl=DEFAULT_TTL):
+        if not self._usable():
+            return
+        data = json.dumps({'expires': time.time() + ttl, 'snapshot': snapshot})
+        try:
+            # mkstemp creates files readable by owner only
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp, self._filename(key))
+        except (IOError, OSError), e:
+            logger.warn(u'Can not write snapshot: %s' % e)
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def _usable(self):
+        if self.private is None:
+            self.private = cachedir.make_private(self.directory)
+        return self.private
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+default_store = SnapshotStore()
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
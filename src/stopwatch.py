@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import csv
+import time
+import clock
+
+class Performance(object):
+    '''
+    Runtime of every command and STOPWATCH data of a macro run.
+
+    >>> performance = Performance('demo.iim', started=0)
+    >>> performance.start('login', now=1)
+    >>> performance.stop('login', now=3.5)
+    2.5
+    >>> performance.toggle('total', now=4)
+    >>> performance.toggle('total', now=5)
+    1
+    >>> performance.label('end', now=6)
+    6
+    >>> performance.record_command(3, 'TAG', 0.25)
+    >>> performance.record_command(4, 'TAG', 6.0, failed=True)
+    >>> performance.finish(now=7)
+    >>> performance.get(1)
+    (True, 'TOTAL', '7.000')
+    >>> performance.get(2), performance.get(4)
+    ((True, 'login', '2.500'), (True, 'end', '6.000'))
+    >>> performance.get(5), performance.get(6)
+    ((True, u'L3 TAG', '0.250'), (True, u'L4 TAG FAILED', '6.000'))
+    >>> performance.get(7)
+    (False, '', '')
+
+    '''
+
+    def __init__(self, name=None, started=None):
+        self.name = name
+        self.started = clock.monotonic() if started is None else started
+        self.total = None
+        # List of (line, command name, seconds, failed), where seconds leave
+        # out waiting of !REPLAYSPEED
+        self.commands = []
+        # Started stopwatches by id
+        self.running = {}
+        # List of (id, seconds) in the order stopwatches are stopped
+        self.records = []
+        # List of (url, seconds) of pages loaded by URL GOTO
+        self.page_loads = []
+        # List of (line, seconds lost) of failures recovered by retry policy
+        self.retries = []
+        # List of (url, action) of page loads skipped or refreshed instead
+        self.avoided_loads = []
+        # List of (path, seconds macro was held up) of screenshots taken
+        self.screenshots = []
+
+    def record_command(self, line, name, seconds, failed=False):
+        self.commands.append((line, name, seconds, failed))
+
+    def command_records(self):
+        ''' Return (id, seconds) of commands, e.g. ('L12 TAG', 0.25) '''
+        return [(u'L%d %s%s' % (line, name, u' FAILED' if failed else u''), seconds)
+                for line, name, seconds, failed in self.commands]
+
+    def record_page_load(self, url, seconds):
+        self.page_loads.append((url, seconds))
+
+    def page_load_time(self):
+        '''
+        Return number of pages loaded and seconds spent loading them.
+
+        >>> performance = Performance()
+        >>> performance.record_page_load('http://a.com/', 0.5)
+        >>> performance.record_page_load('http://b.com/', 1.5)
+        >>> performance.page_load_time()
+        (2, 2.0)
+
+        '''
+        return len(self.page_loads), sum(seconds for url, seconds in self.page_loads)
+
+    def record_avoided_load(self, url, action):
+        self.avoided_loads.append((url, action))
+
+    def avoided_load_count(self):
+        '''
+        Return number of page loads skipped and refreshed instead.
+
+        >>> performance = Performance()
+        >>> performance.record_avoided_load('http://a.com/', 'skip')
+        >>> performance.record_avoided_load('http://a.com/', 'refresh')
+        >>> performance.record_avoided_load('http://a.com/', 'skip')
+        >>> performance.avoided_load_count()
+        (2, 1)
+
+        '''
+        actions = [action for url, action in self.avoided_loads]
+        return actions.count('skip'), actions.count('refresh')
+
+    def record_screenshot(self, path, seconds):
+        self.screenshots.append((path, seconds))
+
+    def record_retry(self, line, seconds):
+        self.retries.append((line, seconds))
+
+    def retry_time(self):
+        '''
+        Return number of retries and seconds lost by them, i.e. spent on
+        replayed commands and restarting driver.
+
+        >>> performance = Performance()
+        >>> performance.record_retry(12, 3.0)
+        >>> performance.retry_time()
+        (1, 3.0)
+
+        '''
+        return len(self.retries), sum(seconds for line, seconds in self.retries)
+
+    def start(self, id, now=None):
+        if id in self.running:
+            raise ValueError, u'Stopwatch %s is already started' % id
+        self.running[id] = clock.monotonic() if now is None else now
+
+    def stop(self, id, now=None):
+        if id not in self.running:
+            raise ValueError, u'Stopwatch %s is not started' % id
+        now = clock.monotonic() if now is None else now
+        seconds = now - self.running.pop(id)
+        self.records.append((id, seconds))
+        return seconds
+
+    def toggle(self, id, now=None):
+        ''' Start stopwatch, or stop it if it is started '''
+        if id in self.running:
+            return self.stop(id, now)
+        self.start(id, now)
+
+    def label(self, id, now=None):
+        ''' Record seconds since macro started '''
+        now = clock.monotonic() if now is None else now
+        seconds = now - self.started
+        self.records.append((id, seconds))
+        return seconds
+
+    def finish(self, now=None):
+        now = clock.monotonic() if now is None else now
+        self.total = now - self.started
+
+    def get(self, index=1):
+        '''
+        Return tuple of data presence, stopwatch name and seconds.
+        Total runtime for index 1, stopwatch records from index 2, followed
+        by commands played.
+        '''
+        if index <= 1:
+            if self.total is None:
+                return False, '', ''
+            return True, 'TOTAL', '%.3f' % self.total
+        records = self.records + self.command_records()
+        if index - 2 < len(records):
+            id, seconds = records[index - 2]
+            return True, id, '%.3f' % seconds
+        return False, '', ''
+
+    def write_csv(self, path, header=False):
+        ''' Append stopwatch records and commands to a CSV file like iMacros '''
+        exists = os.path.exists(path)
+        with open(path, 'ab') as f:
+            writer = csv.writer(f)
+            if header and not exists:
+                writer.writerow(['Date', 'Time', 'Macro', 'ID', 'Seconds'])
+            date, now = time.strftime('%Y/%m/%d'), time.strftime('%H:%M:%S')
+            name = os.path.basename(self.name or '')
+            for id, seconds in self.records + self.command_records():
+                writer.writerow([date, now, name.encode('utf-8'),
+                        id.encode('utf-8'), '%.3f' % seconds])
+            if self.total is not None:
+                writer.writerow([date, now, name.encode('utf-8'), 'TOTAL',
+                        '%.3f' % self.total])
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+Count and time WebDriver wire protocol calls caused by macro lines.
+
+Tracing is opt-in.  A Tracer replaces execute() of the driver instance, which
+every driver and element call goes through, so untraced drivers are not
+touched at all.  Sessions of multiplex.SharedDriver are traced on the
+shared driver, where elements send their calls, and record only calls made
+while the driver is on a window of their own.
+
+    >>> tracer = Tracer()
+    >>> imacros = Interface(tracer=tracer) # doctest: +SKIP
+    >>> tracer.export_chrome_trace('trace.json') # doctest: +SKIP
+
+'''
+
+import os
+import json
+import clock
+
+def _listeners(driver):
+    '''
+    Return {(tracer, session): accepts} of tracers recording calls of
+    driver, whose execute is replaced on first call.
+    '''
+    listeners = vars(driver).get('_tracing_listeners')
+    if listeners is not None:
+        return listeners
+    listeners = driver._tracing_listeners = {}
+    execute = driver.execute
+
+    def traced(driver_command, params=None):
+        started = clock.monotonic()
+        try:
+            return execute(driver_command, params)
+        finally:
+            seconds = clock.monotonic() - started
+            for (tracer, session), accepts in listeners.items():
+                if accepts():
+                    tracer.record(driver_command, started, seconds)
+
+    driver.execute = traced
+    return listeners
+
+class Tracer(object):
+    '''
+    Record wire calls of attached drivers.
+
+    >>> class Driver(object):
+    ...     def execute(self, command, params=None):
+    ...         return {'value': command}
+    >>> driver, tracer = Driver(), Tracer()
+    >>> tracer.attach(driver)
+    >>> tracer.enter(3, 'TAG')
+    >>> driver.execute('findElements')['value']
+    'findElements'
+    >>> driver.execute('clickElement')['value']
+    'clickElement'
+    >>> [(line, command, wire) for started, seconds, wire, line, command in tracer.events]
+    [(3, 'TAG', 'findElements'), (3, 'TAG', 'clickElement')]
+    >>> tracer.counters['findElements'][0], tracer.lines[(3, 'TAG')][0]
+    (1, 2)
+    >>> tracer.leave()
+    >>> driver.execute('getTitle')['value']
+    'getTitle'
+    >>> tracer.events[-1][2:]
+    ('getTitle', None, None)
+    >>> tracer.detach(driver)
+    >>> driver.execute('findElements')['value'], len(tracer.events)
+    ('findElements', 3)
+
+    '''
+
+    def __init__(self, max_events=100000):
+        self.max_events = max_events
+        self.origin = clock.monotonic()
+        self.line = None
+        self.command = None
+        self.clear()
+
+    def clear(self):
+        # List of (started, seconds, wire command, line, macro command)
+        self.events = []
+        self.dropped = 0
+        # [count, seconds] by wire command and by (line, macro command)
+        self.counters = {}
+        self.lines = {}
+
+    def attach(self, driver):
+        shared = getattr(driver, 'shared', None)
+        if shared is not None:
+            # Window session of a shared driver
+            session = driver
+            _listeners(shared.driver)[self, session] = \
+                    lambda: shared.active in session.handles
+        else:
+            _listeners(driver)[self, None] = lambda: True
+
+    def detach(self, driver):
+        shared = getattr(driver, 'shared', None)
+        key = (self, driver) if shared is not None else (self, None)
+        target = shared.driver if shared is not None else driver
+        listeners = vars(target).get('_tracing_listeners')
+        if listeners is None:
+            return
+        listeners.pop(key, None)
+        if not listeners:
+            del target.execute
+            del target._tracing_listeners
+
+    def enter(self, line, command):
+        ''' Attribute following calls to a macro line '''
+        self.line = line
+        self.command = command
+
+    def leave(self):
+        ''' Attribute following calls to no macro line '''
+        self.line = None
+        self.command = None
+
+    def record(self, wire_command, started, seconds):
+        if len(self.events) < self.max_events:
+            self.events.append((started - self.origin, seconds, wire_command,
+                    self.line, self.command))
+        else:
+            self.dropped += 1
+        for counters, key in ((self.counters, wire_command),
+                (self.lines, (self.line, self.command))):
+            counter = counters.get(key)
+            if counter is None:
+                counter = counters[key] = [0, 0.0]
+            counter[0] += 1
+            counter[1] += seconds
+
+    def summary(self):
+        ''' Return list of (line, command, calls, seconds) by line '''
+        return sorted((line, command, calls, seconds) for (line, command),
+                (calls, seconds) in self.lines.items())
+
+    def export_jsonl(self, path):
+        ''' Write one JSON object per wire call '''
+        with open(path, 'wb') as f:
+            for started, seconds, wire_command, line, command in self.events:
+                f.write(json.dumps({
+                    'ts':      started,
+                    'dur':     seconds,
+                    'call':    wire_command,
+                    'line':    line,
+                    'command': command,
+                }) + '\n')
+
+    def export_chrome_trace(self, path):
+        ''' Write events in Chrome trace format for chrome://tracing '''
+        pid = os.getpid()
+        events = [{
+            'name': wire_command,
+            'cat':  'webdriver',
+            'ph':   'X',
+            'ts':   int(started * 1e6),
+            'dur':  int(seconds * 1e6),
+            'pid':  pid,
+            'tid':  line or 0,
+            'args': {'line': line, 'command': command},
+        } for started, seconds, wire_command, line, command in self.events]
+        with open(path, 'wb') as f:
+            json.dump({'traceEvents': events, 'otherData': {
+                'dropped':  self.dropped,
+                'counters': self.counters,
+            }}, f)
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()
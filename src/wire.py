@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''
+WebDriver wire protocol client over kept alive connections.
+
+Selenium opens a new TCP connection for every command by default, which
+costs a connect per round trip.  KeepAliveConnection sends commands over
+connections kept in a ConnectionPool by driver endpoint, so that drivers and
+threads talking to the same endpoint reuse them.
+'''
+
+import socket
+import httplib
+import logging
+import threading
+import urlparse
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+from selenium.webdriver.remote.errorhandler import ErrorCode
+from selenium.webdriver.remote import utils
+
+logger = logging.getLogger('seleniumacros')
+
+class ConnectionPool(object):
+    '''
+    Idle HTTP connections by endpoint, at most max_idle for each.
+
+    >>> import BaseHTTPServer, threading
+    >>> class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    ...     protocol_version = 'HTTP/1.1'
+    ...     def do_GET(self):
+    ...         self.send_response(200)
+    ...         self.send_header('Content-Length', '2')
+    ...         self.end_headers()
+    ...         self.wfile.write('{}')
+    ...     def log_message(self, *args):
+    ...         pass
+    >>> server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    >>> thread = threading.Thread(target=server.serve_forever)
+    >>> thread.daemon = True
+    >>> thread.start()
+    >>> pool = ConnectionPool()
+    >>> for i in range(3):
+    ...     status, headers, data = pool.request('127.0.0.1', server.server_port, 'GET', '/')
+    >>> status, data, pool.connects, pool.reuses
+    (200, '{}', 1, 2)
+    >>> pool.close()
+    >>> server.shutdown()
+
+    '''
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+        # Connections opened and requests sent over reused ones
+        self.connects = 0
+        self.reuses = 0
+
+    def request(self, host, port, method, path, body=None, headers={},
+            timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        ''' Send a request, return status, headers and body of response '''
+        endpoint = (host, port)
+        # A kept alive connection closed by server is opened again once.
+        # Requests over new connections are never sent twice
+        for attempt in range(2):
+            connection, reused = self._acquire(endpoint, timeout)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except socket.timeout:
+                connection.close()
+                raise
+            except (httplib.BadStatusLine, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                continue
+            except:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(endpoint, connection)
+            return response.status, dict(response.getheaders()), data
+
+    def close(self):
+        with self.lock:
+            connections = [c for idle in self.idle.values() for c in idle]
+            self.idle = {}
+        for connection in connections:
+            connection.close()
+
+    def _acquire(self, endpoint, timeout):
+        with self.lock:
+            idle = self.idle.get(endpoint)
+            if idle:
+                self.reuses += 1
+                return idle.pop(), True
+            self.connects += 1
+        host, port = endpoint
+        return httplib.HTTPConnection(host, port, timeout=timeout), False
+
+    def _release(self, endpoint, connection):
+        with self.lock:
+            idle = self.idle.setdefault(endpoint, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+default_pool = ConnectionPool()
+
+class KeepAliveConnection(RemoteConnection):
+    ''' RemoteConnection which sends commands over pooled connections '''
+
+    def __init__(self, remote_server_addr, pool=None, commands=None):
+        RemoteConnection.__init__(self, remote_server_addr, resolve_ip=False)
+        self.pool = pool or default_pool
+        if commands is not None:
+            # Commands added by drivers, e.g. of Chrome
+            self._commands = commands
+
+    def _request(self, method, url, body=None):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != 'http' or parts.username:
+            return RemoteConnection._request(self, method, url, body)
+        if method not in ('POST', 'PUT'):
+            body = None
+        headers = {
+            'Connection': 'keep-alive',
+            'Content-Type': 'application/json;charset=UTF-8',
+            'Accept': 'application/json',
+        }
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        status, response_headers, data = self.pool.request(parts.hostname,
+                parts.port or 80, method, path, body, headers, self._timeout)
+        # Same handling of responses as RemoteConnection
+        if 300 <= status < 304:
+            return self._request('GET', urlparse.urljoin(url,
+                    response_headers.get('location')))
+        body = data.decode('utf-8').replace('\x00', '').strip()
+        if 399 < status <= 500:
+            return {'status': status, 'value': body}
+        if response_headers.get('content-type', '').startswith('image/png'):
+            return {'status': ErrorCode.SUCCESS, 'value': body}
+        try:
+            data = utils.load_json(body)
+        except ValueError:
+            status = ErrorCode.SUCCESS if 199 < status < 300 else ErrorCode.UNKNOWN_ERROR
+            return {'status': status, 'value': body}
+        if 'value' not in data:
+            data['value'] = None
+        return data
+
+def keep_alive(driver, pool=None):
+    '''
+    Send commands of a Selenium driver over kept alive connections.  Other
+    drivers, and legacy Firefox driver whose extension closes connections
+    anyway, are left as they are.
+    '''
+    executor = getattr(driver, 'command_executor', None)
+    if type(executor) is KeepAliveConnection or \
+            not isinstance(executor, RemoteConnection) or \
+            executor.__class__.__name__ == 'ExtensionConnection':
+        return
+    driver.command_executor = KeepAliveConnection(executor._url, pool,
+            executor._commands)
+
+if __name__ == '__main__':
+    import  doctest
+    doctest.testmod()